@@ -31,7 +31,27 @@ INDEX_CONFIG = {
                     "bulk": {
                         "chunk_size": 500,  # 500 by default
                         "max_chunk_bytes": 104857600  # 100Mb by default
-                    }
+                    },
+                    # "index"/"purge" modes, see hub.dataindex.bulk.DEFAULT_BULK_ARGS
+                    "adaptive_bulk": {
+                        "target_bytes": 10485760,  # 10Mb per bulk request
+                        "max_concurrency": 4,  # concurrent bulk requests per indexing process
+                    },
+                    # route variants by chromosome (then set ES_QUERY_BUILDER accordingly in config_web),
+                    # optionally spreading each chromosome over `partition_size` shards, see utils.routing
+                    "routing": {
+                        "chrom": False,
+                        "partition_size": 1,
+                    },
+                    # sort indices by genomic key (position order), see utils.genomickey. Off until its
+                    # query latency and index size are benchmarked against an unsorted index
+                    "index_sort": False,
+                    # slim index of the most requested fields, built after indexing (then set ES_QUERY_BACKEND
+                    # accordingly in config_web), see utils.slim
+                    "slim": {
+                        "enabled": False,
+                        # "fields": [...],  # utils.slim.DEFAULT_SLIM_FIELDS by default
+                    },
             },
             "index": [
                 # keys match build_config_key value
@@ -51,7 +71,27 @@ INDEX_CONFIG = {
                     "bulk": {
                         "chunk_size": 500,  # 500 by default
                         "max_chunk_bytes": 104857600  # 100Mb by default
-                    }
+                    },
+                    # "index"/"purge" modes, see hub.dataindex.bulk.DEFAULT_BULK_ARGS
+                    "adaptive_bulk": {
+                        "target_bytes": 10485760,  # 10Mb per bulk request
+                        "max_concurrency": 4,  # concurrent bulk requests per indexing process
+                    },
+                    # route variants by chromosome (then set ES_QUERY_BUILDER accordingly in config_web),
+                    # optionally spreading each chromosome over `partition_size` shards, see utils.routing
+                    "routing": {
+                        "chrom": False,
+                        "partition_size": 1,
+                    },
+                    # sort indices by genomic key (position order), see utils.genomickey. Off until its
+                    # query latency and index size are benchmarked against an unsorted index
+                    "index_sort": False,
+                    # slim index of the most requested fields, built after indexing (then set ES_QUERY_BACKEND
+                    # accordingly in config_web), see utils.slim
+                    "slim": {
+                        "enabled": False,
+                        # "fields": [...],  # utils.slim.DEFAULT_SLIM_FIELDS by default
+                    },
             },
             "index": [
                 # "hg19/hg38" are flags used to filter compatible index from the UI
@@ -267,3 +307,19 @@ MAX_REF_ALT_LEN = 10000
 
 # max length for _id field
 MAX_ID_LENGTH = 512
+
+# Folder where uploaders of the biggest sources also write their documents as sorted runs (one sub-folder per
+# collection), for builders to merge them from their runs (see utils.sortedruns). Defaults to
+# "<DATA_ARCHIVE_ROOT>/sorted_runs" when None, set to False to disable.
+SORTED_RUNS_FOLDER = None
+
+# Folder of the rsid indices of the dbSNP collections, one sub-folder per assembly, built once per dbSNP release and
+# shared by the sources resolving rsids (see utils.rsid). Defaults to "<DATA_ARCHIVE_ROOT>/rsid_index" when None.
+RSID_INDEX_FOLDER = None
+
+# Export and upload the id filter of indices when they're published, next to their _ids ("<hg19|hg38>.idfilter"
+# redirections must exist in IDS_S3_BUCKET, like the "_ids.xz" ones), and extend it when they're synced,
+# see utils.idfilter (about 3 hours per billion documents to export)
+ID_FILTER_EXPORT = False
+# false positive rate of the id filters (about 10 bits per id for 1%)
+ID_FILTER_ERROR_RATE = 0.01
@@ -16,6 +16,11 @@ ES_INDICES = {
     "hg19": "myvariant_current_hg19",
     "hg38": "myvariant_current_hg38",
 }
+# per-gene variant summaries, indexed by the hub as "<variant index>_gene_summary"
+ES_GENE_SUMMARY_INDICES = {
+    "hg19": "myvariant_current_hg19_gene_summary",
+    "hg38": "myvariant_current_hg38_gene_summary",
+}
 
 # *****************************************************************************
 # App URL Patterns
@@ -32,6 +37,7 @@ APP_LIST = [
     (r"/{pre}/metadata/?", "web.handlers.MVMetadataSourceHandler"),
     (r"/{pre}/{ver}/metadata/fields/?", "web.handlers.MVMetadataFieldHandler"),
     (r"/{pre}/{ver}/metadata/?", "web.handlers.MVMetadataSourceHandler"),
+    (r"/{pre}/{ver}/gene-summary/([^/]+)/?", "web.handlers.GeneSummaryHandler"),
     (r"/beacon/query?", "web.beacon.handlers.BeaconHandler"),
     (r"/beacon/info", "web.beacon.handlers.BeaconInfoHandler"),
 ]
@@ -39,7 +45,18 @@ APP_LIST = [
 # ES Query Pipeline
 # *****************************************************************************
 ES_QUERY_BUILDER = "web.pipeline.MVQueryBuilder"
+# when the indices are routed by chromosome (the "routing" option of the indexer in config_hub)
+# ES_QUERY_BUILDER = "web.pipeline.ChromRoutingQueryBuilder"
+# to return narrow projections of scalar fields (e.g. fields=cadd.phred) from doc values, see utils.docvalues
+# ES_QUERY_BUILDER = "web.pipeline.DocValueQueryBuilder"
 ES_QUERY_BACKEND = "web.pipeline.MVQueryBackend"
+# when the indices have slim indices (the "slim" option of the indexer in config_hub)
+# ES_QUERY_BACKEND = "web.pipeline.SlimIndexQueryBackend"
+# to serve CADD at query time from the local tabix file instead of the index
+# (with the CADD_TABIX_FILE environment variable set), see web.lazy
+# ES_QUERY_BACKEND = "web.lazy.LazyCaddQueryBackend"
+# searches of missing ids are answered without ES when the ID_FILTER_FOLDER environment variable is set to the
+# folder of the id filters exported by the hub (ID_FILTER_EXPORT in config_hub), see utils.idfilter
 
 # *****************************************************************************
 # Analytics & Tracking
@@ -133,9 +150,12 @@ ANNOTATION_KWARGS["*"].update(ASSEMBLY_TYPEDEF)
 
 QUERY_KWARGS = copy.deepcopy(QUERY_KWARGS)
 QUERY_KWARGS["*"].update(ASSEMBLY_TYPEDEF)
+# sort values of the last hit of the previous page, to page sorted queries (e.g. interval queries in position order)
+QUERY_KWARGS["GET"]["search_after"] = {"type": list, "max": 10}
 
 METADATA_KWARGS = {"*": ASSEMBLY_TYPEDEF}
 FIELDS_KWARGS = {"*": ASSEMBLY_TYPEDEF}
+GENE_SUMMARY_KWARGS = {"*": ASSEMBLY_TYPEDEF}
 
 LICENSE_TRANSFORM = {
     "exac_nontcga": "exac",
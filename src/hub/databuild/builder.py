@@ -1,24 +1,315 @@
-import math
 import asyncio
+import os
+import re
 from functools import partial
 import datetime
 import pickle
 
-from biothings.utils.common import iter_n
-from biothings.utils.mongo import id_feeder, get_target_db, Database, Collection
 from pymongo import UpdateOne
-from biothings.hub.databuild.builder import DataBuilder
+
+from biothings.utils.common import iter_n
+from biothings.utils.mongo import get_src_db, get_target_db
+from biothings.hub.databuild.builder import BuilderException, DataBuilder, merger_worker
 from biothings.hub.databuild.backend import ShardedTargetDocMongoBackend
-import config
+from biothings.utils.backend import DocMongoBackend
+from biothings.utils.hub_db import get_src_build
+
+from hub.databuild.mapper import SetChrom
+from hub.dataload.storage import get_runs_folder
+from utils.genesummary import (GENE_SUMMARY_PROJECTION, GENE_SUMMARY_SOURCES, GENE_SUMMARY_SUFFIX,
+                               GeneSummaryAccumulator)
+from utils.genomickey import ASSEMBLIES, GENOMIC_KEY_FIELD, add_genomic_keys
+from utils.popfreq import POPFREQ_FIELD, POPFREQ_PROJECTION, POPFREQ_SOURCES, popfreq_summary
+from utils.sortedruns import CHROM_PARTITIONS, OTHER_PARTITION, has_runs, merge_sources_runs
+
+
+def partition_query(partition):
+    if partition == OTHER_PARTITION:
+        return {"_id": {"$not": re.compile("^chr(%s):" % "|".join(CHROM_PARTITIONS))}}
+    # anchored prefix regex, resolved as a range scan of the _id index
+    return {"_id": {"$regex": "^chr%s:" % partition}}
+
+
+RUNS_CHECKPOINT = "_runs"  # checkpoint key of the sources merged from sorted runs
+
+
+def get_checkpoints(target_name):
+    """
+    Checkpoints of the build of `target_name`, stored in its src_build document, see MyVariantDataBuilder.merge().
+    """
+    build = get_src_build().find_one({"_id": target_name}, {"checkpoints": 1}) or {}
+    return build.get("checkpoints", {})
+
+
+def set_checkpoint(target_name, key, value):
+    get_src_build().update_one({"_id": target_name}, {"$set": {"checkpoints.%s" % key: value}})
 
 
 class MyVariantDataBuilder(DataBuilder):
     MAX_CHROM_EX = 100000  # if chrom discrepancies found, max # of examples we keep
+    MERGE_BY_CHROM = False  # default merge mode, see merge_by_chrom()
+    MAX_PARTITION_RETRIES = 2
+    MEM_PER_DOC_FACTOR = 4  # python objects vs. BSON size, used to estimate the memory of a partition job
+    ROOT_KEYS = ("vcf", "hg19", "hg38", "observed")  # counted in the build's "_meta.stats", see post_merge_scan()
+    incremental = None  # plan of the incremental build being merged, see get_incremental_plan()
+    resume = False
 
-    def merge(self, sources=None, target_name=None, batch_size=50000, job_manager=None, **kwargs):
+    def merge(self, sources=None, target_name=None, batch_size=50000, job_manager=None, incremental=False, resume=False, **kwargs):
+        """
+        Merging progress is checkpointed in the build's src_build document ("checkpoints"): merged sources (or, for the
+        chromosome-partitioned merge, the last merged _id of each source in each partition) and completed post-merge
+        steps. With `resume`, the merge of the given `target_name` continues from its checkpoints.
+        """
         # just override default batch_size, or it consumes too much mem
+        self.incremental = None
+        self.resume = resume
+        if resume:
+            if not target_name:
+                raise BuilderException("Resuming a merge requires the 'target_name' of the interrupted build")
+            if sources is None and not incremental:
+                # passing sources explicitly, so the target collection isn't dropped
+                sources = self.build_config["sources"]
+        if incremental:
+            if sources is not None:
+                raise BuilderException("Incremental builds merge the sources which changed, 'sources' can't be given")
+            self.incremental = self.get_incremental_plan()
+            sources = self.incremental["changed"]
+            if not sources:
+                raise BuilderException("No source changed since build '%s', nothing to merge" % self.incremental["previous"]["_id"])
+            self.logger.info("Incremental build from '%s', merging changed sources %s" % (self.incremental["previous"]["_id"], sources))
         return super(MyVariantDataBuilder, self).merge(sources=sources, target_name=target_name, job_manager=job_manager, batch_size=batch_size, **kwargs)
 
+    async def merge_sources(self, source_names, steps=("merge", "post"), batch_size=100000, ids=None, job_manager=None, by_chrom=None, from_runs=False):
+        target_name = self.target_backend.target_name
+        if not self.resume:
+            self.source_backend.build.update_one({"_id": target_name}, {"$unset": {"checkpoints": ""}})
+        if self.incremental and "merge" in steps and not get_checkpoints(target_name).get("incremental"):
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "merge-incremental"
+            job = await job_manager.defer_to_thread(pinfo, partial(self.prepare_incremental, source_names))
+            await job
+            set_checkpoint(target_name, "incremental", True)
+
+        by_chrom = self.MERGE_BY_CHROM if by_chrom is None else by_chrom
+        if not (by_chrom or from_runs) or ids:
+            res = await super(MyVariantDataBuilder, self).merge_sources(source_names, steps=steps, batch_size=batch_size, ids=ids, job_manager=job_manager)
+        else:
+            res = await self.merge_by_chrom(source_names, steps=steps, batch_size=batch_size, job_manager=job_manager, from_runs=from_runs)
+
+        if self.incremental:
+            # documents of the unchanged sources were merged by the previous build
+            for src_name, cnt in self.incremental["previous_stats"].items():
+                self.merge_stats.setdefault(src_name, cnt)
+        return res
+
+    def get_incremental_plan(self):
+        """
+        Compare the source versions recorded in the latest successful build of this build configuration (its
+        "_meta.src") with the ones currently uploaded (src_dump), to find which sources changed since.
+        """
+        builds = sorted(self.source_backend.build.find({"build_config.name": self.build_name}),
+                        key=lambda build: build["started_at"], reverse=True)
+        previous = next((build for build in builds if build.get("_meta", {}).get("src")), None)
+        if previous is None:
+            raise BuilderException("No successful build found for '%s', can't build incrementally" % self.build_name)
+        if previous["_id"] not in get_target_db().list_collection_names():
+            raise BuilderException("Target collection of previous build '%s' doesn't exist anymore" % previous["_id"])
+
+        # sub-source (collection) => (main source, uploaded release)
+        releases = {}
+        for src in self.source_backend.dump.find():
+            for sub_name, job in src.get("upload", {}).get("jobs", {}).items():
+                releases[sub_name] = (src["_id"], job.get("release"))
+
+        prev_src = previous["_meta"]["src"]
+        sources = self.resolve_sources(self.build_config["sources"])
+        changed = []
+        previous_stats = {}
+        for src_name in sources:
+            main_name, release = releases.get(src_name, (None, None))
+            prev_meta = prev_src.get(main_name, {})
+            if main_name is None or prev_meta.get("version") != release:
+                changed.append(src_name)
+            elif src_name in prev_meta.get("stats", {}):
+                previous_stats[src_name] = prev_meta["stats"][src_name]
+        return {"previous": previous, "sources": sources, "changed": changed, "previous_stats": previous_stats}
+
+    def get_root_keys(self, src_name):
+        """
+        Root keys of the documents of a source, from its mapping (keys set by mappers excluded).
+        """
+        mapping = self.source_backend.get_src_master_docs().get(src_name, {}).get("mapping", {})
+        return set(mapping).difference({"_id", "chrom", "observed"})
+
+    def prepare_incremental(self, changed):
+        """
+        Fill the target collection with a (server-side) copy of the previous build's target, then remove the
+        sub-documents of the `changed` sources from it, deleting documents which had data from those sources only.
+        """
+        unchanged = [src_name for src_name in self.incremental["sources"] if src_name not in changed]
+        # so the metadata of this build also covers the sources merged by the previous one
+        for src_name in unchanged:
+            self.source_backend[src_name]
+        changed_keys = set().union(*[self.get_root_keys(src_name) for src_name in changed])
+        kept_keys = set().union(*[self.get_root_keys(src_name) for src_name in unchanged])
+        if changed_keys & kept_keys:
+            raise BuilderException("Root keys %s are shared with unchanged sources, can't build incrementally" % sorted(changed_keys & kept_keys))
+
+        tgt_db = get_target_db()
+        previous_name = self.incremental["previous"]["_id"]
+        target_name = self.target_backend.target_name
+        self.logger.info("Copying previous target '%s' to '%s'" % (previous_name, target_name))
+        tgt_db[previous_name].aggregate([{"$match": {}}, {"$out": target_name}], allowDiskUse=True)
+        if not changed_keys:
+            return
+
+        col = tgt_db[target_name]
+        touched = {"$or": [{k: {"$exists": True}} for k in sorted(changed_keys)]}
+        if kept_keys:
+            orphans = {"$and": [touched, {"$nor": [{k: {"$exists": True}} for k in sorted(kept_keys)]}]}
+        else:
+            orphans = touched
+        res = col.delete_many(orphans)
+        self.logger.info("Deleted %d documents with data from changed sources only" % res.deleted_count)
+        res = col.update_many(touched, {"$unset": {k: "" for k in changed_keys}})
+        self.logger.info("Removed %s from %d documents" % (sorted(changed_keys), res.modified_count))
+
+    def get_mapping(self, sources):
+        # an incremental build merges only the changed sources, but its mapping covers all of them
+        if self.incremental:
+            sources = self.incremental["sources"]
+        return super(MyVariantDataBuilder, self).get_mapping(sources)
+
+    async def merge_source(self, src_name, *args, **kwargs):
+        target_name = self.target_backend.target_name
+        merged = get_checkpoints(target_name).get("sources", {})
+        if self.resume and src_name in merged:
+            self.logger.info("Source '%s' already merged, skip it" % src_name)
+            return {src_name: merged[src_name]}
+        res = await super(MyVariantDataBuilder, self).merge_source(src_name, *args, **kwargs)
+        set_checkpoint(target_name, "sources.%s" % src_name, res[src_name])
+        return res
+
+    def get_source_specs(self, source_names, from_runs=False):
+        """
+        Merge parameters of each source, in merge order (root document sources first), as passed to merger_worker().
+        With `from_runs`, sources having sorted runs (see utils.sortedruns) get their "run_dir".
+        """
+        defined_root_sources = self.get_root_document_sources()
+        root_sources = sorted(set(source_names).intersection(defined_root_sources))
+        other_sources = self.merge_order(list(set(source_names).difference(root_sources)))
+        src_master = self.source_backend.master
+        specs = []
+        for src_name in root_sources + other_sources:
+            meta = src_master.find_one({"_id": src_name}) or {}
+            specs.append({
+                "src_name": src_name,
+                "col_name": self.source_backend[src_name].name,
+                "query": self.generate_document_query(src_name),
+                "mapper": self.get_mapper_for_source(src_name, init=False),
+                "cleaner": self.document_cleaner(src_name),
+                "upsert": not defined_root_sources or src_name in defined_root_sources,
+                "merger": meta.get("merger", "upsert"),
+                "merger_kwargs": meta.get("merger_kwargs"),
+                "run_dir": None,
+            })
+        runs_folder = get_runs_folder()
+        if from_runs and runs_folder:
+            for spec in specs:
+                run_dir = os.path.join(runs_folder, spec["col_name"])
+                if has_runs(run_dir):
+                    spec["run_dir"] = run_dir
+        return specs
+
+    def get_partition_sizes(self, specs):
+        """
+        Number of documents of each partition in the largest source, to schedule the largest partitions first.
+        """
+        src_db = get_src_db()
+        largest = max(specs, key=lambda spec: src_db[spec["col_name"]].estimated_document_count())
+        col = src_db[largest["col_name"]]
+        sizes = {partition: col.count_documents(partition_query(partition)) for partition in CHROM_PARTITIONS}
+        sizes[OTHER_PARTITION] = col.estimated_document_count() - sum(sizes.values())
+        return sizes
+
+    def get_partition_mem(self, specs, batch_size):
+        """
+        Estimated memory used by a partition job, which holds one batch of documents at a time.
+        """
+        src_db = get_src_db()
+        avg_size = max(src_db.command("collstats", spec["col_name"]).get("avgObjSize", 0) for spec in specs)
+        return int(batch_size * avg_size * self.MEM_PER_DOC_FACTOR)
+
+    async def merge_by_chrom(self, source_names, steps=("merge", "post"), batch_size=100000, job_manager=None, from_runs=False):
+        """
+        Chromosome-partitioned merge: the _id space is split by chromosome ("chrN:" prefix), and all the sources of
+        a partition are merged, in the usual order, by one process job. Partitions are independent, so they're merged
+        in parallel, largest first, and a failed partition is retried on its own (merging is idempotent).
+
+        With `from_runs`, the sources having sorted runs are merged from them, by a k-way merge of their runs instead
+        of reading their collections back (see partition_merger_worker()).
+        """
+        assert job_manager
+        if isinstance(steps, str):
+            steps = [steps]
+        self.merge_stats = {}
+        self.stats = {}
+        self.mapping = {}
+
+        if "merge" in steps:
+            specs = self.get_source_specs(source_names, from_runs=from_runs)
+            self.logger.info("Merging sources %s by chromosome" % [spec["src_name"] for spec in specs])
+            if from_runs:
+                self.logger.info("Merging sources %s from sorted runs" % [spec["src_name"] for spec in specs if spec["run_dir"]])
+            sizes = self.get_partition_sizes(specs)
+            mem = self.get_partition_mem(specs, batch_size)
+            self.register_status("building", transient=True, init=True, job={"step": "merge-by-chrom", "sources": source_names})
+
+            async def merge_partition(partition):
+                for attempt in range(1, self.MAX_PARTITION_RETRIES + 2):
+                    pinfo = self.get_pinfo()
+                    pinfo["step"] = "merge-by-chrom"
+                    pinfo["description"] = "partition %s (attempt %d)" % (partition, attempt)
+                    pinfo["__reqs__"] = {"mem": mem}
+                    # retries continue from the partition's checkpoints
+                    job = await job_manager.defer_to_process(
+                        pinfo, partial(partition_merger_worker, partition, specs, self.target_backend.target_name, batch_size,
+                                       resume=self.resume or attempt > 1))
+                    try:
+                        counts = await job
+                        self.logger.info("Partition %s merged: %s" % (partition, counts))
+                        return counts
+                    except Exception as e:
+                        self.logger.exception("Failed merging partition %s (attempt %d): %s" % (partition, attempt, e))
+                        if attempt > self.MAX_PARTITION_RETRIES:
+                            raise
+
+            partitions = sorted(sizes, key=lambda partition: sizes[partition], reverse=True)
+            for counts in await asyncio.gather(*[merge_partition(partition) for partition in partitions]):
+                for src_name, cnt in counts.items():
+                    self.merge_stats[src_name] = self.merge_stats.get(src_name, 0) + cnt
+            self.register_status("success", job={"step": "merge-by-chrom", "sources": source_names})
+
+            self.register_status("building", transient=True, init=True, job={"step": "finalizing"})
+            self.logger.info("Finalizing target backend")
+            self.target_backend.finalize()
+            self.register_status("success", job={"step": "finalizing"})
+        else:
+            self.logger.info("Skip data merging")
+
+        if "post" in steps:
+            self.logger.info("Running post-merge process")
+            self.register_status("building", transient=True, init=True, job={"step": "post-merge"})
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "post-merge"
+            job = await job_manager.defer_to_thread(pinfo, partial(self.post_merge, source_names, batch_size, job_manager))
+            self.logger.info("Post-merge completed [%s]" % await job)
+            self.register_status("success", job={"step": "post-merge"})
+        else:
+            self.logger.info("Skip post-merge process")
+
+        return self.merge_stats
+
     def validate_merge(self):
         # MyVariant merging either insert or updates. So we can't just count
         # the number of inserted/updated data from single colleciton and compare with
@@ -33,13 +324,19 @@ class MyVariantDataBuilder(DataBuilder):
         else:
             self.logger.warning("Total count of documents {} is greater than what was inserted/updated... {}]".format(target_cnt, total))
 
-    async def set_chrom(self, batch_size, job_manager):
-        # divide & conquer... build batches
-        jobs = []
-        total = self.target_backend.count()
-        btotal = math.ceil(total / batch_size)
-        bnum = 1
-        cnt = 0
+    def get_mapper_for_source(self, src_name, init=True):
+        # "chrom" is set while merging, by wrapping whatever mapper the source uses
+        inner = super(MyVariantDataBuilder, self).get_mapper_for_source(src_name, init=init)
+        return SetChrom(inner, report_name=self.chrom_report_name, src_name=src_name)
+
+    @property
+    def chrom_report_name(self):
+        return "%s_chrom" % self.target_backend.target_name
+
+    def collect_chrom_report(self):
+        """
+        Aggregate the 'chrom' discrepancies reported by the merge batches (see mapper.SetChrom).
+        """
         results = {
             "missing": {
                 "count": 0,
@@ -50,74 +347,149 @@ class MyVariantDataBuilder(DataBuilder):
                 "examples": []
             }
         }
-        root_keys = {}
-        # grab ids only, so we can get more and fill queue for each step
-        # each round, fill the queue to make sure every cpu slots are always working
-        id_batch_size = batch_size * job_manager.process_queue._max_workers * 2
-        self.logger.info("Fetch _ids from '%s' with batch_size=%d, and create post-merger job with batch_size=%d" % \
-                         (self.target_backend.target_collection.name, id_batch_size, batch_size))
-        for big_doc_ids in id_feeder(self.target_backend.target_collection, batch_size=id_batch_size, logger=self.logger):
-            for doc_ids in iter_n(big_doc_ids, batch_size):
-                cnt += len(doc_ids)
-                pinfo = self.get_pinfo()
-                pinfo["step"] = "post-merge (chrom)"
-                pinfo["description"] = "#%d/%d (%.1f%%)" % (bnum, btotal, (cnt / total * 100.))
-                self.logger.info("Creating post-merge job #%d/%d to process chrom %d/%d (%.1f%%)" % \
-                                 (bnum, btotal, cnt, total, (cnt / total * 100.)))
-                job = await job_manager.defer_to_process(pinfo, partial(chrom_worker, self.target_backend.target_name, doc_ids))
-
-                def processed(f, results, batch_num):
-                    try:
-                        fres = f.result()
-                        for errtype in ("missing", "disagreed"):
-                            if fres[errtype]:
-                                results[errtype]["count"] += len(fres[errtype])
-                                if len(results[errtype]["examples"]) < self.__class__.MAX_CHROM_EX:
-                                    results[errtype]["examples"].extend(fres[errtype])
-                        # merge root key counts
-                        rk = fres["root_keys"]
-                        for k in rk:
-                            root_keys.setdefault(k, 0)
-                            root_keys[k] += rk[k]
-                        self.logger.info("chrom batch #%d, done" % batch_num)
-                    except Exception as e:
-                        import traceback
-                        self.logger.error("chrom batch #%d, error in processed (set_chrom): %s:\n%s" % \
-                                          (batch_num, e, traceback.format_exc()))
-                        raise
-
-                job.add_done_callback(partial(processed, results=results, batch_num=bnum))
-                jobs.append(job)
-                bnum += 1
-        self.logger.info("%d jobs created for merging step" % len(jobs))
-        if jobs:
-            await asyncio.gather(*jobs)
+        report_col = get_target_db()[self.chrom_report_name]
+        for report in report_col.find():
+            for errtype in ("missing", "disagreed"):
+                results[errtype]["count"] += report[errtype]["count"]
+                if len(results[errtype]["examples"]) < self.__class__.MAX_CHROM_EX:
+                    results[errtype]["examples"].extend(
+                        [(_id, report["source"]) for _id in report[errtype]["examples"]])
+        return results
+
+    def post_merge(self, source_names, batch_size, job_manager):
+        target_name = self.target_backend.target_name
+        done = get_checkpoints(target_name).get("post_merge", {}) if self.resume else {}
+        self.validate_merge()
+        if "chrom" in done:
+            self.logger.info("'chrom' discrepancies already collected, skip it")
+            results = done["chrom"]
+        else:
+            results = self.collect_chrom_report()
             self.logger.info("Found %d missing 'chrom' and %d where resources disagreed" % (results["missing"]["count"], results["disagreed"]["count"]))
             if results["missing"]["count"] or results["disagreed"]["count"]:
-                fn = "chrom_%s_%s.pickle" % (self.target_backend.target_name, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+                fn = "chrom_%s_%s.pickle" % (target_name, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
                 self.logger.info("Pickling 'chrom' discrepancies into %s" % fn)
                 pickle.dump(results, open(fn, "wb"))
-            # now store metadata
-            root_keys["total"] = root_keys.pop("_id")
-            self.logger.info("Root keys: %s" % root_keys)
-            src_build = self.source_backend.build
-            src_build.update({'_id': self.target_backend.target_name}, {"$set": {"_meta.stats": root_keys}})
+            # examples are in the pickle file, only counts are kept
+            results = {errtype: {"count": results[errtype]["count"]} for errtype in ("missing", "disagreed")}
+            set_checkpoint(target_name, "post_merge.chrom", results)
+            get_target_db()[self.chrom_report_name].drop()
+
+        if "scan" in done:
+            self.logger.info("Genomic keys, '%s' and gene summaries already updated, skip it" % POPFREQ_FIELD)
+            root_key_counts = done["scan"]
+        else:
+            root_key_counts = self.post_merge_scan(batch_size)
+            set_checkpoint(target_name, "post_merge.scan", root_key_counts)
+
+        if "stats" in done:
+            self.logger.info("Root keys already counted, skip it")
+            return results
+
+        # now store metadata, root keys are counted by post_merge_scan()
+        # (other root keys are actual sources and are counted under "src" key while merge_stats)
+        root_keys = {"total": self.target_backend.count(), **root_key_counts}
+        self.logger.info("Root keys: %s" % root_keys)
+        src_build = self.source_backend.build
+        src_build.update({'_id': self.target_backend.target_name}, {"$set": {"_meta.stats": root_keys}})
+        set_checkpoint(target_name, "post_merge.stats", True)
 
         return results
 
-    def post_merge(self, source_names, batch_size, job_manager):
-        self.validate_merge()
-        # we're in a new thread (see biothings.databuild.builder, post_merge is called in defer_to_thread)
-        asyncio.set_event_loop(job_manager.loop)
-        job = self.set_chrom(batch_size, job_manager)
-        # since we are in a new thread, we cannot use asyncio.create_task() here
-        # see https://docs.python.org/3/library/asyncio-dev.html#concurrency-and-multithreading
-        task = asyncio.run_coroutine_threadsafe(job, job_manager.loop)
-        return task
+    def popfreq_changed(self):
+        """
+        Whether the population frequency summaries (see utils.popfreq) must be updated: an incremental build which
+        didn't merge any frequency source keeps the summaries of the previous build.
+        """
+        if self.incremental:
+            changed_keys = set().union(*[self.get_root_keys(src_name) for src_name in self.incremental["changed"]])
+            if not changed_keys & set(POPFREQ_SOURCES):
+                self.logger.info("No population frequency source changed, '%s' kept from previous build" % POPFREQ_FIELD)
+                return False
+        return True
+
+    def copy_gene_summary(self):
+        """
+        Drop the gene summaries of the target (see utils.genesummary), and copy the ones of the previous build if it's
+        an incremental build which didn't merge any of their sources. Return whether they were copied.
+        """
+        target_db = get_target_db()
+        summary_name = self.target_backend.target_name + GENE_SUMMARY_SUFFIX
+        target_db[summary_name].drop()
+        if self.incremental:
+            changed_keys = set().union(*[self.get_root_keys(src_name) for src_name in self.incremental["changed"]])
+            previous_name = self.incremental["previous"]["_id"] + GENE_SUMMARY_SUFFIX
+            if not changed_keys & set(GENE_SUMMARY_SOURCES) and previous_name in target_db.list_collection_names():
+                self.logger.info("No gene summary source changed, copying '%s'" % previous_name)
+                target_db[previous_name].aggregate([{"$out": summary_name}], allowDiskUse=True)
+                return True
+        return False
+
+    def post_merge_scan(self, batch_size):
+        """
+        Read the merged documents once to:
+        - set the genomic keys still missing (see utils.genomickey). Keys are set while merging (see mapper.SetChrom),
+          so only the documents with an assembly position but no key for it are updated, e.g. a document whose keys
+          were replaced by the ones of a later source having positions of the other assembly only,
+        - update the population frequency summaries which changed, unless popfreq_changed() says otherwise,
+        - build the per-gene variant summaries into the "<target>_gene_summary" collection, unless copied from the
+          previous build (see copy_gene_summary()),
+        - count the documents having each of the ROOT_KEYS, returned as {key: count}.
+        Every document is read, but only with the fields needed.
+        """
+        projection = {"chrom": 1, GENOMIC_KEY_FIELD: 1, **{key: 1 for key in self.ROOT_KEYS + ASSEMBLIES}}
+        update_popfreq = self.popfreq_changed()
+        if update_popfreq:
+            projection.update(POPFREQ_PROJECTION)
+        accumulator = None if self.copy_gene_summary() else GeneSummaryAccumulator()
+        if accumulator is not None:
+            projection.update(GENE_SUMMARY_PROJECTION)
+
+        col = self.target_backend.target_collection
+        counts = {GENOMIC_KEY_FIELD: 0, POPFREQ_FIELD: 0}
+        root_key_counts = {key: 0 for key in self.ROOT_KEYS}
+        updates = []
+        for doc in col.find({}, projection, batch_size=batch_size):
+            for key in self.ROOT_KEYS:
+                if key in doc:
+                    root_key_counts[key] += 1
+            update = {}
+            keys = add_genomic_keys(dict(doc, **{GENOMIC_KEY_FIELD: None})).get(GENOMIC_KEY_FIELD)
+            if keys and keys != doc.get(GENOMIC_KEY_FIELD):
+                update.setdefault("$set", {})[GENOMIC_KEY_FIELD] = keys
+                counts[GENOMIC_KEY_FIELD] += 1
+            if update_popfreq:
+                summary = popfreq_summary(doc)
+                if summary != doc.get(POPFREQ_FIELD):
+                    if summary:
+                        update.setdefault("$set", {})[POPFREQ_FIELD] = summary
+                    else:
+                        update["$unset"] = {POPFREQ_FIELD: ""}
+                    counts[POPFREQ_FIELD] += 1
+            if accumulator is not None:
+                accumulator.add(doc)
+            if update:
+                updates.append(UpdateOne({"_id": doc["_id"]}, update))
+            if len(updates) >= batch_size:
+                col.bulk_write(updates, ordered=False)
+                updates = []
+        if updates:
+            col.bulk_write(updates, ordered=False)
+        self.logger.info("'%s' updated in %d documents, '%s' in %d documents"
+                         % (GENOMIC_KEY_FIELD, counts[GENOMIC_KEY_FIELD], POPFREQ_FIELD, counts[POPFREQ_FIELD]))
+
+        if accumulator is not None:
+            summary_name = self.target_backend.target_name + GENE_SUMMARY_SUFFIX
+            count = 0
+            for docs in iter_n(accumulator.summaries(), batch_size):
+                get_target_db()[summary_name].insert_many(docs, ordered=False)
+                count += len(docs)
+            self.logger.info("%d gene summaries stored in '%s'" % (count, summary_name))
+        return root_key_counts
 
     def get_stats(self, *args, **kwargs):
         # we overide that one just to make sure existing metadata won't be
-        # overwritten by the ones coming from the base class (see root_keys in set_chrom())
+        # overwritten by the ones coming from the base class (see root_keys in post_merge())
         return {}
 
 
@@ -135,93 +507,91 @@ class MyVariantShardedDataBuilder(MyVariantDataBuilder):
                          *args, **kwargs)
 
 
-def inspect_chrom(doc: dict):
-    """
-    doc is a merged document stored in "<build_name>" collection (e.g. "warm_hg19_20210722_yz5tmmal") of "myvariant" database (e.g. on su09:27017).
-    Example:
-        {
-            "_id": "chrX:g.1337588C>A",
-            "cadd": { ... },
-            "dbsnp": { ... },
-            "observed": true,
-            "gnomad_genome": { ... },
-            "hg19": { ... },
-            "snpeff": { ... },
-            "vcf": { ... },
-        }
-    A purpose of "chrom_worker" is to add a top-level "chrom" field to every such doc, while "inspect_chrom" is to find if all the second-level "chrom" fields
-    are in consistency.
-    """
 
+def partition_merger_worker(partition, specs, dest_name, batch_size, resume=False):
     """
-    "chrom" is determined in the following order:
-    
-    1. use the commonly shared second-level chrom value across all datasources, if any
-    2. if there are multiple or none second-level chrom values found, infer from the id (like "chrX" from "chrX:g.1337588C>A")
-    3. use None, if it's impossible to infer from the id
-    
-    "agreed" is an indicator of consistency of the second-level "chrom" values. It could be:
-    
-    1. True, if there exists a commonly shared second-level chrom value
-    2. False, if there exist multiple second-level chrom values (and in this case the "chrom" is inferred from the id)
-    3. None, if no second-level chrom values exist 
+    Merge the documents of all sources (see MyVariantDataBuilder.get_source_specs()) belonging to `partition`, by
+    batches of `batch_size`. Return the number of documents merged per source.
+
+    Sources having a "run_dir" are merged together from their sorted runs, after the other root document sources and
+    before the other sources, so documents are only created by root document sources, as in a regular merge.
+
+    Batches are merged by increasing _ids, and the last _id merged is checkpointed after each batch (under
+    "checkpoints.partitions.<partition>.<source>"). With `resume`, merging starts after the checkpointed _ids.
     """
-    result = {"chrom": None, "agreed": False}
-
-    # Get second-level chrom values
-    chrom_values = set()
-    for k in doc:
-        # config.CHROM_FIELDS is a dict of <datasource_name: chrom_field_name>. E.g.CHROM_FIELDS = {'cadd': 'chrom', 'clinvar': 'chrom'}.
-        if type(doc[k]) == dict and k in config.CHROM_FIELDS and config.CHROM_FIELDS[k] in doc[k]:
-            chrom_field_name = config.CHROM_FIELDS[k]
-            chrom_values.add(str(doc[k][chrom_field_name]))
-
-    if len(chrom_values) == 1:
-        result["chrom"] = chrom_values.pop()
-        result["agreed"] = True
-        return result
-
-    # if there are multiple or none second-level chrom values, infer from the id
-    if doc['_id'].startswith('chr'):
-        result["chrom"] = doc['_id'].split(':')[0][3:]
-        result["agreed"] = False if chrom_values else None
-        return result
-
-    # return the init result = {"chrom": None, "agreed": False}. In this case, the "agreed" value is meaningless.
-    return result
-
-
-def chrom_worker(col_name, ids):
-    database: Database = get_target_db()
-    collection: Collection = database[col_name]
-    cur = collection.find({'_id': {'$in': ids}})
-    bulk_operations = []
-
-    docs_with_disagreed_chrom = []
-    docs_with_missing_chrom = []
-    target_root_keys = set(["_id", "vcf", "total", "hg19", "hg38", "observed"])
-    found_root_keys = {}
-
-    for doc in cur:
-        chrom_info = inspect_chrom(doc)
-        chrom_value = chrom_info["chrom"]
-        chrom_agreement = chrom_info["agreed"]
-
-        if chrom_value is None:
-            docs_with_missing_chrom.append(doc["_id"])
-        else:
-            if chrom_agreement is False:
-                docs_with_disagreed_chrom.append(doc["_id"])
-            bulk_operations.append(UpdateOne(filter={"_id": doc["_id"]}, update={"$set": {"chrom": chrom_value}}, upsert=False))
+    checkpoints = get_checkpoints(dest_name).get("partitions", {}).get(partition, {}) if resume else {}
+    counts = {}
+    mongo_specs = [spec for spec in specs if not spec["run_dir"]]
+    run_specs = [spec for spec in specs if spec["run_dir"]]
+    for spec in mongo_specs:
+        if spec["upsert"]:
+            counts[spec["src_name"]] = merge_partition_source(partition, spec, dest_name, batch_size, checkpoints.get(spec["src_name"]))
+    if run_specs:
+        counts.update(merge_partition_runs(partition, run_specs, dest_name, batch_size, checkpoints.get(RUNS_CHECKPOINT)))
+    for spec in mongo_specs:
+        if not spec["upsert"]:
+            counts[spec["src_name"]] = merge_partition_source(partition, spec, dest_name, batch_size, checkpoints.get(spec["src_name"]))
+    return counts
 
-        # count root keys for later metadata
-        for k in doc:
-            # other root keys are actual sources and are counted under "src" key while merge_stats
-            if k in target_root_keys:
-                found_root_keys.setdefault(k, 0)
-                found_root_keys[k] += 1
 
-    if bulk_operations:
-        collection.bulk_write(bulk_operations, ordered=False)
+def merge_partition_source(partition, spec, dest_name, batch_size, checkpoint=None):
+    checkpoint = checkpoint or {"last_id": None, "count": 0, "done": False}
+    if checkpoint["done"]:
+        return checkpoint["count"]
+    key = "partitions.%s.%s" % (partition, spec["src_name"])
+    src_db = get_src_db()
+    query = [partition_query(partition)]
+    if spec["query"]:
+        query.append(spec["query"])
+    if checkpoint["last_id"] is not None:
+        query.append({"_id": {"$gt": checkpoint["last_id"]}})
+    cnt = checkpoint["count"]
+    # only _ids are read here (from the index), batches are merged while the cursor stays open
+    with src_db[spec["col_name"]].find({"$and": query}, {"_id": 1}, no_cursor_timeout=True).sort("_id", 1) as cur:
+        for batch_num, docs in enumerate(iter_n(cur, batch_size), start=1):
+            ids = [doc["_id"] for doc in docs]
+            res = merger_worker(spec["col_name"], dest_name, ids, spec["mapper"], spec["cleaner"], spec["upsert"],
+                                spec["merger"], "%s_%d" % (partition, batch_num), spec["merger_kwargs"])
+            if res is None:
+                raise Exception("Batch #%d of partition %s failed while merging source '%s'" % (batch_num, partition, spec["src_name"]))
+            cnt += len(ids)
+            set_checkpoint(dest_name, key, {"last_id": ids[-1], "count": cnt, "done": False})
+    set_checkpoint(dest_name, key, {"last_id": None, "count": cnt, "done": True})
+    return cnt
+
+
+def merge_partition_runs(partition, specs, dest_name, batch_size, checkpoint=None):
+    """
+    Merge the sorted runs of `specs` sources, writing each merged document once. Documents with data from a root
+    document source are upserted, the others only update existing documents.
+    """
+    counts = {spec["src_name"]: 0 for spec in specs}
+    checkpoint = checkpoint or {"last_id": None, "counts": counts, "done": False}
+    if checkpoint["done"]:
+        return checkpoint["counts"]
+    key = "partitions.%s.%s" % (partition, RUNS_CHECKPOINT)
+    counts.update(checkpoint["counts"])
+    last_id = checkpoint["last_id"]
 
-    return {"missing": docs_with_missing_chrom, "disagreed": docs_with_disagreed_chrom, "root_keys": found_root_keys}
+    tgt = get_target_db()
+    dest = DocMongoBackend(tgt, tgt[dest_name])
+    merged = merge_sources_runs([(spec["run_dir"], spec["mapper"]) for spec in specs], partition)
+    if last_id is not None:
+        # runs are read again, but documents merged before the checkpoint are not written again
+        merged = ((doc, ranks) for doc, ranks in merged if doc["_id"] > last_id)
+    for batch in iter_n(merged, batch_size):
+        upserts, updates = [], []
+        for doc, ranks in batch:
+            for rank in ranks:
+                counts[specs[rank]["src_name"]] += 1
+            if any(specs[rank]["upsert"] for rank in ranks):
+                upserts.append(doc)
+            else:
+                updates.append(doc)
+        if upserts:
+            dest.update(upserts, upsert=True)
+        if updates:
+            dest.update(updates, upsert=False)
+        set_checkpoint(dest_name, key, {"last_id": batch[-1][0]["_id"], "counts": counts, "done": False})
+    set_checkpoint(dest_name, key, {"last_id": None, "counts": counts, "done": True})
+    return counts
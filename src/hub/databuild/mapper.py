@@ -1,5 +1,8 @@
 import biothings.hub.databuild.mapper as mapper
 from biothings import config as btconfig
+from biothings.utils.mongo import get_target_db
+
+from utils.genomickey import add_genomic_keys
 
 logging = btconfig.logger
 max_id_length = btconfig.MAX_ID_LENGTH
@@ -35,3 +38,61 @@ class TagObservedAndSkipLongId(TagObserved, SkipLongId):
         okdocs = SkipLongId.process(self, docs)
         obsdocs = TagObserved.process(self, okdocs)
         return obsdocs
+
+
+class SetChrom(mapper.BaseMapper):
+    """
+    Wrap the mapper of a source to set the root "chrom" field of its docs while they're merged, inferred from the
+    _id (e.g. "X" from "chrX:g.1337588C>A"), or from the source's own chrom field (see config.CHROM_FIELDS) when the
+    _id isn't genomic. The source's chrom field is checked against the _id, and the docs for which no chrom could be
+    found, or for which the source disagrees with the _id, are reported (by merge batch) into the `report_name`
+    collection of the target database, see MyVariantDataBuilder.collect_chrom_report().
+    Once "chrom" is set, the genomic keys of the doc's assembly positions are set too (see utils.genomickey).
+    """
+    MAX_BATCH_EX = 1000  # max # of examples reported per batch
+
+    def __init__(self, inner, report_name, src_name, chrom_fields=None):
+        super().__init__(name=inner.name)
+        self.inner = inner
+        self.report_name = report_name
+        self.src_name = src_name
+        self.chrom_fields = btconfig.CHROM_FIELDS if chrom_fields is None else chrom_fields
+
+    def load(self, *args, **kwargs):
+        return self.inner.load(*args, **kwargs)
+
+    def process(self, docs):
+        report = {"missing": {"count": 0, "examples": []}, "disagreed": {"count": 0, "examples": []}}
+        for doc in self.inner.process(docs):
+            # reports are keyed by source and first _id, so a batch merged again replaces its report
+            report.setdefault("_id", "%s/%s" % (self.src_name, doc["_id"]))
+            errtype = self.set_chrom(doc)
+            add_genomic_keys(doc)
+            if errtype:
+                report[errtype]["count"] += 1
+                if len(report[errtype]["examples"]) < self.MAX_BATCH_EX:
+                    report[errtype]["examples"].append(doc["_id"])
+            yield doc
+        if report["missing"]["count"] or report["disagreed"]["count"]:
+            self.save_report(report)
+
+    def set_chrom(self, doc):
+        """
+        Set doc's "chrom", return the type of discrepancy found ("missing" or "disagreed") or None.
+        """
+        src_chrom = None
+        for key, field in self.chrom_fields.items():
+            if isinstance(doc.get(key), dict) and field in doc[key]:
+                src_chrom = str(doc[key][field])
+                break
+        chrom = doc["_id"].split(":")[0][3:] if doc["_id"].startswith("chr") else src_chrom
+        if chrom is None:
+            return "missing"
+        doc["chrom"] = chrom
+        if src_chrom is not None and src_chrom != chrom:
+            return "disagreed"
+        return None
+
+    def save_report(self, report):
+        report["source"] = self.src_name
+        get_target_db()[self.report_name].replace_one({"_id": report["_id"]}, report, upsert=True)
@@ -1,23 +1,172 @@
-import time
+import asyncio
+import copy
+import os
+from functools import partial
 
 import biothings.hub.databuild.syncer as syncer
+import biothings.utils.jsonpatch as jsonpatch
+from biothings import config as btconfig
 from biothings.hub.databuild.backend import create_backend
+from biothings.hub.dataexport.ids import upload_ids
+from biothings.utils.common import iter_n, loadobj
+from biothings.utils.mongo import doc_feeder
+from elasticsearch.helpers import scan
+from hub.dataindex.bulk import AdaptiveBulkSender
+from hub.dataindex.indexer import id_filter_file
+from utils.idfilter import ID_FILTER_FIELDS, ID_FILTER_SUFFIX, extend_id_filter
+from utils.slim import DEFAULT_SLIM_FIELDS, SLIM_FIELDS_META, SLIM_SUFFIX
 from utils.stats import update_stats
 
+logging = btconfig.logger
+
 
 class MyVariantBaseSyncer(syncer.BaseSyncer):
 
+    def is_routed(self):
+        """
+        Whether the documents of the synced index are routed by chromosome (see utils.routing), in which case every
+        write, read and delete of the sync needs the routing of its document, which biothings' sync workers don't set.
+        """
+        indexer = create_backend(self.get_target_backend()).target_esidxer
+        mapping = next(iter(indexer.get_mapping().values()))
+        return bool(mapping.get("_routing", {}).get("required"))
+
+    async def sync_cols(self, diff_folder, batch_size=10000, mode=None, force=False, target_backend=None,
+                        steps=("mapping", "content", "meta", "post"), debug=False):
+        steps = [steps] if isinstance(steps, str) else list(steps)
+        self.target_backend = target_backend
+        if "content" not in steps or self.target_backend_type != "es" or not self.is_routed():
+            return await super().sync_cols(diff_folder, batch_size, mode, force, target_backend, steps, debug)
+
+        # the other steps are biothings' ones, the content is synced with sync_es_routed_jsondiff_worker()
+        summary = {}
+        before, after = steps[:steps.index("content")], steps[steps.index("content") + 1:]
+        if before:
+            summary.update(await super().sync_cols(diff_folder, batch_size, mode, force, target_backend, before, debug))
+        summary.update(await self.sync_routed_content(diff_folder, batch_size, force, debug))
+        if after:
+            summary.update(await super().sync_cols(diff_folder, batch_size, mode, force, target_backend, after, debug))
+        return summary
+
+    async def sync_routed_content(self, diff_folder, batch_size, force, debug):
+        self.load_metadata(diff_folder)
+        old_db_col_names = self.get_target_backend()
+        new_db_col_names = self._meta["new"]["backend"]
+        selfcontained = "selfcontained" in self._meta["diff"]["type"]
+        coldhot = "coldhot" in self.diff_type
+        self.setup_log(new_db_col_names)
+        self.logger.info("Syncing %s to %s using diff files in '%s' (routed)" % (old_db_col_names, new_db_col_names,
+                                                                                diff_folder))
+        pinfo = self.get_pinfo()
+        pinfo["source"] = "%s -> %s" % (old_db_col_names, new_db_col_names)
+        pinfo["step"] = "content"
+        self.register_status("syncing", transient=True, init=True, job={"step": "sync-content"})
+        jobs = []
+        total = len(self._meta["diff"]["files"])
+        for cnt, diff_info in enumerate(self._meta["diff"]["files"], 1):
+            diff_file = os.path.join(diff_folder, diff_info["name"])
+            worker_args = diff_info.get("worker_args", {})
+            pinfo["description"] = "file %s (%s/%s)" % (diff_file, cnt, total)
+            job = await self.job_manager.defer_to_process(
+                pinfo, partial(sync_es_routed_jsondiff_worker, diff_file, old_db_col_names, new_db_col_names,
+                               worker_args.get("batch_size") or batch_size, cnt, force, selfcontained,
+                               copy.deepcopy(self._meta), debug, coldhot))
+            jobs.append(job)
+        try:
+            results = await asyncio.gather(*jobs)
+        except Exception as e:
+            self.logger.error("Failed to sync %s using diff files in '%s': %s" % (old_db_col_names, diff_folder, e),
+                              extra={"notify": True})
+            self.register_status("failed", job={"err": repr(e)})
+            raise
+        summary = {}
+        for res in results:
+            for key, value in res.items():
+                summary[key] = summary.get(key, 0) + value
+        self.register_status("success", job={"step": "sync-content"}, sync=summary)
+        return summary
+
     def post_sync_cols(self, diff_folder, batch_size, mode, force, target_backend, steps):
         assert self.target_backend_type == "es", "Only support ElasticSearch backend (got: %s)" % self.target_backend_type
         assert not self._meta is None, "Metadata not loaded (use load_metadata(diff_folder))"
-        self.logger.info("Sleeping for a bit while index is being fully updated...")
-        time.sleep(3 * 60)
         backend_info = self.get_target_backend()
         self.logger.info("Updating 'stats' by querying index '%s'" % backend_info[1])
         indexer = create_backend(backend_info).target_esidxer
         # compute stats using ES index
         assembly = self._meta["build_config"]["assembly"]
-        return update_stats(indexer, assembly)
+        stats = update_stats(indexer, assembly)
+        self.sync_slim_index(diff_folder, indexer, batch_size)
+        if getattr(btconfig, "ID_FILTER_EXPORT", False):
+            self.extend_id_filter(diff_folder, indexer, batch_size)
+        return stats
+
+    def diff_ids(self, diff_folder):
+        """
+        The `_id`s of the added or updated documents, and of the deleted ones, of the diff files of the sync.
+        """
+        upserted, deleted = [], []
+        for diff_info in self._meta["diff"]["files"]:
+            diff_file = os.path.join(diff_folder, diff_info["name"])
+            diff = loadobj(diff_file if os.path.exists(diff_file) else "%s.synced" % diff_file)
+            upserted.extend(doc["_id"] if isinstance(doc, dict) else doc for doc in diff["add"])
+            upserted.extend(patch_info["_id"] for patch_info in diff["update"])
+            deleted.extend(diff["delete"])
+        return upserted, deleted
+
+    def sync_slim_index(self, diff_folder, indexer, batch_size):
+        """
+        Apply the sync to the slim index of the synced index, if any (see utils.slim): copy the slim fields of the
+        added and updated documents from the synced index, delete the deleted ones.
+        """
+        slim_index = indexer._index + SLIM_SUFFIX
+        client = indexer._es
+        if not client.indices.exists(index=slim_index):
+            return
+        mappings = client.indices.get_mapping(index=indexer._index)[indexer._index]["mappings"]
+        client.indices.put_mapping(index=slim_index, body={"properties": mappings["properties"]})
+        slim_mappings = client.indices.get_mapping(index=slim_index)[slim_index]["mappings"]
+        slim_fields = slim_mappings.get("_meta", {}).get(SLIM_FIELDS_META, DEFAULT_SLIM_FIELDS)
+
+        upserted, deleted = self.diff_ids(diff_folder)
+        routing = self.is_routed()
+        sender = AdaptiveBulkSender(client, indexer._index, routing=routing)
+        slim_sender = AdaptiveBulkSender(client, slim_index, routing=routing)
+        for ids in iter_n(upserted, batch_size):
+            slim_sender.index([dict(source, _id=_id)
+                               for _id, source in sender.indexed_docs(ids, source=slim_fields).items()])
+        missing = 0
+        for ids in iter_n(deleted, batch_size):
+            missing += slim_sender.delete(ids)[1]
+        self.logger.info(f"Slim index {slim_index} synced: {len(upserted)} documents copied, "
+                         f"{len(deleted) - missing} deleted")
+
+    def extend_id_filter(self, diff_folder, indexer, batch_size):
+        """
+        Add the added and updated documents of the sync to the id filter exported for the synced index (if any, see
+        utils.idfilter), and upload it again.
+        """
+        filter_file = id_filter_file(indexer._index)
+        if not os.path.exists(filter_file):
+            self.logger.info("No id filter exported for index '%s'" % indexer._index)
+            return
+        ids, _ = self.diff_ids(diff_folder)
+        sender = AdaptiveBulkSender(indexer._es, indexer._index, routing=self.is_routed())
+        docs = (dict(source, _id=_id) for batch in iter_n(ids, batch_size)
+                for _id, source in sender.indexed_docs(batch, source=list(ID_FILTER_FIELDS)).items())
+
+        def all_docs():
+            self.logger.info(f"Id filter {filter_file} is full, rebuilding it from index '{indexer._index}'")
+            hits = scan(indexer._es, index=indexer._index, _source=list(ID_FILTER_FIELDS), size=batch_size)
+            return (dict(hit.get("_source", {}), _id=hit["_id"]) for hit in hits)
+
+        bloom = extend_id_filter(filter_file, docs, all_docs)
+        self.logger.info(f"Id filter {filter_file} extended with {len(ids)} documents ({bloom.count} keys, "
+                         f"capacity {bloom.capacity})")
+        redir = self._meta["build_config"]["assembly"] + ID_FILTER_SUFFIX
+        if "demo" in indexer._index:
+            redir = "demo_%s" % redir
+        upload_ids(filter_file, redir, s3_bucket=btconfig.IDS_S3_BUCKET, aws_key=btconfig.AWS_KEY,
+                   aws_secret=btconfig.AWS_SECRET)
 
 
 class MyVariantThrottledESJsonDiffSelfContainedSyncer(MyVariantBaseSyncer, syncer.ThrottledESJsonDiffSelfContainedSyncer):
@@ -34,3 +183,76 @@ class MyVariantESColdHotJsonDiffSelfContainedSyncer(MyVariantBaseSyncer, syncer.
 
 class MyVariantESJsonDiffSelfContainedSyncer(MyVariantBaseSyncer, syncer.ESJsonDiffSelfContainedSyncer):
     pass
+
+
+def sync_es_routed_jsondiff_worker(diff_file, es_config, new_db_col_names, batch_size, cnt, force=False,
+                                   selfcontained=False, metadata=None, debug=False, coldhot=False):
+    """
+    biothings' sync_es_jsondiff_worker() (sync_es_coldhot_jsondiff_worker() with `coldhot`) for an index routed by
+    chromosome: documents are added, fetched to be patched and deleted with the routing of their `_id`.
+    Added documents overwrite any indexed version (merged with it with `coldhot`), so a diff file can be applied again.
+    """
+    res = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
+    synced_file = "%s.synced" % diff_file
+    if os.path.exists(synced_file):
+        logging.info("Diff file '%s' already synced, skip it", os.path.basename(diff_file))
+        diff = loadobj(synced_file)
+        res["skipped"] += len(diff["add"]) + len(diff["delete"]) + len(diff["update"])
+        return res
+
+    indexer = create_backend(es_config).target_esidxer
+    sender = AdaptiveBulkSender(indexer._es, indexer._index, routing=True)
+    diff = loadobj(diff_file)
+
+    # add
+    if selfcontained:
+        cur = diff["add"]
+    else:
+        new = create_backend(new_db_col_names)
+        assert new.target_collection.name == diff["source"], \
+            "Source is different in diff file '%s': %s" % (diff_file, diff["source"])
+        cur = doc_feeder(new.target_collection, step=batch_size, inbatch=False, query={"_id": {"$in": diff["add"]}})
+    for docs in iter_n(cur, batch_size):
+        for doc in docs:
+            doc.pop("_timestamp", None)
+        if coldhot:
+            # documents new in the hot collection may already be indexed from the cold one
+            docs = list(sender.merged(docs))
+        sender.index(docs)
+        res["added"] += len(docs)
+
+    # update: patch the indexed documents
+    for patches in iter_n(diff["update"], batch_size):
+        indexed = sender.indexed_docs([patch_info["_id"] for patch_info in patches])
+        docs = []
+        for patch_info in patches:
+            doc = indexed.get(patch_info["_id"])
+            if doc is None:
+                logging.warning("_id '%s' not found, can't be updated" % patch_info["_id"])
+                res["skipped"] += 1
+                continue
+            doc["_id"] = patch_info["_id"]
+            try:
+                newdoc = jsonpatch.apply_patch(doc, patch_info["patch"])
+            except jsonpatch.JsonPatchConflict as e:
+                # assuming already applied
+                logging.warning("_id '%s' already synced ? JsonPatchError: %s", doc["_id"], e)
+                res["skipped"] += 1
+                continue
+            if newdoc == doc:
+                logging.warning("_id '%s' already synced" % doc["_id"])
+                res["skipped"] += 1
+                continue
+            docs.append(newdoc)
+        sender.index(docs)
+        res["updated"] += len(docs)
+
+    # delete
+    for ids in iter_n(diff["delete"], batch_size):
+        deleted, missing = sender.delete(ids)
+        res["deleted"] += deleted
+        res["skipped"] += missing
+
+    logging.info("Done applying diff from file '%s': %s" % (diff_file, res))
+    os.rename(diff_file, synced_file)
+    return res
@@ -0,0 +1,300 @@
+"""
+Adaptive bulk indexing.
+
+Instead of fixed-count bulk requests, documents are serialized once (straight to bytes, never as `str`) and packed into bulk requests of (about)
+`target_bytes`, which are sent by a pool of threads whose effective concurrency adapts to the cluster (additive
+increase while requests are answered under `target_latency`, multiplicative decrease on rejections). Only the
+items rejected by Elasticsearch (429 / 503, e.g. a full write queue) are retried, after an exponential backoff;
+any other item failure fails the batch.
+
+Request bodies are built as bytes, which the Elasticsearch client sends as-is: each document is kept as the byte
+parts of its two NDJSON lines (a pre-rendered action line prefix, its `_id`, and the document from `orjson.dumps()`,
+which also writes infinite floats as null), joined once per request. Documents are serialized in the indexing worker
+processes (see `dispatch()`), so the sender threads only ship bytes.
+
+With `routing`, documents are indexed, read (e.g. to be merged with their indexed version in "merge" mode) and
+deleted with their chromosome as routing value (see utils.routing).
+"""
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import orjson
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ApiError, ConnectionTimeout
+from elasticsearch.helpers import BulkIndexError, bulk
+from pymongo import MongoClient
+
+from biothings.utils.loggers import get_logger
+from biothings.utils.mongo import doc_feeder
+from utils.routing import id_routing
+
+DEFAULT_BULK_ARGS = {
+    "target_bytes": 10 * 1024 ** 2,
+    "max_concurrency": 4,
+    "target_latency": 10.0,  # seconds
+    "max_retries": 8,
+    "initial_backoff": 1.0,  # seconds, doubled for each retry
+    "max_backoff": 60.0,
+}
+
+ROUTING_PREFIX = b',"routing":'
+ID_PREFIX = b',"_id":'
+ACTION_SUFFIX = b"}}\n"
+NEWLINE = b"\n"
+
+RETRY_STATUSES = {429, 503}
+MAX_ID_BYTES = 512  # an ES limitation
+
+
+class BulkMetrics(dict):
+    """
+    Counters of an indexing batch, which can be added together to report on a whole index job.
+    """
+    COUNTERS = ("docs", "bytes", "requests", "rejected", "retried", "invalid", "skipped", "request_time", "backoff_time",
+                "elapsed")
+
+    def __init__(self, **kwargs):
+        super().__init__({key: 0 for key in self.COUNTERS}, min_concurrency=None, max_concurrency=0)
+        self.update(kwargs)
+
+    def __add__(self, other):
+        total = BulkMetrics(**{key: self[key] + other[key] for key in self.COUNTERS})
+        total["max_concurrency"] = max(self["max_concurrency"], other["max_concurrency"])
+        mins = [value for value in (self["min_concurrency"], other["min_concurrency"]) if value is not None]
+        total["min_concurrency"] = min(mins) if mins else None
+        return total
+
+    def summary(self):
+        elapsed = self["elapsed"] or 1e-9
+        return ("%d docs (%.1f MB) in %d requests, %.0f docs/s, %.1f MB/s, %d rejected/%d retried items, "
+                "%.1fs backoff, concurrency %s-%s" % (
+                    self["docs"], self["bytes"] / 1024 ** 2, self["requests"], self["docs"] / elapsed,
+                    self["bytes"] / 1024 ** 2 / elapsed, self["rejected"], self["retried"], self["backoff_time"],
+                    self["min_concurrency"], self["max_concurrency"]))
+
+
+class ConcurrencyLimit:
+    """
+    AIMD limit on the number of concurrent bulk requests.
+    """
+    def __init__(self, max_concurrency: int, target_latency: float):
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.value = max(1, max_concurrency // 2)
+
+    def on_response(self, latency: float):
+        if latency <= self.target_latency:
+            self.value = min(self.max_concurrency, self.value + 1)
+        else:
+            self.value = max(1, self.value - 1)
+
+    def on_rejection(self):
+        self.value = max(1, self.value // 2)
+
+
+class AdaptiveBulkSender:
+    def __init__(self, client, index_name: str, dumps=orjson.dumps, routing=False,
+                 target_bytes=DEFAULT_BULK_ARGS["target_bytes"],
+                 max_concurrency=DEFAULT_BULK_ARGS["max_concurrency"], target_latency=DEFAULT_BULK_ARGS["target_latency"],
+                 max_retries=DEFAULT_BULK_ARGS["max_retries"], initial_backoff=DEFAULT_BULK_ARGS["initial_backoff"],
+                 max_backoff=DEFAULT_BULK_ARGS["max_backoff"]):
+        self.client = client
+        self.index_name = index_name
+        self.dumps = dumps  # a document to bytes, e.g. MyVariantJSONSerializer.dumps_bytes
+        self.routing = routing
+        self.action_prefix = b'{"index":{"_index":%s' % orjson.dumps(index_name)
+        self.target_bytes = target_bytes
+        self.limit = ConcurrencyLimit(max_concurrency, target_latency)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.metrics = BulkMetrics()
+
+    def serialize(self, doc: dict):
+        """
+        The byte parts of the action and source lines of `doc` in a bulk request body.
+        """
+        _id = doc.pop("_id")
+        if self.routing:
+            return (self.action_prefix, ROUTING_PREFIX, orjson.dumps(id_routing(_id)), ID_PREFIX, orjson.dumps(_id),
+                    ACTION_SUFFIX, self.dumps(doc), NEWLINE)
+        return self.action_prefix, ID_PREFIX, orjson.dumps(_id), ACTION_SUFFIX, self.dumps(doc), NEWLINE
+
+    def chunks(self, docs):
+        """
+        Pack docs into lists of (_id, parts) items of about `target_bytes` (a bigger document is sent alone).
+        """
+        chunk, size = [], 0
+        for doc in docs:
+            _id = doc["_id"]
+            parts = self.serialize(doc)
+            item_size = sum(map(len, parts))
+            if chunk and size + item_size > self.target_bytes:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((_id, parts))
+            size += item_size
+        if chunk:
+            yield chunk
+
+    def existing_ids(self, ids: list):
+        """
+        The subset of `ids` already indexed.
+        """
+        response = self.client.search(index=self.index_name, body={"query": {"ids": {"values": ids}}},
+                                      _source=False, size=len(ids))
+        return {hit["_id"] for hit in response["hits"]["hits"]}
+
+    def indexed_docs(self, ids: list, source=True):
+        """
+        The indexed documents of `ids` (those found), by `_id`, with only the fields of `source` if it's a list.
+        """
+        specs = [{"_id": _id, "routing": id_routing(_id)} if self.routing else {"_id": _id} for _id in ids]
+        response = self.client.mget(body={"docs": specs}, index=self.index_name, _source=source)
+        return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+
+    def merged(self, docs: list):
+        """
+        Update the indexed version of `docs` (if any) with their new content, like `Indexer`'s "merge" mode.
+        """
+        indexed = self.indexed_docs([doc["_id"] for doc in docs])
+        for doc in docs:
+            doc.pop("_timestamp", None)
+            if doc["_id"] in indexed:
+                doc = dict(indexed[doc["_id"]], **doc)
+            yield doc
+
+    def delete(self, ids: list):
+        """
+        Delete the documents of `ids`, return the numbers of deleted and missing documents.
+        """
+        actions = [dict(_op_type="delete", _index=self.index_name, _id=_id, **(
+            {"routing": id_routing(_id)} if self.routing else {})) for _id in ids]
+        deleted, errors = bulk(self.client, actions, raise_on_error=False)
+        failed = [error for error in errors if error["delete"].get("status") != 404]
+        if failed:
+            raise BulkIndexError("%i document(s) failed to delete." % len(failed), failed)
+        return deleted, len(errors)
+
+    def backoff(self, attempt: int):
+        return min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1)) if attempt else 0
+
+    def send(self, attempt: int, chunk: list):
+        """
+        Send one bulk request (after the backoff of its `attempt`), return (items to retry, failed items, latency).
+        """
+        delay = self.backoff(attempt)
+        if delay:
+            time.sleep(delay)
+
+        t0 = time.time()
+        try:
+            response = self.client.bulk(body=b"".join(part for _, parts in chunk for part in parts), index=self.index_name)
+        except ConnectionTimeout:
+            return chunk, [], time.time() - t0
+        except ApiError as e:
+            if e.status_code in RETRY_STATUSES:
+                # the whole request was rejected
+                return chunk, [], time.time() - t0
+            raise
+        latency = time.time() - t0
+
+        to_retry, failed = [], []
+        if response.get("errors"):
+            for (_id, item), result in zip(chunk, response["items"]):
+                info = next(iter(result.values()))
+                if info.get("status", 200) < 300:
+                    continue
+                if info["status"] in RETRY_STATUSES:
+                    to_retry.append((_id, item))
+                else:
+                    failed.append({"index": info})
+        return to_retry, failed, latency
+
+    def index(self, docs):
+        """
+        Index docs, return the metrics of the batch. Raise BulkIndexError if some documents couldn't be indexed.
+        """
+        t0 = time.time()
+        metrics = self.metrics
+        chunks = self.chunks(docs)
+        retries = deque()  # (attempt, chunk)
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.limit.max_concurrency) as pool:
+            futures = {}
+            while True:
+                while len(futures) < self.limit.value:
+                    if retries:
+                        attempt, chunk = retries.popleft()
+                    else:
+                        attempt, chunk = 0, next(chunks, None)
+                        if chunk is None:
+                            break
+                    futures[pool.submit(self.send, attempt, chunk)] = (attempt, chunk)
+                if not futures:
+                    break
+                current = len(futures)
+                metrics["max_concurrency"] = max(metrics["max_concurrency"], current)
+                metrics["min_concurrency"] = current if metrics["min_concurrency"] is None else min(metrics["min_concurrency"], current)
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempt, chunk = futures.pop(future)
+                    to_retry, failed, latency = future.result()
+                    metrics["requests"] += 1
+                    metrics["request_time"] += latency
+                    metrics["backoff_time"] += self.backoff(attempt)
+                    errors.extend(failed)
+                    if to_retry:
+                        self.limit.on_rejection()
+                        metrics["rejected"] += len(to_retry)
+                        if attempt >= self.max_retries:
+                            errors.extend({"index": {"_id": _id, "status": 429, "error": "too many retries"}}
+                                          for _id, _ in to_retry)
+                        else:
+                            metrics["retried"] += len(to_retry)
+                            retries.append((attempt + 1, to_retry))
+                    else:
+                        self.limit.on_response(latency)
+                    retried_ids = {_id for _id, _ in to_retry}
+                    indexed = [(_id, item) for _id, item in chunk if _id not in retried_ids]
+                    metrics["docs"] += len(indexed) - len(failed)
+                    metrics["bytes"] += sum(len(part) for _, parts in indexed for part in parts)
+
+        metrics["elapsed"] = time.time() - t0
+        if errors:
+            raise BulkIndexError("%i document(s) failed to index." % len(errors), errors)
+        return metrics
+
+
+def dispatch(mg_client_args, mg_dbs_name, mg_col_name, es_client_args, es_idx_name, bulk_args, ids, mode, name):
+    """
+    Index one batch of documents, from the MongoDB collection to the Elasticsearch index, with an
+    AdaptiveBulkSender. `mode` is one of `Indexer`'s modes: "index" (or "purge"), "resume" (only index the
+    documents missing from the index) or "merge" (update the indexed documents). Return the metrics of the batch.
+    """
+    logger, _ = get_logger(f"index_{es_idx_name}")
+    valid_ids = [_id for _id in ids if len(_id.encode()) <= MAX_ID_BYTES]
+    for _id in set(ids).difference(valid_ids):
+        logger.warning("_id is too long: '%s'" % _id)
+
+    collection = MongoClient(**mg_client_args)[mg_dbs_name][mg_col_name]
+    serializer = es_client_args.get("serializer")
+    skipped = 0
+    with Elasticsearch(**es_client_args) as client:
+        sender = AdaptiveBulkSender(client, es_idx_name, dumps=getattr(serializer, "dumps_bytes", orjson.dumps),
+                                     **bulk_args)
+        if mode == "resume":
+            existing = sender.existing_ids(valid_ids)
+            skipped = len(existing)
+            valid_ids = [_id for _id in valid_ids if _id not in existing]
+        docs = doc_feeder(collection, step=len(valid_ids), inbatch=False, query={"_id": {"$in": valid_ids}})
+        if mode == "merge":
+            docs = sender.merged(list(docs))
+        metrics = sender.index(docs) if valid_ids else sender.metrics
+    metrics["invalid"] = len(ids) - len(valid_ids) - skipped
+    metrics["skipped"] = skipped
+    logger.info("#%s: %s" % (name, metrics.summary()))
+    return metrics
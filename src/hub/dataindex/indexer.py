@@ -1,9 +1,21 @@
 import asyncio
+import os
+import time
+from datetime import datetime
 
 import config
 from biothings.hub.dataindex.indexer import Indexer, IndexManager, ColdHotIndexer
+from biothings.hub.dataindex.indexer_schedule import Schedule
 from biothings.hub.dataexport.ids import export_ids, upload_ids
+from biothings.utils.common import iter_n, timesofar
 from biothings.utils.hub_db import get_src_build
+from biothings.utils.mongo import DatabaseClient, get_target_db, id_feeder
+from hub.dataindex import bulk
+from utils.genesummary import GENE_SUMMARY_SUFFIX
+from utils.genomickey import ASSEMBLIES, GENOMIC_KEY_FIELD
+from utils.idfilter import ID_FILTER_FIELDS, ID_FILTER_SUFFIX, build_id_filter
+from utils.popfreq import POPFREQ_FIELD
+from utils.slim import DEFAULT_SLIM_FIELDS, SLIM_FIELDS_META, SLIM_SUFFIX
 from utils.stats import ESMappingMetaStatsService, BuildDocMetaStatsService
 
 from elasticsearch import JSONSerializer, SerializationError, Elasticsearch
@@ -53,12 +65,40 @@ class MyVariantJSONSerializer(JSONSerializer):
 
             `orjson.dumps()` will output compact JSON representation, effectively the same behavior with json.dumps(separators=(",", ":"))
             """
-            return orjson.dumps(data, default=self.default).decode()
+            return self.dumps_bytes(data).decode()
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
+    def dumps_bytes(self, data):
+        """
+        Same as `dumps()`, without decoding `orjson`'s output, for request bodies built as bytes (the Elasticsearch
+        client sends bytes as-is), see `hub.dataindex.bulk`.
+        """
+        try:
+            return orjson.dumps(data, default=self.default)
         except (ValueError, TypeError) as e:
             raise SerializationError(data, e)
 
 
 class BaseVariantIndexer(Indexer):
+    # index of the gene summaries of the build (see utils.genesummary), the counts are mapped dynamically
+    GENE_SUMMARY_INDEX = {
+        "settings": {
+            "analysis": {
+                "normalizer": {
+                    "keyword_lowercase_normalizer": {"type": "custom", "filter": ["lowercase"]}
+                }
+            }
+        },
+        "mappings": {
+            "properties": {
+                "symbol": {"type": "keyword", "normalizer": "keyword_lowercase_normalizer"},
+                "entrezgene": {"type": "long"},
+                "chrom": {"type": "keyword"},
+                "variant_count": {"type": "long"},
+            }
+        }
+    }
 
     def __init__(self, build_doc, indexer_env, index_name):
         super().__init__(build_doc, indexer_env, index_name)
@@ -77,6 +117,18 @@ class BaseVariantIndexer(Indexer):
         self.es_index_mappings["properties"]["observed"] = {
             "type": "boolean"
         }
+        self.es_index_mappings["properties"][GENOMIC_KEY_FIELD] = {
+            "properties": {assembly: {"type": "long"} for assembly in ASSEMBLIES}
+        }
+        self.es_index_mappings["properties"][POPFREQ_FIELD] = {
+            "properties": {
+                "max_af": {"type": "float"},
+                "max_af_source": {"type": "keyword"},
+                "popmax_af": {"type": "float"},
+                "popmax_af_source": {"type": "keyword"},
+                "popmax_population": {"type": "keyword"},
+            }
+        }
         self.es_index_mappings["properties"]["_seqhashed"] = {
             "type": "object",
             "properties": {
@@ -93,17 +145,103 @@ class BaseVariantIndexer(Indexer):
         }
 
         self.assembly = build_doc["build_config"]["assembly"]
+        if indexer_env.get("index_sort", False):
+            # documents stored in position order, see utils.genomickey
+            self.es_index_settings["sort"] = {
+                "field": f"{GENOMIC_KEY_FIELD}.{self.assembly}",
+                "order": "asc",
+            }
 
-    async def post_index(self, *args, **kwargs):
-        # No idea how come the decision to sleep for 3 minutes
-        # Migrated from Sebastian's commit 1a7b7a. It was originally marked "Not Tested Yet".
-        self.logger.info("Sleeping for a bit while index is being fully updated...")
-        await asyncio.sleep(3 * 60)
+        # byte-size bulk requests and adaptive concurrency, see hub.dataindex.bulk.DEFAULT_BULK_ARGS
+        self.adaptive_bulk_args = dict(bulk.DEFAULT_BULK_ARGS, **indexer_env.get("adaptive_bulk", {}))
+
+        # route documents by chromosome, see utils.routing
+        # (the web API must then use web.pipeline.ChromRoutingQueryBuilder, and syncs
+        # go through hub.databuild.syncer.sync_es_routed_jsondiff_worker)
+        routing = indexer_env.get("routing", {})
+        self.adaptive_bulk_args["routing"] = bool(routing.get("chrom"))
+        if routing.get("chrom"):
+            self.es_index_mappings["_routing"] = {"required": True}
+            if routing.get("partition_size", 1) > 1:
+                # each chromosome spread over `partition_size` shards, so the biggest ones don't unbalance shards
+                self.es_index_settings["routing_partition_size"] = routing["partition_size"]
+
+        # slim index of the most requested fields, see utils.slim
+        # (the web API must then use web.pipeline.SlimIndexQueryBackend, with the same fields)
+        slim = indexer_env.get("slim", {})
+        self.slim_fields = slim.get("fields", DEFAULT_SLIM_FIELDS) if slim.get("enabled") else None
+
+    async def do_index(self, job_manager, batch_size, ids, mode, **kwargs):
+        """
+        Same as `Indexer.do_index()`, except that batches are indexed by `hub.dataindex.bulk.dispatch()`, with bulk
+        requests of `adaptive_bulk_args["target_bytes"]` instead of fixed-count chunks, retrying only the documents
+        rejected by a busy cluster (and routed by chromosome if enabled). The metrics of all batches are logged at
+        the end.
+        """
+        client = DatabaseClient(**self.mongo_client_args)
+        collection = client[self.mongo_database_name][self.mongo_collection_name]
+
+        if ids:
+            self.logger.info("Indexing from '%s' with specific list of _ids, create indexer job with batch_size=%d.",
+                             self.mongo_collection_name, batch_size)
+            id_provider = iter_n(ids, batch_size)
+        else:
+            self.logger.info("Fetch _ids from '%s', and create indexer job with batch_size=%d.",
+                             self.mongo_collection_name, batch_size)
+            id_provider = id_feeder(collection, batch_size, logger=self.logger)
+
+        jobs = []
+        error = None  # the first Exception
+        metrics = bulk.BulkMetrics()
+        started_at = datetime.now()
+
+        total = len(ids) if ids else collection.count()
+        schedule = Schedule(total, batch_size)
+
+        def batch_finished(future):
+            nonlocal error, metrics
+            try:
+                result = future.result()
+                metrics += result
+                schedule.finished += result["docs"] + result["invalid"] + result["skipped"]
+            except Exception as exc:
+                self.logger.warning(exc)
+                error = exc
+
+        for batch_num, batch_ids in zip(schedule, id_provider):
+            await asyncio.sleep(0.0)
+
+            # when one batch failed, stop scheduling and cancel all on-going jobs, to fail quickly.
+            if error:
+                for job in jobs:
+                    if not job.done():
+                        job.cancel()
+                raise error
+
+            self.logger.info(schedule)
+            pinfo = self.pinfo.get_pinfo(schedule.suffix(self.mongo_collection_name))
+            job = await job_manager.defer_to_process(
+                pinfo, bulk.dispatch, self.mongo_client_args, self.mongo_database_name, self.mongo_collection_name,
+                self.es_client_args, self.es_index_name, self.adaptive_bulk_args, batch_ids, mode or "index", batch_num)
+            job.add_done_callback(batch_finished)
+            jobs.append(job)
+
+        self.logger.info(schedule)
+        await asyncio.gather(*jobs)
+
+        schedule.completed()
+        self.logger.notify(schedule)
+        # batches run concurrently, report the throughput of the whole job
+        metrics["elapsed"] = (datetime.now() - started_at).total_seconds()
+        self.logger.info(f"Bulk indexing of {self.es_index_name}: {metrics.summary()}")
+        return {"count": total, "created_at": datetime.now().astimezone()}
 
+    async def post_index(self, *args, **kwargs):
         # STEP 1: update _meta.stats in ES mapping
+        # (the index is refreshed first, so all indexed documents are counted)
         with Elasticsearch(**self.es_client_args) as es_client:
             mapping_service = ESMappingMetaStatsService(client=es_client, index_name=self.es_index_name)
-            meta_stats = mapping_service.update_mapping_meta_stats(assembly=self.assembly)
+            meta_stats, src_stats = mapping_service.update_mapping_meta_stats(assembly=self.assembly)
             self.logger.info(f"_meta.stats updated to {meta_stats} for index {self.es_index_name}")
 
         # STEP 2: update _meta.stats in MongoDB myvariant_hubdb.src_build
@@ -119,11 +257,69 @@ class BaseVariantIndexer(Indexer):
 
         src_build = get_src_build()
         build_service = BuildDocMetaStatsService(src_build=src_build, build_name=self.build_name, logger=self.logger)
-        build_service.update_build_meta_stats(meta_stats)
+        build_service.update_build_meta_stats(meta_stats, src_stats)
+
+        # STEP 3: index the gene summaries next to the variants
+        self.index_gene_summary()
+
+        # STEP 4: build the slim index from the variant index
+        if self.slim_fields:
+            await self.build_slim_index()
 
         # return nothing, otherwise the returned values would be written to the associated build_doc by PostIndexJSR
         return
 
+    def index_gene_summary(self):
+        """
+        Index the gene summaries of the build (see utils.genesummary) into "<index>_gene_summary", replacing it.
+        """
+        collection = get_target_db()[self.build_name + GENE_SUMMARY_SUFFIX]
+        if not collection.estimated_document_count():
+            self.logger.info(f"No gene summary in '{collection.name}', skip indexing them")
+            return
+        index_name = self.es_index_name + GENE_SUMMARY_SUFFIX
+        bulk_args = {key: value for key, value in self.adaptive_bulk_args.items() if key in bulk.DEFAULT_BULK_ARGS}
+        with Elasticsearch(**self.es_client_args) as es_client:
+            if es_client.indices.exists(index=index_name):
+                es_client.indices.delete(index=index_name)
+            es_client.indices.create(index=index_name, body=self.GENE_SUMMARY_INDEX)
+            sender = bulk.AdaptiveBulkSender(es_client, index_name, dumps=self.es_client_args["serializer"].dumps_bytes,
+                                             **bulk_args)
+            metrics = sender.index(collection.find())
+        self.logger.info(f"Gene summaries indexed into {index_name}: {metrics.summary()}")
+
+    async def build_slim_index(self, poll_interval=10):
+        """
+        Build "<index>_slim", with the `slim_fields` of the variant index documents only (see utils.slim), replacing
+        it. Documents are copied by a sliced reindex task in ES (keeping their routing), polled until completion.
+        """
+        index_name = self.es_index_name + SLIM_SUFFIX
+        with Elasticsearch(**self.es_client_args) as es_client:
+            if es_client.indices.exists(index=index_name):
+                es_client.indices.delete(index=index_name)
+            # same mappings and settings, so the same queries work on both indices
+            full_index = es_client.indices.get(index=self.es_index_name)[self.es_index_name]
+            settings = {key: value for key, value in full_index["settings"]["index"].items()
+                        if key in ("number_of_shards", "analysis", "sort", "routing_partition_size", "mapping")}
+            mappings = dict(full_index["mappings"])
+            # so syncs copy the same fields
+            mappings["_meta"] = dict(mappings.get("_meta", {}), **{SLIM_FIELDS_META: self.slim_fields})
+            es_client.indices.create(index=index_name, body={"settings": settings, "mappings": mappings})
+            response = es_client.reindex(body={
+                "source": {"index": self.es_index_name, "_source": self.slim_fields},
+                "dest": {"index": index_name},
+            }, wait_for_completion=False, slices="auto", refresh=True)
+            while True:
+                await asyncio.sleep(poll_interval)
+                task = es_client.tasks.get(task_id=response["task"])
+                if task.get("completed"):
+                    break
+                self.logger.info(f"Building {index_name}: {task['task']['status']}")
+            result = task.get("response", {})
+            if task.get("error") or result.get("failures"):
+                raise Exception(f"Failed to build {index_name}: {task.get('error') or result['failures'][:10]}")
+        self.logger.info(f"Slim index {index_name} built with fields {self.slim_fields}: {result.get('total')} documents")
+
 
 class MyVariantIndexerManager(IndexManager):
 
@@ -147,6 +343,45 @@ class MyVariantIndexerManager(IndexManager):
                    aws_key=config.AWS_KEY,
                    aws_secret=config.AWS_SECRET)
 
+        if getattr(config, "ID_FILTER_EXPORT", False):
+            # id filter of the index, for the web API to answer queries of missing ids, see utils.idfilter
+            filter_file = self.export_id_filter(index, bdoc)
+            upload_ids(filter_file, redir.replace("_ids.xz", ID_FILTER_SUFFIX),
+                       s3_bucket=config.IDS_S3_BUCKET,
+                       aws_key=config.AWS_KEY,
+                       aws_secret=config.AWS_SECRET)
+
+    def export_id_filter(self, index, bdoc):
+        """
+        Export the id filter of the documents of build `index` (and of its cold collection if any) into
+        id_filter_file(index), and return its path.
+        """
+        t0 = time.time()
+        collections = [get_target_db()[index]]
+        if bdoc.get("build_config", {}).get("cold_collection"):
+            collections.append(get_target_db()[bdoc["build_config"]["cold_collection"]])
+        # at most one key per field and document (cold and hot documents may be the same)
+        capacity = sum(collection.estimated_document_count() for collection in collections) * len(ID_FILTER_FIELDS)
+        projection = {field: 1 for field in ID_FILTER_FIELDS}
+        docs = (doc for collection in collections for doc in collection.find({}, projection))
+        bloom = build_id_filter(docs, capacity, getattr(config, "ID_FILTER_ERROR_RATE", 0.01))
+
+        filter_file = id_filter_file(index)
+        bloom.save(filter_file)
+        self.logger.info(f"Id filter of {bloom.count} keys ({bloom.num_bits // 8} bytes) exported to {filter_file} "
+                         f"in {timesofar(t0)}")
+        return filter_file
+
+
+def id_filter_file(index):
+    """
+    The path of the id filter exported for `index`: "<DATA_EXPORT_FOLDER>/idfilter/<index>.idfilter".
+    """
+    export_folder = getattr(config, "DATA_EXPORT_FOLDER", None) or os.path.join(config.DATA_ARCHIVE_ROOT, "export")
+    export_folder = os.path.join(export_folder, "idfilter")
+    os.makedirs(export_folder, exist_ok=True)
+    return os.path.join(export_folder, index + ID_FILTER_SUFFIX)
+
 
 class VariantIndexer(BaseVariantIndexer):
     pass
@@ -1,13 +1,20 @@
+import os
+import glob
+import itertools
 
 from .cadd_parser import load_data
 import biothings.hub.dataload.uploader as uploader
-from hub.dataload.uploader import SnpeffPostUpdateUploader
+from hub.dataload.uploader import SnpeffPostUpdateUploader, SortedRunsUploader
+from hub.dataload.storage import MyVariantIgnoreDuplicatedRunsStorage
+from utils.posindex import get_sources_position_index
 
-class CADDUploader(uploader.DummySourceUploader, SnpeffPostUpdateUploader):
+class CADDUploader(SortedRunsUploader, SnpeffPostUpdateUploader):
 
     keep_archive = 1
 
     name = "cadd"
+    # the same variant can be in several CADD files
+    storage_class = MyVariantIgnoreDuplicatedRunsStorage
     __metadata__ = {
         "assembly" : "hg19",
         "src_meta" : {
@@ -17,9 +24,23 @@ class CADDUploader(uploader.DummySourceUploader, SnpeffPostUpdateUploader):
         }
     }
 
+    # CADD scores all possible SNVs, only the variants from these source collections are loaded
+    FILTER_SOURCES = ["dbsnp_hg19", "clinvar_hg19", "dbnsfp_hg19_v2", "gnomad_exomes_hg19", "gnomad_genomes_hg19"]
+    # also load every variant annotated as "CodingTranscript", known or not
+    KEEP_CODING_TRANSCRIPTS = False
+
     def load_data(self,data_folder):
-        self.logger.info("Load data from folder '%s'" % data_folder)
-        return load_data(data_folder)
+        # manually downloaded tabix files, see CADDDumper
+        input_files = sorted(f for f in glob.glob(os.path.join(data_folder, "*.tsv.gz")) if os.path.exists(f + ".tbi"))
+        if not input_files:
+            raise uploader.ResourceError("Expecting tabix-indexed .tsv.gz files in '%s'" % data_folder)
+        # shared by all CADD releases, rebuilt only when the filtering sources change
+        index_dir = os.path.join(os.path.dirname(os.path.abspath(data_folder)), "position_index_hg19")
+        get_sources_position_index(self.FILTER_SOURCES, index_dir, logger=self.logger).close()
+        self.logger.info("Load data from files %s" % input_files)
+        return itertools.chain.from_iterable(
+            load_data(input_file, index_dir, keep_coding_transcripts=self.KEEP_CODING_TRANSCRIPTS)
+            for input_file in input_files)
 
     @classmethod
     def get_mapping(klass):
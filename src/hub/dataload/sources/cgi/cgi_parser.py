@@ -1,20 +1,22 @@
+import os
 import unicodedata
-from collections import defaultdict
 
 from csv import DictReader
 from biothings.utils.dataload import dict_sweep, open_anyfile
+from utils.extsort import ExternalSorter, unique_sorted, DEFAULT_MEMORY_LIMIT
 
 
-def load_data(input_file):
+def load_data(input_file, memory_limit=DEFAULT_MEMORY_LIMIT):
+    tmp_dir = os.path.dirname(input_file)
 
-    with open_anyfile(input_file) as in_f:
+    with open_anyfile(input_file) as in_f, \
+            ExternalSorter(key=lambda v: v['_id'], memory_limit=memory_limit, tmp_dir=tmp_dir) as results:
 
         # Remove duplicated lines if any
         header = next(in_f).strip().split('\t')
-        lines = set(list(in_f))
+        lines = unique_sorted(in_f, memory_limit=memory_limit, tmp_dir=tmp_dir)
         reader = DictReader(lines, fieldnames=header, delimiter='\t')
 
-        results = defaultdict(list)
         for row in reader:
 
             variant = {}
@@ -45,10 +47,10 @@ def load_data(input_file):
                 variant['cgi'][new_k] = unicodedata.normalize("NFKD", row.get(old_k, None))
 
             variant = dict_sweep(variant, vals=['', 'null', 'N/A', None, [], {}])
-            results[variant['_id']].append(variant)
+            results.add(variant)
 
         # Merge duplications
-        for v in results.values():
+        for _, v in results.groupby():
             if len(v) == 1:
                 yield v[0]
             else:
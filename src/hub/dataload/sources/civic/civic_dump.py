@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 import logging
 import datetime
 
@@ -7,6 +8,7 @@ from config import DATA_ARCHIVE_ROOT
 from biothings.hub.dataload.dumper import HTTPDumper
 
 from hub.dataload.sources.civic.graphql_dump import GraphqlDump
+from hub.dataload.sources.civic.graphql_batch_dump import GraphqlBatchDump
 
 
 class CivicDumper(HTTPDumper):
@@ -18,10 +20,27 @@ class CivicDumper(HTTPDumper):
     MAX_PARALLEL_DUMP = 5
     SLEEP_BETWEEN_DOWNLOAD = 0.1
 
+    # dump all variants into one NDJSON file with batched, concurrent GraphQL requests (see `GraphqlBatchDump`),
+    # instead of one `variant_<id>.json` file per variant
+    BATCH_DUMP = True
+    BATCH_DUMP_FILENAME = "variants.ndjson"
+    BATCH_DUMP_REMOTE = "graphql-batch"
+    # only fetch variants which are new or modified since the previous release (according to the manifest stored
+    # next to the previous NDJSON file), unchanged ones are carried forward from the previous release folder
+    INCREMENTAL_DUMP = True
+    BATCH_DUMP_ARGS = {
+        "batch_size": 25,
+        "concurrency": 4,
+        "page_size": 500,
+        "max_retries": 5,
+    }
+
     def set_release(self):
         self.release = datetime.date.today().strftime("%Y-%m-%d")
 
     def create_todump_list(self, force=False, **kwargs):
+        if self.__class__.BATCH_DUMP:
+            return self.create_batch_todump_list(force=force, **kwargs)
 
         self.logger.info("Find all available variant IDS")
         ids = GraphqlDump().get_variants_list(api_url=self.API_URL)
@@ -48,8 +67,46 @@ class CivicDumper(HTTPDumper):
                 logging.info(local)
                 self.to_dump.append({"remote": data_url, "local": local})
 
+    def create_batch_todump_list(self, force=False, **kwargs):
+        self.set_release()
+        if (
+            force
+            or not self.src_doc
+            or (self.src_doc.get("download", {}).get("release") or "") < self.release
+        ):
+            data_folder = os.path.join(self.SRC_ROOT_FOLDER, self.release)
+            local = os.path.join(data_folder, self.__class__.BATCH_DUMP_FILENAME)
+            self.to_dump.append({"remote": self.__class__.BATCH_DUMP_REMOTE, "local": local})
+
+            # a forced dump re-fetches everything
+            self.previous_file = None
+            if self.__class__.INCREMENTAL_DUMP and not force:
+                try:
+                    self.previous_file = os.path.join(self.current_data_folder, self.__class__.BATCH_DUMP_FILENAME)
+                except TypeError:
+                    # current data folder doesn't even exist
+                    pass
+
+    def batch_download(self, localfile):
+        dumper = GraphqlBatchDump(api_url=self.API_URL, logger=self.logger, **self.__class__.BATCH_DUMP_ARGS)
+        previous_file = getattr(self, "previous_file", None)
+        # `download()` runs outside of the hub's event loop, so we can run our own here
+        if previous_file and os.path.abspath(previous_file) != os.path.abspath(localfile):
+            self.logger.info(f"Downloading new or modified variants into '{localfile}' (previous dump: '{previous_file}')")
+            fetched, carried = asyncio.run(dumper.dump_incremental(localfile, previous_file=previous_file))
+            self.logger.info(f"Fetched {fetched} variants, carried forward {carried} unchanged variants into '{localfile}'")
+            return fetched + carried
+
+        self.logger.info(f"Downloading all variants into '{localfile}'")
+        fetched, _ = asyncio.run(dumper.dump_incremental(localfile))
+        self.logger.info(f"Dumped {fetched} variants into '{localfile}'")
+        return fetched
+
     def download(self, remoteurl, localfile, headers={}):
         self.prepare_local_folders(localfile)
+        if remoteurl == self.__class__.BATCH_DUMP_REMOTE:
+            return self.batch_download(localfile)
+
         variant_id = remoteurl
 
         self.logger.info(f"Downloading data for variant id: {variant_id}")
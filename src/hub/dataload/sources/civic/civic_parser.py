@@ -68,14 +68,38 @@ def get_id(doc):
         return _id
 
 
+def iter_variant_data(data_folder):
+    """
+    Yield the dumped data of each variant, either from the NDJSON file written by `GraphqlBatchDump`,
+    or from the `variant_<id>.json` files written by `GraphqlDump`.
+    """
+    ndjson_file = os.path.join(data_folder, "variants.ndjson")
+    if os.path.exists(ndjson_file):
+        with open(ndjson_file) as in_f:
+            for line in in_f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        for infile in glob.glob(os.path.join(data_folder, "variant_*.json")):
+            with open(infile) as in_f:
+                yield json.load(in_f)
+
+
 def load_data(data_folder):
-    for infile in glob.glob(os.path.join(data_folder,"variant_*.json")):
-        variant_data = json.load(open(infile))
+    for variant_data in iter_variant_data(data_folder):
+        parts = [
+            variant_data["ContributorAvatars"]["data"],
+            variant_data["GeneVariant"]["data"]["variant"],
+            variant_data["VariantDetail"]["data"]["variant"],
+            variant_data["VariantSummary"]["data"]["variant"],
+        ]
+        if any(part is None for part in parts):
+            # a query failed when the variant was dumped, its document would be incomplete
+            logging.warning("Skipping CIViC variant {}: incomplete dumped data".format(variant_data.get("variant_id")))
+            continue
         doc = {}
-        doc = merge_dicts(doc, variant_data["ContributorAvatars"]["data"])
-        doc = merge_dicts(doc, variant_data["GeneVariant"]["data"]["variant"])
-        doc = merge_dicts(doc, variant_data["VariantDetail"]["data"]["variant"])
-        doc = merge_dicts(doc, variant_data["VariantSummary"]["data"]["variant"])
+        for part in parts:
+            doc = merge_dicts(doc, part)
 
         new_doc = {}
         new_doc["_id"] = get_id(doc=doc)
@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+
+import aiohttp
+import orjson
+
+from hub.dataload.sources.civic.graphql_variants import GraphqlVariants
+from hub.dataload.sources.civic.graphql_variants_modified import GraphqlVariantsModified
+from hub.dataload.sources.civic.graphql_detail import GraphqlVariantDetail
+from hub.dataload.sources.civic.graphql_contributor_avatars import (
+    GraphqlContributorAvatars,
+)
+from hub.dataload.sources.civic.graphql_summary import GraphqlVariantSummary
+from hub.dataload.sources.civic.graphql_gene import GraphqlGeneVariant
+
+
+def split_operation(query: str):
+    """
+    Split a GraphQL document made of one operation followed by fragment definitions, e.g.
+
+        query VariantDetail($variantId: Int!) {
+            variant(id: $variantId) { ...VariantDetailFields }
+        }
+        fragment VariantDetailFields on VariantInterface { ... }
+
+    into the selection set of the operation (without its outer braces) and the fragment definitions.
+    """
+    start = query.index("{")
+    depth = 0
+    for pos in range(start, len(query)):
+        if query[pos] == "{":
+            depth += 1
+        elif query[pos] == "}":
+            depth -= 1
+            if depth == 0:
+                return query[start + 1:pos].strip(), query[pos + 1:].strip()
+    raise ValueError("Unbalanced braces in GraphQL query")
+
+
+def hash_record(record) -> str:
+    return hashlib.sha1(orjson.dumps(record, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def record_complete(record: dict) -> bool:
+    """
+    Whether none of the queries of a variant record came back null (see `GraphqlBatchDump.split_response()`).
+    """
+    return all(value is not None for key in GraphqlBatchDump.QUERIES for value in record[key]["data"].values())
+
+
+def manifest_path(localfile: str) -> str:
+    """
+    Path of the manifest stored next to a NDJSON dump, e.g. "variants.ndjson" => "variants.manifest.json".
+    The manifest maps each variant id (as a string) to {"marker": <modification marker>, "hash": <record hash>}.
+    """
+    return os.path.splitext(localfile)[0] + ".manifest.json"
+
+
+def load_manifest(localfile: str) -> dict:
+    path = manifest_path(localfile)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as in_f:
+        return orjson.loads(in_f.read())
+
+
+def save_manifest(localfile: str, manifest: dict):
+    with open(manifest_path(localfile), "wb") as out_f:
+        out_f.write(orjson.dumps(manifest, option=orjson.OPT_SORT_KEYS))
+
+
+class GraphqlBatchDump():
+    """
+    Asynchronous CIViC dump, merging the "VariantSummary", "VariantDetail", "ContributorAvatars" and "GeneVariant"
+    queries (see `GraphqlDump.dump_variant()`) of a batch of variants into one aliased GraphQL request.
+
+    Batches are sent concurrently (at most `concurrency` requests in flight), and failed requests, or the variants
+    failing in a partially successful response, are retried with exponential backoff. Each variant's data is re-shaped into the structure returned by `GraphqlDump.dump_variant()`
+    so `civic_parser` handles both dump formats the same way.
+    """
+
+    # key in the variant record => (query class, name of the variable in the query's selection set)
+    QUERIES = {
+        "VariantSummary": (GraphqlVariantSummary, "$variantId"),
+        "VariantDetail": (GraphqlVariantDetail, "$variantId"),
+        "ContributorAvatars": (GraphqlContributorAvatars, "$subscribable"),
+        "GeneVariant": (GraphqlGeneVariant, "$variantId"),
+    }
+    # root field of each query's response, e.g. {"data": {"variant": {...}}}
+    ROOT_FIELDS = {
+        "VariantSummary": "variant",
+        "VariantDetail": "variant",
+        "ContributorAvatars": "contributors",
+        "GeneVariant": "variant",
+    }
+
+    def __init__(self, api_url: str, batch_size=25, concurrency=4, page_size=500,
+                 max_retries=5, backoff_base=1.0, backoff_max=60.0, timeout=300, logger=None):
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger("civic_dump")
+
+        self._selections = {}
+        fragments = []
+        for key, (query_class, _) in self.QUERIES.items():
+            selection, query_fragments = split_operation(query_class.QUERY)
+            self._selections[key] = selection
+            fragments.append(query_fragments)
+        self._fragments = "\n".join(fragments)
+
+    @classmethod
+    def alias(cls, key: str, variant_id: int):
+        return f"{key}_{variant_id}"
+
+    def gql(self, variant_ids: list):
+        """
+        Build one aliased GraphQL request fetching all four queries for every variant in `variant_ids`.
+        """
+        fields = []
+        for variant_id in variant_ids:
+            variant_id = int(variant_id)  # ids are inlined in the query, make sure they're what we expect
+            values = {
+                "$variantId": str(variant_id),
+                "$subscribable": f"{{id: {variant_id}, entityType: VARIANT}}",
+            }
+            for key, (_, variable) in self.QUERIES.items():
+                selection = self._selections[key].replace(variable, values[variable])
+                fields.append(f"{self.alias(key, variant_id)}: {selection}")
+
+        query = "query VariantBatch {\n" + "\n".join(fields) + "\n}\n" + self._fragments
+        return {"operationName": "VariantBatch", "query": query, "variables": {}}
+
+    def split_response(self, variant_ids: list, response_data: dict):
+        """
+        Split the response of an aliased request into one record per variant, each shaped like the output of
+        `GraphqlDump.dump_variant()`.
+        """
+        data = response_data.get("data") or {}
+        for variant_id in variant_ids:
+            record = {"variant_id": int(variant_id)}
+            for key in self.QUERIES:
+                record[key] = {"data": {self.ROOT_FIELDS[key]: data.get(self.alias(key, int(variant_id)))}}
+            yield record
+
+    def failed_variants(self, variant_ids: list, response_data: dict):
+        """
+        Return the ids in `variant_ids` with a query which failed in a partially successful response, i.e. named in
+        the path of an error or answered with null. An error without a path fails the whole batch.
+        """
+        data = response_data.get("data") or {}
+        errors = response_data.get("errors") or []
+        if any(not error.get("path") for error in errors):
+            return list(variant_ids)
+        failed_aliases = {error["path"][0] for error in errors}
+        return [
+            variant_id for variant_id in variant_ids
+            if any(self.alias(key, int(variant_id)) in failed_aliases or data.get(self.alias(key, int(variant_id))) is None
+                   for key in self.QUERIES)
+        ]
+
+    def backoff(self, attempt: int):
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def _post(self, session: aiohttp.ClientSession, payload: dict, description: str):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.post(self.api_url, json=payload) as response:
+                    # 429 and 5xx are transient, other errors are not worth retrying
+                    if response.status == 429 or response.status >= 500:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason)
+                    response.raise_for_status()
+                    response_data = await response.json(loads=orjson.loads, content_type=None)
+                    if response_data.get("errors") and not response_data.get("data"):
+                        raise ValueError(f"GraphQL errors for {description}: {response_data['errors']}")
+                    return response_data
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429:
+                    raise
+                if attempt == self.max_retries:
+                    self.logger.error(f"Giving up on {description} after {attempt + 1} attempts: {e}")
+                    raise
+                delay = self.backoff(attempt)
+                self.logger.warning(f"Error on {description} ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def fetch_batch(self, session: aiohttp.ClientSession, variant_ids: list):
+        """
+        Fetch the records of `variant_ids` with one aliased request. Variants with a failed query (see
+        `failed_variants()`) are requested again with exponential backoff, and a ValueError is raised if some still
+        fail after `max_retries` retries, so no partial record is ever returned.
+        """
+        records = {}
+        to_fetch = list(variant_ids)
+        for attempt in range(self.max_retries + 1):
+            description = f"variant batch {to_fetch[0]}..{to_fetch[-1]}"
+            response_data = await self._post(session, self.gql(to_fetch), description=description)
+            failed = set(self.failed_variants(to_fetch, response_data))
+            for record in self.split_response([v for v in to_fetch if v not in failed], response_data):
+                records[record["variant_id"]] = record
+            if not failed:
+                break
+            to_fetch = [v for v in to_fetch if v in failed]
+            errors = response_data.get("errors")
+            if attempt == self.max_retries:
+                self.logger.error(f"Giving up on {description} after {attempt + 1} attempts, "
+                                  f"{len(to_fetch)} variants failed: {errors}")
+                raise ValueError(f"GraphQL errors or null results for variants {to_fetch}: {errors}")
+            delay = self.backoff(attempt)
+            self.logger.warning(f"{len(to_fetch)} variants failed in {description} ({errors}), "
+                                f"retrying them in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        return [records[int(variant_id)] for variant_id in variant_ids]
+
+    async def get_variants_list(self, session: aiohttp.ClientSession):
+        """
+        Return all the variant ids. Pages are cursor-based, so they're fetched one after another,
+        but with `page_size` ids per request.
+        """
+        ids = []
+        has_next_page = True
+        end_cursor = None
+        while has_next_page:
+            payload = GraphqlVariants().gql(after=end_cursor)
+            payload["variables"]["first"] = self.page_size
+            response_data = await self._post(session, payload, description=f"variants page after {end_cursor}")
+            browse_variants = response_data["data"]["browseVariants"]
+            ids.extend(edge["node"]["id"] for edge in browse_variants["edges"])
+            has_next_page = browse_variants["pageInfo"]["hasNextPage"]
+            end_cursor = browse_variants["pageInfo"]["endCursor"]
+        self.logger.info(f"Count variant IDs = {len(ids)}")
+        return ids
+
+    async def get_variants_markers(self, session: aiohttp.ClientSession):
+        """
+        Return a dict of {variant_id: marker} for all the variants, where the marker is a hash of the latest events
+        (revisions, comments) on the variant and its molecular profiles, and of their evidence counts.
+        A variant whose marker didn't change since the previous dump doesn't need to be fetched again.
+        """
+        markers = {}
+        has_next_page = True
+        end_cursor = None
+        while has_next_page:
+            payload = GraphqlVariantsModified().gql(after=end_cursor, first=self.page_size)
+            response_data = await self._post(session, payload, description=f"modified variants page after {end_cursor}")
+            variants = response_data["data"]["variants"]
+            for node in variants["nodes"]:
+                markers[node["id"]] = hash_record(node)
+            has_next_page = variants["pageInfo"]["hasNextPage"]
+            end_cursor = variants["pageInfo"]["endCursor"]
+        self.logger.info(f"Count variant markers = {len(markers)}")
+        return markers
+
+    async def dump_variants(self, session: aiohttp.ClientSession, variant_ids: list, out_f, manifest: dict = None):
+        """
+        Fetch `variant_ids` by batches, and write one record per variant as a NDJSON line to `out_f` (binary mode).
+        If `manifest` is given, the hash of each record is stored into it, and the entry of an incomplete record (see
+        `record_complete()`) is dropped so the next incremental dump fetches it again.
+        Return the number of records written.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [variant_ids[i:i + self.batch_size] for i in range(0, len(variant_ids), self.batch_size)]
+        done = 0
+
+        async def fetch_batch(batch):
+            nonlocal done
+            async with semaphore:
+                records = await self.fetch_batch(session, batch)
+            # the event loop is single-threaded, no need to lock the file
+            for record in records:
+                out_f.write(orjson.dumps(record) + b"\n")
+                if manifest is None:
+                    continue
+                if record_complete(record):
+                    manifest.setdefault(str(record["variant_id"]), {})["hash"] = hash_record(record)
+                else:
+                    manifest.pop(str(record["variant_id"]), None)
+            done += 1
+            if done % 10 == 0 or done == len(batches):
+                self.logger.info(f"Dumped {done}/{len(batches)} batches of variants")
+            return len(batch)
+
+        counts = await asyncio.gather(*[fetch_batch(batch) for batch in batches])
+        return sum(counts)
+
+    async def dump(self, localfile: str, variant_ids: list = None):
+        """
+        Dump all the variants (or only `variant_ids` if given) into the NDJSON file `localfile`.
+        """
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            if variant_ids is None:
+                variant_ids = await self.get_variants_list(session)
+            with open(localfile, "wb") as out_f:
+                return await self.dump_variants(session, variant_ids, out_f)
+
+    async def dump_incremental(self, localfile: str, previous_file: str = None):
+        """
+        Dump all the variants into the NDJSON file `localfile`, fetching only the variants which are new or whose
+        marker changed since `previous_file` was dumped. Unchanged records are copied from `previous_file`, unless
+        they're incomplete (see `record_complete()`), in which case they're fetched again.
+        Variants no longer listed by CIViC are dropped. A manifest is written next to `localfile`.
+
+        Return a tuple of (number of fetched records, number of carried-forward records).
+        """
+        previous_manifest = {}
+        if previous_file and os.path.exists(previous_file):
+            previous_manifest = load_manifest(previous_file)
+        if not previous_manifest:
+            self.logger.info("No previous manifest found, dumping all the variants")
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            markers = await self.get_variants_markers(session)
+            manifest = {str(variant_id): {"marker": marker} for variant_id, marker in markers.items()}
+
+            unchanged = {
+                key for key, entry in manifest.items()
+                if previous_manifest.get(key, {}).get("marker") == entry["marker"]
+            }
+            to_fetch = [variant_id for variant_id in markers if str(variant_id) not in unchanged]
+            self.logger.info(f"{len(to_fetch)} new or modified variants to fetch, "
+                             f"{len(unchanged)} unchanged variants to carry forward")
+
+            carried = 0
+            with open(localfile, "wb") as out_f:
+                if unchanged:
+                    with open(previous_file, "rb") as in_f:
+                        for line in in_f:
+                            if not line.strip():
+                                continue
+                            record = orjson.loads(line)
+                            key = str(record["variant_id"])
+                            if key in unchanged and record_complete(record):
+                                out_f.write(line if line.endswith(b"\n") else line + b"\n")
+                                manifest[key]["hash"] = previous_manifest[key].get("hash")
+                                unchanged.discard(key)  # in case of duplicated lines
+                                carried += 1
+                    if unchanged:
+                        # listed in the previous manifest but missing or incomplete in the previous dump, fetch them too
+                        self.logger.warning(f"{len(unchanged)} unchanged variants missing or incomplete in "
+                                            f"'{previous_file}', fetching them")
+                        to_fetch.extend(int(key) for key in unchanged)
+
+                fetched = await self.dump_variants(session, to_fetch, out_f, manifest=manifest)
+
+        save_manifest(localfile, manifest)
+        return fetched, carried
@@ -0,0 +1,70 @@
+import logging
+import requests
+
+
+class GraphqlVariantsModified():
+    """
+    List variants along with the latest events (revisions, comments) on them and on their molecular profiles.
+    Used to decide, without fetching the variants themselves, which ones changed since the previous dump.
+    """
+
+    OPERATION_NAME = "VariantsModified"
+
+    QUERY = """
+    query VariantsModified($first: Int, $after: String) {
+        variants(first: $first, after: $after) {
+            pageInfo {
+                endCursor
+                hasNextPage
+            }
+            nodes {
+                id
+                lastAcceptedRevisionEvent {
+                    createdAt
+                }
+                lastSubmittedRevisionEvent {
+                    createdAt
+                }
+                lastCommentEvent {
+                    createdAt
+                }
+                molecularProfiles {
+                    nodes {
+                        id
+                        lastAcceptedRevisionEvent {
+                            createdAt
+                        }
+                        lastSubmittedRevisionEvent {
+                            createdAt
+                        }
+                        lastCommentEvent {
+                            createdAt
+                        }
+                        evidenceItems {
+                            totalCount
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """
+
+    def gql(self, after: str, first: int = None):
+        query = {
+            "operationName": self.OPERATION_NAME,
+            "query": self.QUERY,
+            "variables": {"after": after, "first": first},
+        }
+        return query
+
+    def fetch(self, after: str, api_url: str, first: int = None):
+        try:
+            response = requests.post(
+                api_url,
+                json=self.gql(after=after, first=first)
+            )
+            return response.json()
+        except Exception as e:
+            logging.error(f"Error in {self.OPERATION_NAME}: {e}")
+            raise
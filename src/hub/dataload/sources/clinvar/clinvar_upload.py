@@ -12,11 +12,15 @@ SRC_META = {
 
 class ClinvarBaseUploader(SnpeffPostUpdateUploader):
     storage_class = MyVariantTrimmingStorage
+    # parse the xml file with `clinvar_doc_streamer()` (lxml iterparse + process pool)
+    # instead of the single-process `clinvar_doc_feeder()`
+    STREAMING_PARSER = True
 
     def get_pinfo(self):
         pinfo = super(ClinvarBaseUploader,self).get_pinfo()
-        # clinvar parser has some memory requirements, ~1.5G
-        pinfo.setdefault("__reqs__", {})["mem"] = 1.5 * (1024**3)
+        # clinvar docs are sorted on disk (see `utils.extsort`), memory is bounded by the sort buffer
+        # plus the xml parsing, ~0.5G
+        pinfo.setdefault("__reqs__", {})["mem"] = 0.5 * (1024**3)
         return pinfo
 
     @classmethod
@@ -242,7 +246,7 @@ class ClinvarHG19Uploader(ClinvarBaseUploader):
     def load_data(self, data_folder):
         self.logger.info("Load data from folder '%s'" % data_folder)
         try:
-            return load_common(data_folder, "hg19")
+            return load_common(data_folder, "hg19", streaming=self.__class__.STREAMING_PARSER)
         except Exception as e:
             import traceback
             self.logger.error("Error while uploading, %s:\n%s" % (e, traceback.format_exc()))
@@ -262,7 +266,7 @@ class ClinvarHG38Uploader(ClinvarBaseUploader):
     def load_data(self, data_folder):
         self.logger.info("Load data from folder '%s'" % data_folder)
         try:
-            return load_common(data_folder, "hg38")
+            return load_common(data_folder, "hg38", streaming=self.__class__.STREAMING_PARSER)
         except Exception as e:
             import traceback
             self.logger.error("Error while uploading, %s:\n%s" % (e,traceback.format_exc()))
@@ -18,11 +18,18 @@ through its XSD, https://ftp.ncbi.nlm.nih.gov/pub/clinvar/clinvar_public.xsd.
 
     1. Group all the document by `doc['_id']`, and then inside each group, merge all the `doc['clinvar']['rcv']`.
         Each group of documents will be merged into a single document.
+
+`clinvar_doc_streamer()` is an alternative to `clinvar_doc_feeder()`. It streams the xml file with `lxml.etree.iterparse`
+(clearing each `<ClinVarSet>` element once it's serialized), and converts batches of `<ClinVarSet>` blocks into clinvar
+documents in a process pool. Documents are produced by the same `_map_public_set_to_json()` function.
 """
 
 import glob
+import gzip
 import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from itertools import groupby
 
 import biothings
@@ -30,10 +37,16 @@ import config
 biothings.config_for_app(config)
 
 from biothings.utils.dataload import unlist, dict_sweep, value_convert_to_number, rec_handler
+from utils.extsort import external_sort, DEFAULT_MEMORY_LIMIT
 
 GLOB_PATTERN = "ClinVarFullRelease_*.xml.gz"
 clinvarlib = None
 
+# number of `<ClinVarSet>` blocks sent to a worker process at once
+STREAM_BATCH_SIZE = 1000
+# number of worker processes for `clinvar_doc_streamer()`; None means `os.cpu_count()`
+STREAM_WORKERS = None
+
 
 def import_clinvar_lib(data_folder):
     # a python lib is generated on the fly, in data folder
@@ -44,25 +57,25 @@ def import_clinvar_lib(data_folder):
 
 
 def merge_rcv_accession(docs):
-    doc_groups = []
+    # `docs` must be sorted by `_id`, so documents with the same `_id` are adjacent
+    n_groups = 0
     for key, group in groupby(docs, lambda x: x['_id']):
-        doc_groups.append(list(group))
-
-    # get the number of groups, and unique keys
-    logging.info("number of groups: %s" % len(doc_groups))
+        n_groups += 1
+        doc_list = list(group)
 
-    # Each group is a list of documents
-    # Loop through each group, if doc number >1, merge rcv accessions
-    for doc_list in doc_groups:
+        # if doc number >1, merge rcv accessions
         if len(doc_list) == 1:
             yield doc_list[0]
         else:
             rcv_list = [doc['clinvar']['rcv'] for doc in doc_list]
-            
+
             merged_doc = doc_list[0]
             merged_doc['clinvar']['rcv'] = rcv_list
             yield merged_doc
 
+    # get the number of groups, and unique keys
+    logging.info("number of groups: %s" % n_groups)
+
 
 def _map_measure_to_json(measure_obj, hg19=True):
     """
@@ -464,7 +477,84 @@ def clinvar_doc_feeder(input_file, hg19: bool):
             yield doc
 
 
-def load_data(data_folder, version):
+def iter_clinvar_set_blocks(input_file):
+    """
+    Stream the xml file with `lxml.etree.iterparse`, and yield each `<ClinVarSet>` element serialized as a string.
+
+    Each element is cleared (along with its already-processed siblings) right after serialization, so the memory
+    footprint doesn't grow with the size of the file.
+    """
+    from lxml import etree
+
+    with gzip.open(input_file, "rb") as in_f:
+        for _, elem in etree.iterparse(in_f, events=("end",), tag="ClinVarSet", huge_tree=True):
+            yield etree.tostring(elem, encoding="unicode")
+
+            elem.clear()
+            # `<ClinVarSet>` elements are children of `<ReleaseSet>`, drop references to those already processed
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def _init_clinvar_worker(data_folder):
+    import logging as loggingmod
+    global logging
+    logging = loggingmod.getLogger("clinvar_upload")
+
+    import_clinvar_lib(data_folder)
+
+
+def _map_clinvar_set_blocks(clinvar_set_blocks, hg19: bool):
+    """
+    Convert a batch of `<ClinVarSet>...</ClinVarSet>` blocks into a list of clinvar documents.
+    Run inside worker processes of `clinvar_doc_streamer()`.
+    """
+    docs = []
+    for clinvar_set_block in clinvar_set_blocks:
+        try:
+            public_set_obj = clinvarlib.parseString(clinvar_set_block, silence=1)
+        except:
+            logging.debug(clinvar_set_block)
+            raise
+
+        docs.extend(_map_public_set_to_json(public_set_obj, hg19))
+    return docs
+
+
+def _iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def clinvar_doc_streamer(input_file, data_folder, hg19: bool, batch_size=STREAM_BATCH_SIZE, workers=STREAM_WORKERS):
+    """
+    Streaming counterpart of `clinvar_doc_feeder()`, yielding the same documents in the same order.
+
+    `<ClinVarSet>` blocks are read incrementally by `iter_clinvar_set_blocks()`, grouped into batches of `batch_size`,
+    and converted by a pool of `workers` processes. At most `2 * workers` batches are pending at any time so that a
+    slow consumer doesn't let the parsed blocks pile up in memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = 2 * workers
+
+    blocks = iter_clinvar_set_blocks(input_file)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_clinvar_worker, initargs=(data_folder,)) as executor:
+        pending = deque()
+        for batch in _iter_batches(blocks, batch_size):
+            pending.append(executor.submit(_map_clinvar_set_blocks, batch, hg19))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def load_data(data_folder, version, streaming=False, sort_memory_limit=DEFAULT_MEMORY_LIMIT):
     # try to get logger from uploader
     import logging as loggingmod
     global logging
@@ -476,14 +566,18 @@ def load_data(data_folder, version):
     assert len(files) == 1, "Expecting only one file matching '%s', got: %s" % (GLOB_PATTERN, files)
     input_file = files[0]
 
-    doc_generator = clinvar_doc_feeder(input_file, hg19=(version == "hg19"))
+    if streaming:
+        doc_generator = clinvar_doc_streamer(input_file, data_folder, hg19=(version == "hg19"))
+    else:
+        doc_generator = clinvar_doc_feeder(input_file, hg19=(version == "hg19"))
 
     # Sorting is necessary because `merge_rcv_accession` will call `itertools.groupby()`
-    #   which cannot put non-adjacent items with the same key into a group
-    doc_list = list(doc_generator)
-    doc_list = sorted(doc_list, key=lambda k: k['_id'])
+    #   which cannot put non-adjacent items with the same key into a group.
+    # The sort is disk-backed so memory doesn't grow with the size of the ClinVar release.
+    sorted_doc_generator = external_sort(doc_generator, key=lambda k: k['_id'],
+                                         memory_limit=sort_memory_limit, tmp_dir=data_folder)
 
-    merged_doc_generator = merge_rcv_accession(doc_list)
+    merged_doc_generator = merge_rcv_accession(sorted_doc_generator)
     return merged_doc_generator
 
 
@@ -7,8 +7,8 @@ from .dbnsfp_mapping_48a_v2 import mapping as mapping_v2
 from .dbnsfp_parser_48a_v2 import load_file as load_file_v2
 
 import biothings.hub.dataload.uploader as uploader
-from hub.dataload.uploader import SnpeffPostUpdateUploader
-from hub.dataload.storage import MyVariantIgnoreDuplicatedStorage
+from hub.dataload.uploader import SnpeffPostUpdateUploader, SortedRunsUploader
+from hub.dataload.storage import MyVariantIgnoreDuplicatedRunsStorage
 
 
 SRC_META = {
@@ -18,9 +18,9 @@ SRC_META = {
 }
 
 
-class DBNSFPBaseUploaderV1(uploader.ParallelizedSourceUploader, SnpeffPostUpdateUploader):
+class DBNSFPBaseUploaderV1(SortedRunsUploader, uploader.ParallelizedSourceUploader, SnpeffPostUpdateUploader):
 
-    storage_class = MyVariantIgnoreDuplicatedStorage
+    storage_class = MyVariantIgnoreDuplicatedRunsStorage
     GLOB_PATTERN = "dbNSFP*_variant.chr*"
 
     @classmethod
@@ -37,9 +37,9 @@ class DBNSFPBaseUploaderV1(uploader.ParallelizedSourceUploader, SnpeffPostUpdate
         return load_file_v1(path, assembly=assembly)
 
 
-class DBNSFPBaseUploaderV2(uploader.ParallelizedSourceUploader, SnpeffPostUpdateUploader):
+class DBNSFPBaseUploaderV2(SortedRunsUploader, uploader.ParallelizedSourceUploader, SnpeffPostUpdateUploader):
 
-    storage_class = MyVariantIgnoreDuplicatedStorage
+    storage_class = MyVariantIgnoreDuplicatedRunsStorage
     GLOB_PATTERN = "dbNSFP*_variant.chr*"
 
     @classmethod
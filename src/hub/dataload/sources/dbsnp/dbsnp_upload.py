@@ -2,8 +2,8 @@ import glob, os
 
 from .dbsnp_json_parser import load_data_file
 import biothings.hub.dataload.uploader as uploader
-from hub.dataload.uploader import SnpeffPostUpdateUploader
-from hub.dataload.storage import MyVariantIgnoreDuplicatedStorage
+from hub.dataload.uploader import SnpeffPostUpdateUploader, SortedRunsUploader
+from hub.dataload.storage import MyVariantIgnoreDuplicatedRunsStorage
 
 
 SRC_META = {
@@ -13,9 +13,9 @@ SRC_META = {
 }
 
 
-class DBSNPBaseUploader(uploader.ParallelizedSourceUploader, SnpeffPostUpdateUploader):
+class DBSNPBaseUploader(SortedRunsUploader, uploader.ParallelizedSourceUploader, SnpeffPostUpdateUploader):
 
-    storage_class = MyVariantIgnoreDuplicatedStorage
+    storage_class = MyVariantIgnoreDuplicatedRunsStorage
 
     def jobs(self):
         files = glob.glob(os.path.join(self.data_folder, "refsnp-chr*.json.bz2"))
@@ -1,74 +1,21 @@
 import os
-import requests
-from collections import defaultdict
 
 from biothings.utils.dataload import dict_sweep, value_convert_to_number, unlist, open_anyfile
+from utils.extsort import external_groupby, unique_sorted, DEFAULT_MEMORY_LIMIT
+from utils.clingen import ClingenResolver, default_cache_path
 
 
-class DictQuery(dict):
-    """Parse nested dictionary
-    """
-    def get(self, path, default=None):
-        """Extract value from dictionary based on path
-        """
-        keys = path.split("/")
-        val = None
-
-        for key in keys:
-            if val:
-                if isinstance(val, list):
-                    val = [v.get(key, default) if v else None for v in val]
-                else:
-                    val = val.get(key, default)
-            else:
-                val = dict.get(self, key, default)
-
-            if not val:
-                break
-        return val
-
-
-def batch_query_myvariant_id_from_clingen(hgvs_ids, assembly):
+def batch_query_myvariant_id_from_clingen(hgvs_ids, assembly, cache_path, offline=False):
     """Query ClinGen to get myvariant IDs for all input non genomic hgvs IDs
 
     Keyword arguments:
     hgvs_ids -- list of non genomic hgvs IDs
     assembly -- genomic assembly, either hg19 or hg38
+    cache_path -- path to the persistent cache of resolved ids (see `utils.clingen.ClingenResolver`)
+    offline -- only resolve ids from the cache, without querying ClinGen
     """
-    def parse_myvariant_ids(doc, assembly):
-        """Parse the results from clingen to retrieve myvariant id
-
-        Keyword arguments:
-        doc -- doc retrieved from clingen
-        """
-        ASSEMBLY_MAPPING = {
-            "hg19": "MyVariantInfo_hg19",
-            "hg38": "MyVariantInfo_hg38"
-        }
-        extract_path = 'externalRecords/' + ASSEMBLY_MAPPING[assembly]
-        res = DictQuery(doc).get(extract_path)
-        if res:
-            return [_doc['id'] for _doc in res if _doc]
-        else:
-            return []
-
-    hgvs_dict = {}
-    hgvs_ids = list(set(hgvs_ids))
-    for i in range(0, len(hgvs_ids), 1000):
-        if i + 1000 <= len(hgvs_ids):
-            batch = hgvs_ids[i: i + 1000]
-        else:
-            batch = hgvs_ids[i:]
-        data = '\n'.join(batch)
-        res = requests.post('http://reg.genome.network/alleles?file=hgvs',
-                            data=data,
-                            headers={'content-type': "text/plain"}).json()
-        # loop through clingen results and input hgvs id in parallel
-        # construct a mapping dictionary with key as input hgvs id
-        # and value as myvariant hgvs id
-        for _doc, _id in zip(res, batch):
-            hgvs_dict[_id] = parse_myvariant_ids(_doc, assembly)
-    return hgvs_dict
+    with ClingenResolver(cache_path=cache_path, offline=offline) as resolver:
+        return resolver.resolve(hgvs_ids, assembly)
 
 
 def _map_line_to_json(fields):
@@ -88,20 +35,31 @@ def _map_line_to_json(fields):
     return unlist(dict_sweep(value_convert_to_number(one_snp_json), vals=[""]))
 
 
-def load_data(data_folder, assembly="hg19"):
+def load_data(data_folder, assembly="hg19", memory_limit=DEFAULT_MEMORY_LIMIT, clingen_offline=False):
     """Load data from EMV csv file into list of JSON docs
     """
     input_file = os.path.join(data_folder, "EmVClass.2018-Q2.csv")
     assert os.path.exists(input_file), "Can't find input file '%s'" % input_file
-    with open_anyfile(input_file) as in_f:
-        lines = set(list(in_f))
-        lines = [_doc.strip().split(',') for _doc in lines]
-        results = defaultdict(list)
-        # mapping non genomic hgvs ids to genomic hgvs ids used in MyVariant
-        hgvs_ids = [_item[4] for _item in lines]
-        hgvs_mapping_dict = batch_query_myvariant_id_from_clingen(hgvs_ids, assembly)
-        # loop through csv doc to convert into json docs
-        for row in lines:
+
+    # non genomic hgvs ids, collected while the lines are sorted (only the ids are kept in memory, not the lines)
+    hgvs_ids = set()
+
+    def read_lines(in_f):
+        for line in in_f:
+            hgvs_ids.add(line.strip().split(',')[4])
+            yield line
+
+    def variant_generator(in_f):
+        hgvs_mapping_dict = None
+        # remove duplicated lines if any. The whole file is read before the first line comes out, so all the ids
+        # are known by then
+        for line in unique_sorted(read_lines(in_f), memory_limit=memory_limit, tmp_dir=data_folder):
+            if hgvs_mapping_dict is None:
+                # mapping non genomic hgvs ids to genomic hgvs ids used in MyVariant
+                hgvs_mapping_dict = batch_query_myvariant_id_from_clingen(hgvs_ids, assembly,
+                                                                          cache_path=default_cache_path(data_folder),
+                                                                          offline=clingen_offline)
+            row = line.strip().split(',')
             # structure the content of emv docs
             variant = _map_line_to_json(row)
             # fetch corresponding genomic hgvs ids
@@ -109,8 +67,13 @@ def load_data(data_folder, assembly="hg19"):
             # could be one non-genomic hgvs id mapping to mulitple genomic ones
             if mapped_ids:
                 for _id in mapped_ids:
-                    results[_id].append(variant)
-        for k, v in results.items():
+                    yield _id, variant
+
+    with open_anyfile(input_file) as in_f:
+        variant_groups = external_groupby(variant_generator(in_f), key=lambda item: item[0],
+                                          memory_limit=memory_limit, tmp_dir=data_folder)
+        for k, group in variant_groups:
+            v = [variant for _, variant in group]
             if len(v) == 1:
                 doc = {'_id': k, 'emv': v[0]}
             else:
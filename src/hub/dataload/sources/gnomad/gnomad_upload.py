@@ -7,8 +7,8 @@ from biothings.hub.dataload.uploader import ResourceError, ParallelizedSourceUpl
 from .gnomad_v2_parser import load_genome_data as load_genome_data_v2, load_exome_data as load_exome_data_v2
 from .gnomad_v3_parser import load_genome_data as load_genome_data_v3
 from .mapping import exomes_mapping_v2, genomes_mapping_v2, genomes_mapping_v3
-from hub.dataload.uploader import SnpeffPostUpdateUploader
-from hub.dataload.storage import MyVariantIgnoreDuplicatedStorage
+from hub.dataload.uploader import SnpeffPostUpdateUploader, SortedRunsUploader
+from hub.dataload.storage import MyVariantIgnoreDuplicatedRunsStorage
 
 """
 Structure of manual upload:
@@ -55,8 +55,8 @@ SRC_META = {
 }
 
 
-class GnomadBaseUploader(SnpeffPostUpdateUploader):
-    storage_class = MyVariantIgnoreDuplicatedStorage
+class GnomadBaseUploader(SortedRunsUploader, SnpeffPostUpdateUploader):
+    storage_class = MyVariantIgnoreDuplicatedRunsStorage
 
 
 class GnomadBaseHg19Uploader(GnomadBaseUploader):
@@ -1,115 +1,96 @@
-import csv
-import requests
-from itertools import groupby
-from functools import partial
-from biothings.utils.dataload import dict_sweep, list_split, unlist, \
-                                     value_convert_to_number, merge_duplicate_rows
-import biothings.utils.mongo as mongo
-from utils.hgvs import get_hgvs_from_rsid
+import os
+from biothings.utils.common import iter_n
+from utils.extsort import external_sort, DEFAULT_MEMORY_LIMIT
+from utils.rsid import get_assembly_rsid_index
+from utils.table import TableColumn
+from utils.tabular import TabularMapper, iter_rows, merge_duplicates, number_or_list
 
 VALID_COLUMN_NO = 70
 
 
-def safe_str(s):
-    uc = s.decode('cp1252')
-    _s = uc.encode('utf8')
-    return _s
+# one column per field, in file order
+COLUMNS = [
+    None,  # NHLBIkey
+    TableColumn(name="HUPfield", dest="hupfield"),
+    TableColumn(name="LastCurationDate", dest="last_curation_date"),
+    TableColumn(name="CreationDate", dest="creation_date"),
+    TableColumn(name="SNPid(dbSNP134)", dest="srsid"),
+    TableColumn(name="chr(hg19)", dest="hg19.chr"),
+    TableColumn(name="pos(hg19)", dest="hg19.pos"),
+    TableColumn(name="PMID", dest="publication.pmid"),
+    TableColumn(name="SNPid(in paper)", dest="publication.snpid"),
+    TableColumn(name="LocationWithinPaper", dest="publication.location_within_paper"),
+    TableColumn(name="Pvalue", dest="publication.p_value"),
+    TableColumn(name="Phenotype", dest="publication.phenotype"),
+    TableColumn(name="PaperPhenotypeDescription", dest="publication.paper_phenotype_description"),
+    TableColumn(name="PaperPhenotypeCategories", dest="publication.paper_phenotype_categories"),
+    TableColumn(name="DatePub", dest="publication.date_pub"),
+    None,  # InNHGRIcat(as of 3/31/12)
+    TableColumn(name="Journal", dest="publication.journal"),
+    TableColumn(name="Title", dest="publication.title"),
+    TableColumn(name="IncludesMaleFemaleOnlyAnalyses", dest="includes_male_female_only_analyses"),
+    TableColumn(name="Exclusively Male/Female", dest="exclusively_male_female"),
+    TableColumn(name="Initial Sample Description", dest="initial_sample_description"),
+    TableColumn(name="Replication Sample Description", dest="replication_sample_description"),
+    TableColumn(name="Platform [SNPs passing QC]", dest="platform_snps_passing_qc"),
+    TableColumn(name="GWASancestryDescription", dest="gwas_ancestry_description"),
+    None,  # TotalSamples(discovery+replication)
+    TableColumn(name="TotalDiscoverySamples", dest="discovery.total_samples"),
+    TableColumn(name="European Discovery", dest="discovery.european"),
+    TableColumn(name="African Discovery", dest="discovery.african"),
+    TableColumn(name="East Asian Discovery", dest="discovery.east_asian"),
+    TableColumn(name="Indian/South Asian Discovery", dest="discovery.indian_south_asian"),
+    TableColumn(name="Hispanic Discovery", dest="discovery.hispanic"),
+    TableColumn(name="Native Discovery", dest="discovery.native"),
+    TableColumn(name="Micronesian Discovery", dest="discovery.micronesian"),
+    TableColumn(name="Arab/ME Discovery", dest="discovery.arab_me"),
+    TableColumn(name="Mixed Discovery", dest="discovery.mixed"),
+    TableColumn(name="Unspecified Discovery", dest="discovery.unspecified"),
+    TableColumn(name="Filipino Discovery", dest="discovery.filipino"),
+    TableColumn(name="Indonesian Discovery", dest="discovery.indonesian"),
+    TableColumn(name="Total replication samples", dest="replication.total_samples"),
+    TableColumn(name="European Replication", dest="replication.european"),
+    TableColumn(name="African Replication", dest="replication.african"),
+    TableColumn(name="East Asian Replication", dest="replication.east_asian"),
+    TableColumn(name="Indian/South Asian Replication", dest="replication.indian_south_asian"),
+    TableColumn(name="Hispanic Replication", dest="replication.hispanic"),
+    TableColumn(name="Native Replication", dest="replication.native"),
+    TableColumn(name="Micronesian Replication", dest="replication.micronesian"),
+    TableColumn(name="Arab/ME Replication", dest="replication.arab_me"),
+    TableColumn(name="Mixed Replication", dest="replication.mixed"),
+    TableColumn(name="Unspecified Replication", dest="replication.unspecified"),
+    TableColumn(name="Filipino Replication", dest="replication.filipino"),
+    TableColumn(name="Indonesian Replication", dest="replication.indonesian"),
+    TableColumn(name="InGene", dest="in_gene"),
+    TableColumn(name="NearestGene", dest="nearest_gene"),
+    TableColumn(name="InLincRNA", dest="in_lincrna"),
+    TableColumn(name="InMiRNA", dest="in_mirna"),
+    TableColumn(name="InMiRNABS", dest="in_mirna_bs"),
+    None,  # dbSNPfxn
+    None,  # dbSNPMAF
+    None,  # dbSNPalleles/het/se
+    None,  # dbSNPvalidation
+    None,  # dbSNPClinStatus
+    TableColumn(name="ORegAnno", dest="oreg_anno"),
+    TableColumn(name="ConservPredTFBS", dest="conserv_pred_tfbs"),
+    TableColumn(name="HumanEnhancer", dest="human_enhancer"),
+    TableColumn(name="RNAedit", dest="rna_edit"),
+    TableColumn(name="PolyPhen2", dest="polyphen2"),
+    TableColumn(name="SIFT", dest="sift"),
+    TableColumn(name="LS-SNP", dest="ls_snp"),
+    TableColumn(name="UniProt", dest="uniprot"),
+    TableColumn(name="EqtlMethMetabStudy", dest="eqtl_meth_metab_study"),
+]
+assert len(COLUMNS) == VALID_COLUMN_NO
 
+# numbers are converted, other values are split on commas
+MAPPER = TabularMapper(root="grasp", columns=COLUMNS, na_values={""}, convert=number_or_list(","))
 
-# convert one snp to json
-def _map_line_to_json(fields,dbsnp_col):
-    # lines in fh
-    assert len(fields) == VALID_COLUMN_NO
-    rsid = fields[8]
 
-    # load as json data
-    if rsid is None:
-        return
-    docs = get_hgvs_from_rsid([{"_id":rsid}], lambda d: d["_id"], dbsnp_col)
-    for doc in docs:
-        HGVS = doc['_id']
-        one_snp_json = {
-
-            "_id": HGVS,
-            "grasp":
-                {
-                    'hg19':
-                        {
-                            'chr': fields[5],
-                            'pos': fields[6]
-                        },
-                    'hupfield': fields[1],
-                    'last_curation_date': fields[2],
-                    'creation_date': fields[3],
-                    'srsid': fields[4],
-                    'publication':
-                        {
-                            'journal': fields[16],
-                            'title': fields[17],
-                            'pmid': fields[7],
-                            'snpid': fields[8],
-                            'location_within_paper': fields[9],
-                            'p_value': fields[10],
-                            'phenotype': fields[11],
-                            'paper_phenotype_description': fields[12],
-                            'paper_phenotype_categories': fields[13],
-                            'date_pub': fields[14]
-                        },
-                    'includes_male_female_only_analyses': fields[18],
-                    'exclusively_male_female': fields[19],
-                    'initial_sample_description': fields[20],
-                    'replication_sample_description': fields[21],
-                    'platform_snps_passing_qc': fields[22],
-                    'gwas_ancestry_description': fields[23],
-                    'discovery':
-                        {
-                            'total_samples': fields[25],
-                            'european': fields[26],
-                            'african': fields[27],
-                            'east_asian': fields[28],
-                            'indian_south_asian': fields[29],
-                            'hispanic': fields[30],
-                            'native': fields[31],
-                            'micronesian': fields[32],
-                            'arab_me': fields[33],
-                            'mixed': fields[34],
-                            'unspecified': fields[35],
-                            'filipino': fields[36],
-                            'indonesian': fields[37]
-                        },
-                    'replication':
-                        {
-                            'total_samples': fields[38],
-                            'european': fields[39],
-                            'african': fields[40],
-                            'east_asian': fields[41],
-                            'indian_south_asian': fields[42],
-                            'hispanic': fields[43],
-                            'native': fields[44],
-                            'micronesian': fields[45],
-                            'arab_me': fields[46],
-                            'mixed': fields[47],
-                            'unspecified': fields[48],
-                            'filipino': fields[49],
-                            'indonesian': fields[50]
-                        },
-                    'in_gene': fields[51],
-                    'nearest_gene': fields[52],
-                    'in_lincrna': fields[53],
-                    'in_mirna': fields[54],
-                    'in_mirna_bs': fields[55],
-                    'oreg_anno': fields[61],
-                    'conserv_pred_tfbs': fields[62],
-                    'human_enhancer': fields[63],
-                    'rna_edit': fields[64],
-                    'polyphen2': fields[65],
-                    'sift': fields[66],
-                    'ls_snp': fields[67],
-                    'uniprot': fields[68],
-                    'eqtl_meth_metab_study': fields[69]
-                }
-            }
-        yield list_split(dict_sweep(unlist(value_convert_to_number(one_snp_json)), [""]), ",")
+# convert one snp to json, `hgvs_ids` are the dbSNP _ids matching the rsid
+def _map_line_to_json(fields,hgvs_ids):
+    for HGVS in hgvs_ids:
+        yield MAPPER.to_doc(fields, HGVS)
 
 ''' replace None indices with '''
 
@@ -124,41 +105,43 @@ def row_generator(db_row):
             row.append('')
     return row
 
-def parse_rsid_group(data, dbsnp_col):
+def parse_rsid_group(data, rsid_index, chunk_size=10000):
     # lines are sorted by rsid, so we parse group of rsid data and
     # yield them once we reached another group
     current_rsid = None
     rsid_group = []
     # debug...
     processed = {}
-    for line in data:
-        new_rsid = line[8].strip() # 8: rsid columns
-        if new_rsid != current_rsid:
-            for row in rsid_group:
-                yield row
-            rsid_group = []
-            assert not new_rsid in processed, "Already processed: %s" % repr(new_rsid)
+    # rsids are resolved to hgvs ids by chunks of lines
+    for lines in iter_n(data, chunk_size):
+        hgvs_ids = rsid_index.get_many(line[8] for line in lines)
+        for line in lines:
+            new_rsid = line[8].strip() # 8: rsid columns
+            if new_rsid != current_rsid:
+                for row in rsid_group:
+                    yield row
+                rsid_group = []
+                assert not new_rsid in processed, "Already processed: %s" % repr(new_rsid)
 
-        rows = _map_line_to_json(line,dbsnp_col=dbsnp_col)
-        [rsid_group.append(row) for row in rows]
-        current_rsid = new_rsid
-        processed[current_rsid] = True
+            rows = _map_line_to_json(line,hgvs_ids.get(line[8], []))
+            [rsid_group.append(row) for row in rows]
+            current_rsid = new_rsid
+            processed[current_rsid] = True
+    for row in rsid_group:
+        yield row
 
 
 # open file, parse, pass to json mapper
-def load_data(input_file):
-    src_db = mongo.get_src_db()
-    if not "dbsnp_hg19" in src_db.collection_names():
-        raise ValueError("'dbsnp_hg19' collection is missing, run dbsnp uploader first")
-    dbsnp_col = src_db["dbsnp_hg19"]
-    open_file = open(input_file,encoding="cp1252")
-    open_file = csv.reader(open_file, delimiter="\t")
-    next(open_file)
-    grasp = map(row_generator, open_file)
+def load_data(input_file, memory_limit=DEFAULT_MEMORY_LIMIT):
+    # header line skipped
+    grasp = map(row_generator, iter_rows(input_file, encoding="cp1252", skip_lines=1))
     grasp = filter(lambda row: row[58] != "", grasp)
-    #json_rows = map(partial(_map_line_to_json,dbsnp_col=dbsnp_col), grasp)
-    json_rows = (row for row in parse_rsid_group(grasp,dbsnp_col))
-    #json_rows = (row for g in json_rows for row in g if row)
-    row_groups = (it for (key, it) in groupby(json_rows, lambda row: row["_id"]))
-    for row in (merge_duplicate_rows(rg, "grasp") for rg in row_groups):
-        yield row
+    # `parse_rsid_group` expects rows sorted by rsid
+    grasp = external_sort(grasp, key=lambda row: row[8].strip(), memory_limit=memory_limit,
+                          tmp_dir=os.path.dirname(input_file))
+    # built once per dbsnp_hg19 release, shared with other sources
+    with get_assembly_rsid_index("hg19") as rsid_index:
+        json_rows = (row for row in parse_rsid_group(grasp,rsid_index))
+        #json_rows = (row for g in json_rows for row in g if row)
+        for row in merge_duplicates(json_rows, "grasp"):
+            yield row
@@ -32,7 +32,8 @@ class GraspUploader(SnpeffPostUpdateUploader):
         if len(content) != 1:
             raise uploader.ResourceError("Expecting only one file in the archive, got: %s" % content)
         input_file = content.pop()
-        input_file = os.path.join(data_folder,"sorted")#input_file)
+        # rows are sorted by rsid while parsing, no need for a pre-sorted file
+        input_file = os.path.join(data_folder,input_file)
         self.logger.info("Load data from file '%s'" % input_file)
         res = load_data(input_file)
         return res
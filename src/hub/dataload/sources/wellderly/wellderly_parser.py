@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
+import bisect
 from collections import namedtuple
-from itertools import combinations_with_replacement as cwr
+from functools import lru_cache
+from itertools import combinations_with_replacement as cwr, repeat
 from utils.hgvs import _normalized_vcf
 
 # (`start`, `end`) can be different from `pos`
@@ -75,16 +78,8 @@ def format_hgvs(chrom, pos, ref, alt):
     raise ValueError("Cannot convert {} into HGVS id.".format((chrom, pos, ref, alt)))
 
 
-class Genotype:
-    def __init__(self, first_allele, second_allele):
-        self.first_allele = first_allele
-        self.second_allele = second_allele
-
-    def __str__(self):
-        return "{}/{}".format(self.first_allele, self.second_allele)
-
-
-def genotype_combinations(ref: str, alt_list: list) -> list:
+@lru_cache(maxsize=None)
+def genotype_index_combinations(alt_num: int) -> tuple:
     """
     The `GC` column (not VCF-standard) in the Wellderly tsv files represents the count of genotypes in the
     following patterns.
@@ -102,66 +97,134 @@ def genotype_combinations(ref: str, alt_list: list) -> list:
     Note that this expanding scheme seems only apply to the Wellderly tsv files.
 
     For n alleles, there would be {(n+1) choose 2} genotypes regardless of the combination order.
+
+    Return them as pairs of allele indices (0 for REF, i for the i-th ALT), e.g.
+    ((0, 0), (0, 1), (1, 1), (0, 2), (1, 2), (2, 2)) for 2 ALT alleles. The order only depends on the number of
+    alleles, so it's computed once per number of ALT alleles.
+    """
+    index_list = [(q, p) for (p, q) in cwr(reversed(range(alt_num + 1)), 2)]
+    index_list.reverse()
+    return tuple(index_list)
+
+
+@lru_cache(maxsize=4096)
+def genotype_strings(ref: str, alts: tuple) -> tuple:
+    """
+    The genotypes of `genotype_index_combinations()`, as strings (e.g. "A/T"). Most rows are SNPs, so the same
+    (REF, ALTs) come back over and over.
     """
-    # The REF must be the first allele in the list
-    allele_list = [ref] + alt_list
-    genotype_list = [Genotype(first_allele=q, second_allele=p) for (p, q) in cwr(reversed(allele_list), 2)]
-    genotype_list.reverse()
-    return genotype_list
+    allele_list = (ref,) + alts
+    return tuple("{}/{}".format(allele_list[i], allele_list[j]) for (i, j) in genotype_index_combinations(len(alts)))
 
 
 class WellderlyTsvReader:
+    # number of rows read at once by `load_data()`
+    CHUNK_SIZE = 100000
+
+    @staticmethod
+    def _split_flat(column: pd.Series):
+        """
+        Split a column of comma-separated values all at once: a list of all the values, and the offsets of the values
+        of each row in it (with the total number of values as last offset).
+        """
+        values = column.tolist()
+        offsets = np.zeros(len(values) + 1, dtype="int64")
+        np.cumsum(np.fromiter(map(str.count, values, repeat(",")), dtype="int64", count=len(values)) + 1,
+                  out=offsets[1:])
+        return ",".join(values).split(","), offsets.tolist()
+
+    @staticmethod
+    def _invalid_row(chunk: pd.DataFrame, row: int, message: str):
+        row = chunk.iloc[int(row)]
+        return ValueError("{}. Got row={}".format(message, tuple(row[["CHROM:POS", "REF", "ALT", "AC", "AF"]])))
+
     @classmethod
-    def generate_document(cls, row: pd.Series, assembly="hg19"):
-        # Read REF and ALT alleles
-        ref = row["REF"]
-
-        alt_list = row["ALT"].split(",")
-        alt_cnt = [int(ac) for ac in row["AC"].split(",")]
-        alt_freq = [float(af) for af in row["AF"].split(",")]
-        if not len(alt_list) == len(alt_cnt) == len(alt_freq):
-            raise ValueError("Inconsistent length between ALT, AC and AF fields. Got row={}".format(row.to_str()))
-
-        # Collect all alleles (REF + ALT)
-        allele_list = alt_list + [ref]
-        allele_freq = alt_freq + [1 - sum(alt_freq)]  # the `AF` column does not have the `REF` allele frequencies
-        allele_json = [{"allele": allele, "freq": freq} for (allele, freq) in zip(allele_list, allele_freq)]
-
-        # Collect all genotypes
-        genotype_cnt = [int(gc) for gc in row["GC"].split(",")]
-        genotype_list = genotype_combinations(ref=ref, alt_list=alt_list)
-
-        genotype_total = sum(genotype_cnt)
-        if genotype_total > 0:
-            genotype_freq = [cnt / genotype_total for cnt in genotype_cnt]
-        else:  # In some rare cases, `GC` can be nothing but 0's
-            genotype_freq = [0 for _ in genotype_cnt]
-        genotype_json = [{"count": cnt, "freq": freq, 'genotype': str(gt)} for (cnt, freq, gt)
-                         in zip(genotype_cnt, genotype_freq, genotype_list) if cnt > 0]
-
-        # Generate ID and document for each (REF, ALT) pair
-        chrom, pos = row["CHROM:POS"].split(":")
-        for alt in alt_list:
-            hgvsID = format_hgvs(chrom, pos, ref, alt)
-
-            document = {
-                '_id': hgvsID.id,
-                'wellderly': {
-                    'chrom': hgvsID.chrom,
-                    'pos': pos, 'ref': ref, 'alt': alt,
-                    assembly: {'start': hgvsID.start, 'end': hgvsID.end},
-                    'vartype': hgvsID.vartype,
-                    'alleles': allele_json,
-                    'genotypes': genotype_json
+    def _check_integers(cls, chunk: pd.DataFrame, column: str, values: list, offsets: list):
+        """
+        Raise a ValueError naming the first row of `chunk` with a value of `column` that isn't an integer.
+        """
+        if "".join(values).isdecimal() and all(values):
+            return
+        for index, value in enumerate(values):
+            try:
+                int(value)
+            except ValueError:
+                row = bisect.bisect_right(offsets, index) - 1
+                raise cls._invalid_row(chunk, row, "Invalid {} field, integers expected".format(column)) from None
+
+    @classmethod
+    def generate_chunk_documents(cls, chunk: pd.DataFrame, assembly="hg19"):
+        """
+        Generate the documents of a chunk of rows, one per (REF, ALT) pair, with the columns split and converted
+        column-wise.
+        """
+        alts, alt_offsets = cls._split_flat(chunk["ALT"])
+        ac, ac_offsets = cls._split_flat(chunk["AC"])
+        af, af_offsets = cls._split_flat(chunk["AF"])
+        gc, gc_offsets = cls._split_flat(chunk["GC"])
+
+        alt_nums = np.diff(alt_offsets)
+        inconsistent = (alt_nums != np.diff(ac_offsets)) | (alt_nums != np.diff(af_offsets))
+        if inconsistent.any():
+            raise cls._invalid_row(chunk, inconsistent.argmax(), "Inconsistent length between ALT, AC and AF fields")
+        # AC values must be integers (only their number is used)
+        cls._check_integers(chunk, "AC", ac, ac_offsets)
+        # AF values have the same offsets as ALT values
+        af = np.array(af, dtype=float).tolist()
+        gc = np.array(gc, dtype=object).astype("int64").tolist()
+
+        chrom_pos = chunk["CHROM:POS"].tolist()
+        fields = ":".join(chrom_pos).split(":")
+        if len(fields) != 2 * len(chrom_pos):
+            row = next(row for row, value in enumerate(chrom_pos) if value.count(":") != 1)
+            raise cls._invalid_row(chunk, row, "Invalid CHROM:POS field")
+        # trim off leading "chr" if any
+        chroms = [chrom[3:] if chrom[:3].lower() == "chr" else chrom for chrom in fields[0::2]]
+        pos_strs = fields[1::2]
+        positions = np.array(pos_strs, dtype=object).astype("int64").tolist()
+        refs = chunk["REF"].tolist()
+
+        for chrom, pos, position, ref, alt_start, alt_end, gc_start, gc_end in zip(
+                chroms, pos_strs, positions, refs, alt_offsets, alt_offsets[1:], gc_offsets, gc_offsets[1:]):
+            alt_list = alts[alt_start:alt_end]
+
+            # Collect all alleles (ALT + REF), the `AF` column does not have the `REF` allele frequencies
+            alt_freqs = af[alt_start:alt_end]
+            allele_json = [{"allele": allele, "freq": freq} for (allele, freq) in zip(alt_list, alt_freqs)]
+            allele_json.append({"allele": ref, "freq": 1 - sum(alt_freqs)})
+
+            # Collect all genotypes, in some rare cases, `GC` can be nothing but 0's
+            genotype_cnt = gc[gc_start:gc_end]
+            genotype_total = sum(genotype_cnt) or 1
+            genotype_json = [{"count": cnt, "freq": cnt / genotype_total, 'genotype': gt} for (cnt, gt)
+                             in zip(genotype_cnt, genotype_strings(ref, tuple(alt_list))) if cnt > 0]
+
+            # Generate ID and document for each (REF, ALT) pair, SNPs (most of the variants) directly
+            for alt in alt_list:
+                if len(ref) == len(alt) == 1:
+                    _id, start, end, vartype = f"chr{chrom}:g.{position}{ref}>{alt}", position, position, "snp"
+                else:
+                    _id, _, start, end, vartype = format_hgvs(chrom, position, ref, alt)
+
+                document = {
+                    '_id': _id,
+                    'wellderly': {
+                        'chrom': chrom,
+                        'pos': pos, 'ref': ref, 'alt': alt,
+                        assembly: {'start': start, 'end': end},
+                        'vartype': vartype,
+                        'alleles': allele_json,
+                        'genotypes': genotype_json
+                    }
                 }
-            }
 
-            yield document
+                yield document
 
     @classmethod
-    def load_data(cls, file, assembly="hg19"):
+    def load_data(cls, file, assembly="hg19", chunksize=None):
         # Skip 'AN' column
         data_types = {"CHROM:POS": str, "REF": str, "ALT": str, "AC": str, "GC": str, "AF": str}
-        df = pd.read_csv(file, sep="\t", usecols=data_types.keys(), dtype=data_types)
-        for _, row in df.iterrows():
-            yield from cls.generate_document(row, assembly)
+        reader = pd.read_csv(file, sep="\t", usecols=data_types.keys(), dtype=data_types,
+                             chunksize=chunksize or cls.CHUNK_SIZE)
+        for chunk in reader:
+            yield from cls.generate_chunk_documents(chunk, assembly)
@@ -1,9 +1,23 @@
+import os
+
 from biothings.hub.dataload.storage import BasicStorage, IgnoreDuplicatedStorage
+from biothings import config as btconfig
 from utils.hgvs import DocEncoder
+from utils.sortedruns import RunWriter
 from config import MAX_REF_ALT_LEN, MAX_ID_LENGTH
 from collections.abc import Mapping
 
 
+def get_runs_folder():
+    """
+    Root folder of the sorted runs written by uploaders, one sub-folder per collection (None if disabled).
+    """
+    folder = getattr(btconfig, "SORTED_RUNS_FOLDER", None)
+    if folder is None:
+        folder = os.path.join(btconfig.DATA_ARCHIVE_ROOT, "sorted_runs")
+    return folder or None
+
+
 class MyVariantBasicStorage(BasicStorage):
     """
     Extended from BasicStorage, providing new implementation of `check_doc_func()` method which encode long HGVS IDs.
@@ -96,3 +110,33 @@ class MyVariantTrimmingStorage(MyVariantBasicStorage):
 
 class MyVariantIgnoreDuplicatedStorage(MyVariantBasicStorage, IgnoreDuplicatedStorage):
     pass
+
+
+class SortedRunsStorageMixin:
+    """
+    Storage mixin also writing the stored documents (once checked) as sorted runs (see utils.sortedruns), into the
+    runs folder of the collection being uploaded, so the builder can merge them without reading the collection back.
+    """
+    _run_writer = None
+
+    def process(self, iterable, *args, **kwargs):
+        runs_folder = get_runs_folder()
+        if not runs_folder:
+            return super().process(iterable, *args, **kwargs)
+
+        with RunWriter(os.path.join(runs_folder, self.temp_collection.name)) as self._run_writer:
+            total = super().process(iterable, *args, **kwargs)
+            counts = self._run_writer.commit()
+        self._run_writer = None
+        self.logger.info("Wrote sorted runs of %d documents" % sum(counts.values()))
+        return total
+
+    def doc_iterator(self, *args, **kwargs):
+        for doc_li in super().doc_iterator(*args, **kwargs):
+            if self._run_writer is not None and doc_li:
+                self._run_writer.extend(doc_li if isinstance(doc_li, list) else [doc_li])
+            yield doc_li
+
+
+class MyVariantIgnoreDuplicatedRunsStorage(SortedRunsStorageMixin, MyVariantIgnoreDuplicatedStorage):
+    pass
@@ -1,6 +1,7 @@
 import glob
 import os
 import math
+import shutil
 
 import biothings.hub.dataload.uploader as uploader
 from biothings.hub.dataload.storage import UpsertStorage
@@ -10,7 +11,7 @@ from biothings.utils.common import iter_n
 
 import hub.dataload.sources.snpeff.snpeff_upload as snpeff_upload
 import hub.dataload.sources.snpeff.snpeff_parser as snpeff_parser
-from hub.dataload.storage import MyVariantBasicStorage
+from hub.dataload.storage import MyVariantBasicStorage, MyVariantIgnoreDuplicatedRunsStorage, get_runs_folder
 from utils.hgvs import get_pos_start_end
 from config import MAX_REF_ALT_LEN
 
@@ -118,6 +119,33 @@ class SnpeffPostUpdateUploader(uploader.BaseSourceUploader):
         self.do_snpeff(force=force, force_use_cache=force_use_cache)
 
 
+class SortedRunsUploader(uploader.BaseSourceUploader):
+    """
+    Uploader also writing its documents as sorted runs (see utils.sortedruns), so builders can merge the source from
+    its runs (see MyVariantDataBuilder.merge_by_chrom()). Runs are written next to the temp collection and replace
+    the previous runs of the collection when the temp collection is switched.
+    """
+    storage_class = MyVariantIgnoreDuplicatedRunsStorage
+
+    def switch_collection(self):
+        super(SortedRunsUploader, self).switch_collection()
+        runs_folder = get_runs_folder()
+        if not runs_folder:
+            return
+        temp_dir = os.path.join(runs_folder, self.temp_collection_name)
+        run_dir = os.path.join(runs_folder, self.collection_name)
+        if not os.path.exists(temp_dir):
+            self.logger.warning("No sorted runs found in '%s'" % temp_dir)
+            return
+        if os.path.exists(run_dir):
+            shutil.rmtree(run_dir)
+        os.rename(temp_dir, run_dir)
+        self.logger.info("Sorted runs of '%s' moved to '%s'" % (self.collection_name, run_dir))
+        # runs left by failed uploads
+        for stale_dir in glob.glob(os.path.join(runs_folder, self.collection_name + "_temp_*")):
+            shutil.rmtree(stale_dir, ignore_errors=True)
+
+
 def annotate_start_end(hgvs_vcfs, assembly):
     for hgvs_id in hgvs_vcfs:
         st, end = None, None
@@ -0,0 +1,214 @@
+import json
+import unittest
+from types import SimpleNamespace
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, ObjectApiResponse
+from elasticsearch import ApiError
+from elasticsearch._otel import OpenTelemetry
+from elasticsearch.helpers import BulkIndexError
+
+import biothings.hub  # noqa: F401, sets biothings.config up, as the hub does before loading its modules
+
+from hub.dataindex.bulk import AdaptiveBulkSender, BulkMetrics, ConcurrencyLimit
+
+
+class FakeSerializer:
+    def dumps(self, data):
+        return data if isinstance(data, (str, bytes)) else json.dumps(data)
+
+
+class FakeClient:
+    """
+    Just enough of an Elasticsearch client for AdaptiveBulkSender: documents are indexed in `docs` (by `_id`, with
+    their routing), unless `statuses` has a status for their next attempt, and each bulk request is recorded (as its
+    list of `_id`s) in `requests`. Requests are rejected as a whole (with a 429) while `rejected` starts with True.
+    """
+    def __init__(self, statuses=None, rejected=()):
+        self.statuses = statuses or {}
+        self.rejected = list(rejected)
+        self.docs = {}
+        self.requests = []
+        # used by elasticsearch.helpers.bulk
+        self._otel = OpenTelemetry(enabled=False)
+        self.transport = SimpleNamespace(serializers=SimpleNamespace(get_serializer=lambda mimetype: FakeSerializer()))
+
+    def options(self, **kwargs):
+        return self
+
+    def mget(self, body, index=None, _source=True):
+        docs = []
+        for spec in body["docs"]:
+            routing, source = self.docs.get(spec["_id"], (None, None))
+            # as with Elasticsearch, a document is only found with its routing
+            if source is not None and spec.get("routing") == routing:
+                docs.append({"_id": spec["_id"], "found": True, "_source": dict(source)})
+            else:
+                docs.append({"_id": spec["_id"], "found": False})
+        return {"docs": docs}
+
+    def bulk(self, body=None, index=None, operations=None, **kwargs):
+        if operations is not None:
+            body = "\n".join(op.decode() if isinstance(op, bytes) else op for op in operations)
+        rejected = bool(self.rejected) and self.rejected.pop(0)
+        lines = iter(body.splitlines())
+        items, ids = [], []
+        for line in lines:
+            (op_type, action), = json.loads(line).items()
+            source = json.loads(next(lines)) if op_type == "index" else None
+            ids.append(action["_id"])
+            if rejected:
+                continue
+            status = self.statuses.get(action["_id"], []).pop(0) if self.statuses.get(action["_id"]) else None
+            if op_type == "delete":
+                status = status or (200 if self.docs.pop(action["_id"], None) else 404)
+            else:
+                status = status or 201
+                if status < 300:
+                    self.docs[action["_id"]] = (action.get("routing"), source)
+            items.append({op_type: {"_id": action["_id"], "status": status}})
+        self.requests.append(ids)
+        if rejected:
+            raise ApiError("rejected", ApiResponseMeta(429, "1.1", HttpHeaders(), 0.0, None), {})
+        body = {"errors": any(next(iter(item.values()))["status"] >= 300 for item in items), "items": items}
+        return ObjectApiResponse(body=body, meta=ApiResponseMeta(200, "1.1", HttpHeaders(), 0.0, None))
+
+
+def make_docs(count):
+    return [{"_id": "chr1:g.%dA>G" % pos, "chrom": "1", "pos": pos} for pos in range(1, count + 1)]
+
+
+class TestAdaptiveBulkSender(unittest.TestCase):
+    def make_sender(self, client, **kwargs):
+        # about 2 docs by request, no backoff
+        kwargs = dict(dict(target_bytes=200, max_concurrency=2, initial_backoff=0, max_backoff=0), **kwargs)
+        return AdaptiveBulkSender(client, "myvariant_test", **kwargs)
+
+    def test_index(self):
+        client = FakeClient()
+        sender = self.make_sender(client)
+        metrics = sender.index(make_docs(10))
+        self.assertEqual({doc["_id"] for doc in make_docs(10)}, set(client.docs))
+        self.assertEqual((None, {"chrom": "1", "pos": 3}), client.docs["chr1:g.3A>G"])
+        self.assertGreater(len(client.requests), 1)
+        self.assertEqual(10, sum(map(len, client.requests)))
+        self.assertEqual(10, metrics["docs"])
+        self.assertEqual(len(client.requests), metrics["requests"])
+        self.assertEqual(0, metrics["rejected"])
+        self.assertEqual(0, metrics["retried"])
+
+    def test_routing(self):
+        client = FakeClient()
+        sender = self.make_sender(client, routing=True)
+        sender.index([{"_id": "chrX:g.5A>G", "pos": 5}, {"_id": "chrMT:g.5A>G", "pos": 5}])
+        self.assertEqual("X", client.docs["chrX:g.5A>G"][0])
+        self.assertEqual("MT", client.docs["chrMT:g.5A>G"][0])
+
+    def test_retry_rejected_items_only(self):
+        docs = make_docs(6)
+        client = FakeClient(statuses={docs[1]["_id"]: [429], docs[2]["_id"]: [503], docs[3]["_id"]: [400]})
+        sender = self.make_sender(client)
+        with self.assertRaises(BulkIndexError) as ctx:
+            sender.index([dict(doc) for doc in docs])
+        # the 400 item failed the batch, without being sent again
+        self.assertEqual([{"index": {"_id": docs[3]["_id"], "status": 400}}], ctx.exception.errors)
+        sent = [_id for request in client.requests for _id in request]
+        self.assertEqual(2, sent.count(docs[1]["_id"]))
+        self.assertEqual(2, sent.count(docs[2]["_id"]))
+        self.assertEqual(1, sent.count(docs[3]["_id"]))
+        self.assertEqual(8, len(sent))
+        self.assertEqual({doc["_id"] for doc in docs} - {docs[3]["_id"]}, set(client.docs))
+
+        metrics = sender.metrics
+        self.assertEqual(5, metrics["docs"])
+        self.assertEqual(2, metrics["rejected"])
+        self.assertEqual(2, metrics["retried"])
+        self.assertEqual(len(client.requests), metrics["requests"])
+
+    def test_give_up(self):
+        docs = make_docs(4)
+        client = FakeClient(statuses={docs[0]["_id"]: [429] * 10})
+        sender = self.make_sender(client, max_retries=2)
+        with self.assertRaises(BulkIndexError) as ctx:
+            sender.index([dict(doc) for doc in docs])
+        self.assertEqual([{"index": {"_id": docs[0]["_id"], "status": 429, "error": "too many retries"}}],
+                         ctx.exception.errors)
+        sent = [_id for request in client.requests for _id in request]
+        # first attempt and max_retries retries
+        self.assertEqual(3, sent.count(docs[0]["_id"]))
+        self.assertEqual({doc["_id"] for doc in docs[1:]}, set(client.docs))
+
+        metrics = sender.metrics
+        self.assertEqual(3, metrics["docs"])
+        self.assertEqual(3, metrics["rejected"])
+        self.assertEqual(2, metrics["retried"])
+        self.assertEqual(len(client.requests), metrics["requests"])
+
+    def test_rejected_request(self):
+        docs = make_docs(2)
+        client = FakeClient(rejected=[True])
+        sender = self.make_sender(client, target_bytes=10 * 1024)
+        metrics = sender.index([dict(doc) for doc in docs])
+        # the whole request is sent again
+        self.assertEqual([[doc["_id"] for doc in docs]] * 2, client.requests)
+        self.assertEqual({doc["_id"] for doc in docs}, set(client.docs))
+        self.assertEqual(2, metrics["docs"])
+        self.assertEqual(2, metrics["rejected"])
+        self.assertEqual(2, metrics["retried"])
+        self.assertEqual(2, metrics["requests"])
+
+    def test_backoff(self):
+        sender = self.make_sender(FakeClient(), initial_backoff=1.0, max_backoff=5.0)
+        self.assertEqual([0, 1.0, 2.0, 4.0, 5.0], [sender.backoff(attempt) for attempt in range(5)])
+
+    def test_delete(self):
+        docs = make_docs(3)
+        client = FakeClient()
+        sender = self.make_sender(client)
+        sender.index([dict(doc) for doc in docs])
+        self.assertEqual((2, 1), sender.delete([docs[0]["_id"], docs[1]["_id"], "chr1:g.100A>G"]))
+        self.assertEqual({docs[2]["_id"]}, set(client.docs))
+
+        client.statuses = {docs[2]["_id"]: [500]}
+        with self.assertRaises(BulkIndexError):
+            sender.delete([docs[2]["_id"]])
+
+
+class TestConcurrencyLimit(unittest.TestCase):
+    def test_aimd(self):
+        limit = ConcurrencyLimit(max_concurrency=4, target_latency=1.0)
+        self.assertEqual(2, limit.value)
+        limit.on_response(0.5)
+        limit.on_response(0.5)
+        limit.on_response(0.5)
+        self.assertEqual(4, limit.value)
+        limit.on_response(2.0)
+        self.assertEqual(3, limit.value)
+        limit.on_rejection()
+        self.assertEqual(1, limit.value)
+        limit.on_rejection()
+        limit.on_response(2.0)
+        self.assertEqual(1, limit.value)
+
+    def test_single(self):
+        limit = ConcurrencyLimit(max_concurrency=1, target_latency=1.0)
+        self.assertEqual(1, limit.value)
+        limit.on_response(0.5)
+        self.assertEqual(1, limit.value)
+
+
+class TestBulkMetrics(unittest.TestCase):
+    def test_add(self):
+        first = BulkMetrics(docs=10, requests=2, rejected=1, retried=1, min_concurrency=1, max_concurrency=2)
+        second = BulkMetrics(docs=5, requests=1, skipped=3, max_concurrency=4)
+        total = first + second
+        self.assertEqual(15, total["docs"])
+        self.assertEqual(3, total["requests"])
+        self.assertEqual(1, total["rejected"])
+        self.assertEqual(3, total["skipped"])
+        self.assertEqual(1, total["min_concurrency"])
+        self.assertEqual(4, total["max_concurrency"])
+        self.assertIsNone((BulkMetrics() + BulkMetrics())["min_concurrency"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,305 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from itertools import groupby
+
+from biothings.utils.dataload import dict_sweep, unlist, value_convert_to_number, merge_duplicate_rows
+
+import hub.dataload.sources.cadd.cadd_parser as cadd_parser
+import utils.cadd as utils_cadd
+from hub.dataload.sources.cadd.cadd_parser import VALID_COLUMN_NO, _map_line_to_json, iter_regions, merge_duplicates
+from utils.hgvs import get_hgvs_from_vcf
+from utils.posindex import PositionIndex, build_position_index
+
+
+# hand-written mapping replaced by the declarative columns, kept as reference
+def legacy_map_line_to_json(fields):
+    assert len(fields) == VALID_COLUMN_NO
+    chrom = fields[0]
+    chromStart = fields[1]
+    ref = fields[2]
+    alt = fields[4]
+    HGVS = get_hgvs_from_vcf(chrom, chromStart, ref, alt)
+
+    # load as json data
+    if HGVS is None:
+        return
+    one_snp_json = {
+        "_id": HGVS,
+        "cadd": {
+            'chrom': fields[0],
+            'pos': fields[1],
+            'ref': fields[2],
+            'anc': fields[3],
+            'alt': fields[4],
+            'type': fields[5],
+            'length': fields[6],
+            'istv': fields[7],
+            'isderived': fields[8],
+            'annotype': fields[9],
+            'consequence': fields[10],
+            'consscore': fields[11],
+            'consdetail': fields[12],
+            'gc': fields[13],
+            'cpg': fields[14],
+            'mapability': {
+                '20bp': fields[15],
+                '35bp': fields[16]
+            },
+            'scoresegdup': fields[17],
+            'phast_cons': {
+                'primate': fields[18],
+                'mammalian': fields[19],
+                'vertebrate': fields[20]
+            },
+            'phylop': {
+                'primate': fields[21],
+                'mammalian': fields[22],
+                'vertebrate': fields[23]
+            },
+            'gerp': {
+                'n': fields[24],
+                's': fields[25],
+                'rs': fields[26],
+                'rs_pval': fields[27]
+            },
+            'bstatistic': fields[28],
+            'mutindex': fields[29],
+            'dna': {
+                'helt': fields[30],
+                'mgw': fields[31],
+                'prot': fields[32],
+                'roll': fields[33]
+            },
+            'mirsvr': {
+                'score': fields[34],
+                'e': fields[35],
+                'aln': fields[36]
+            },
+            'targetscans': fields[37],
+            'fitcons': fields[38],
+            'chmm': {
+                'tssa': fields[39],
+                'tssaflnk': fields[40],
+                'txflnk': fields[41],
+                'tx': fields[42],
+                'txwk': fields[43],
+                'enh': fields[44],
+                # 'enh': fields[45],
+                'znfrpts': fields[46],
+                'het': fields[47],
+                'tssbiv': fields[48],
+                'bivflnk': fields[49],
+                'enhbiv': fields[50],
+                'reprpc': fields[51],
+                'reprpcwk': fields[52],
+                'quies': fields[53],
+            },
+            'encode': {
+                'exp': fields[54],
+                'h3k27ac': fields[55],
+                'h3k4me1': fields[56],
+                'h3k4me3': fields[57],
+                'nucleo': fields[58],
+                'occ': fields[59],
+                'p_val': {
+                    'comb': fields[60],
+                    'dnas': fields[61],
+                    'faire': fields[62],
+                    'polii': fields[63],
+                    'ctcf': fields[64],
+                    'mycp': fields[65]
+                },
+                'sig': {
+                    'dnase': fields[66],
+                    'faire': fields[67],
+                    'polii': fields[68],
+                    'ctcf': fields[69],
+                    'myc': fields[70]
+                },
+            },
+            'segway': fields[71],
+            'motif': {
+                'toverlap': fields[72],
+                'dist': fields[73],
+                'ecount': fields[74],
+                'ename': fields[75],
+                'ehipos': fields[76],
+                'escorechng': fields[77]
+            },
+            'tf': {
+                'bs': fields[78],
+                'bs_peaks': fields[79],
+                'bs_peaks_max': fields[80]
+            },
+            'isknownvariant': fields[81],
+            'esp': {
+                'af': fields[82],
+                'afr': fields[83],
+                'eur': fields[84]
+            },
+            '1000g': {
+                'af': fields[85],
+                'asn': fields[86],
+                'amr': fields[87],
+                'afr': fields[88],
+                'eur': fields[89]
+            },
+            'min_dist_tss': fields[90],
+            'min_dist_tse': fields[91],
+            'gene': {
+                'gene_id': fields[92],
+                'feature_id': fields[93],
+                'ccds_id': fields[94],
+                'genename': fields[95],
+                'cds': {
+                    'cdna_pos': fields[96],
+                    'rel_cdna_pos': fields[97],
+                    'cds_pos': fields[98],
+                    'rel_cds_pos': fields[99]
+                },
+                'prot': {
+                    'protpos': fields[100],
+                    'rel_prot_pos': fields[101],
+                    'domain': fields[102]
+                }
+            },
+            'dst2splice': fields[103],
+            'dst2spltype': fields[104],
+            'exon': fields[105],
+            'intron': fields[106],
+            'oaa': fields[107],   # ref aa
+            'naa': fields[108],   # alt aa
+            'grantham': fields[109],
+            'polyphen': {
+                'cat': fields[110],
+                'val': fields[111]
+            },
+            'sift': {
+                'cat': fields[112],
+                'val': fields[113]
+            },
+            'rawscore': fields[114],    # raw CADD score
+            'phred': fields[115]        # log-percentile of raw CADD score
+        }
+    }
+
+    obj = dict_sweep(unlist(value_convert_to_number(one_snp_json)), ["NA"])
+    yield obj
+
+
+def random_rows(count, seed=42):
+    rng = random.Random(seed)
+    values = ["NA", "", "0", "12", "-3", "0.25", "1e-05", "nan", "CodingTranscript", "SYNONYMOUS", "A,T"]
+    for _ in range(count):
+        row = [rng.choice(values) for _ in range(VALID_COLUMN_NO)]
+        row[0:5] = [rng.choice(["1", "X"]), str(rng.randint(10000, 10010)), "T", "T", rng.choice(["A", "C", "G"])]
+        yield row
+
+
+def dumps(docs):
+    # key order doesn't matter, and nan != nan
+    return json.dumps(docs, sort_keys=True)
+
+
+class TestCaddParser(unittest.TestCase):
+    def test_map_line_to_json(self):
+        for row in random_rows(500):
+            expected = list(legacy_map_line_to_json(list(row)))
+            result = list(_map_line_to_json(list(row)))
+            self.assertEqual(1, len(result))
+            self.assertEqual(dumps(expected), dumps(result))
+
+    def test_id(self):
+        row = next(random_rows(1))
+        row[0:5] = ["1", "10001", "T", "T", "A"]
+        doc = next(_map_line_to_json(row))
+        self.assertEqual("chr1:g.10001T>A", doc["_id"])
+        self.assertEqual({"chrom": 1, "pos": 10001, "ref": "T", "anc": "T", "alt": "A"},
+                         {k: doc["cadd"][k] for k in ("chrom", "pos", "ref", "anc", "alt")})
+
+    def test_wrong_column_number(self):
+        row = next(random_rows(1))
+        with self.assertRaises(ValueError):
+            list(_map_line_to_json(row[:-1]))
+
+    def test_merge_duplicates(self):
+        rows = sorted(random_rows(500), key=lambda row: (row[0], row[1], row[4]))
+        docs = [doc for row in rows for doc in legacy_map_line_to_json(row)]
+        expected = [merge_duplicate_rows(group, "cadd") for _, group in groupby(docs, lambda doc: doc["_id"])]
+
+        docs = [doc for row in rows for doc in _map_line_to_json(row)]
+        result = list(merge_duplicates(docs, "cadd"))
+        self.assertLess(len(result), len(docs))
+        self.assertEqual(dumps(expected), dumps(result))
+
+
+class FakeTabix:
+    def __init__(self, rows):
+        self.lines = ["\t".join(row) for row in rows]
+
+    def fetch(self, contig, start, end):
+        # records overlapping the region
+        return [line for line in self.lines if line.split("\t")[0] == contig
+                and int(line.split("\t")[1]) <= end and int(line.split("\t")[1]) + len(line.split("\t")[2]) - 1 > start]
+
+
+class TestCaddLoadRegion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_dir = os.path.join(self.tmp_dir.name, "position_index_hg19")
+        build_position_index(["chr1:g.10001T>A", "chr1:g.10005_10006del"], self.index_dir)
+        cadd_parser.position_index = PositionIndex(self.index_dir)
+
+        self.rows = []
+        for pos, ref, alt, annotype in [(10001, "T", "A", "Intergenic"), (10001, "T", "C", "Intergenic"),
+                                        (10002, "A", "G", "CodingTranscript"), (10004, "TCA", "T", "Intergenic")]:
+            row = next(random_rows(1))
+            row[0:5] = ["1", str(pos), ref, ref[0], alt]
+            row[9] = annotype
+            self.rows.append(row)
+        cadd_parser.tabix = FakeTabix(self.rows)
+
+    def tearDown(self):
+        cadd_parser.position_index.close()
+        self.tmp_dir.cleanup()
+
+    def test_load_region(self):
+        docs = cadd_parser.load_region("1", 10000, 10010)
+        self.assertEqual(["chr1:g.10001T>A", "chr1:g.10005_10006del"], [doc["_id"] for doc in docs])
+
+        docs = cadd_parser.load_region("1", 10000, 10010, keep_coding_transcripts=True)
+        self.assertEqual(["chr1:g.10001T>A", "chr1:g.10002A>G", "chr1:g.10005_10006del"], [doc["_id"] for doc in docs])
+
+    def test_region_boundaries(self):
+        # the deletion overlaps both regions, but is only loaded from the one it starts in
+        self.assertEqual(["chr1:g.10001T>A", "chr1:g.10005_10006del"],
+                         [doc["_id"] for doc in cadd_parser.load_region("1", 10000, 10004)])
+        self.assertEqual([], cadd_parser.load_region("1", 10004, 10010))
+
+    def test_load_region_multiple_rows(self):
+        # an Intergenic row then a CodingTranscript row of the same variant: the gene of the second one is kept
+        gene_columns = [i for i, column in enumerate(utils_cadd.COLUMNS)
+                        if column is not None and column.dest.startswith("gene.")]
+        rows = []
+        for annotype, gene_id in [("Intergenic", "NA"), ("CodingTranscript", "ENSG00000139618")]:
+            row = next(random_rows(1))
+            row[0:5] = ["1", "10001", "T", "T", "A"]
+            row[9] = annotype
+            for i in gene_columns:
+                row[i] = "NA"
+            row[gene_columns[0]] = gene_id
+            rows.append(row)
+        cadd_parser.tabix = FakeTabix(rows)
+
+        docs = cadd_parser.load_region("1", 10000, 10010)
+        expected = merge_duplicate_rows([doc for row in rows for doc in legacy_map_line_to_json(list(row))], "cadd")
+        self.assertEqual(dumps([expected]), dumps(docs))
+        self.assertEqual({"gene_id": "ENSG00000139618"}, docs[0]["cadd"]["gene"])
+        self.assertEqual(["Intergenic", "CodingTranscript"], docs[0]["cadd"]["annotype"])
+
+    def test_iter_regions(self):
+        regions = list(iter_regions(["MT", "GL000192.1"], region_size=10000))
+        self.assertEqual([("MT", 0, 10000), ("MT", 10000, 16569), ("GL000192.1", 0, None)], regions)
@@ -0,0 +1,222 @@
+import io
+import os
+import re
+import tempfile
+import unittest
+
+import orjson
+import aiohttp
+from aiohttp import web
+
+from hub.dataload.sources.civic.graphql_batch_dump import GraphqlBatchDump, hash_record, load_manifest
+
+
+class StubCivicGraphql:
+    """
+    A local stub of the CIViC GraphQL API, answering "BrowseVariants" pages and aliased "VariantBatch" requests.
+    """
+    ALIAS_PATTERN = re.compile(r"^(\w+)_(\d+): ", re.MULTILINE)
+
+    def __init__(self, variant_ids, fail_first=0):
+        self.variant_ids = variant_ids
+        self.fail_first = fail_first  # number of requests answered with a 503 before serving
+        self.failing_aliases = {}  # alias => number of times it's answered with null and an error
+        self.requests = []
+        self.revisions = {variant_id: "2024-01-01" for variant_id in variant_ids}
+
+    async def handle(self, request):
+        payload = await request.json()
+        self.requests.append(payload)
+        if len(self.requests) <= self.fail_first:
+            return web.Response(status=503)
+
+        if payload["operationName"] == "BrowseVariants":
+            first = payload["variables"]["first"]
+            start = int(payload["variables"]["after"] or 0)
+            page = self.variant_ids[start:start + first]
+            data = {"browseVariants": {
+                "edges": [{"node": {"id": variant_id}} for variant_id in page],
+                "pageInfo": {"hasNextPage": start + first < len(self.variant_ids), "endCursor": str(start + first)},
+            }}
+        elif payload["operationName"] == "VariantsModified":
+            first = payload["variables"]["first"]
+            start = int(payload["variables"]["after"] or 0)
+            page = self.variant_ids[start:start + first]
+            data = {"variants": {
+                "nodes": [{"id": variant_id, "lastAcceptedRevisionEvent": {"createdAt": self.revisions[variant_id]}}
+                          for variant_id in page],
+                "pageInfo": {"hasNextPage": start + first < len(self.variant_ids), "endCursor": str(start + first)},
+            }}
+        else:
+            data = {}
+            errors = []
+            for key, variant_id in self.ALIAS_PATTERN.findall(payload["query"]):
+                alias = f"{key}_{variant_id}"
+                if self.failing_aliases.get(alias):
+                    self.failing_aliases[alias] -= 1
+                    data[alias] = None
+                    errors.append({"message": "Internal error", "path": [alias]})
+                else:
+                    data[alias] = {"id": int(variant_id), "query": key}
+            if errors:
+                return web.json_response({"data": data, "errors": errors})
+        return web.json_response({"data": data})
+
+
+class TestGraphqlBatchDump(unittest.IsolatedAsyncioTestCase):
+    async def start_stub(self, stub):
+        app = web.Application()
+        app.router.add_post("/api/graphql", stub.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self.addAsyncCleanup(runner.cleanup)
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/api/graphql"
+
+    def test_gql(self):
+        dumper = GraphqlBatchDump(api_url="http://localhost")
+        query = dumper.gql([12, 34])["query"]
+
+        self.assertIn("VariantSummary_12: variant(id: 12)", query)
+        self.assertIn("GeneVariant_34: variant(id: 34)", query)
+        self.assertIn("ContributorAvatars_34: contributors(subscribable: {id: 34, entityType: VARIANT})", query)
+        self.assertNotIn("$", query)
+        # fragments are defined only once, whatever the batch size
+        self.assertEqual(1, query.count("fragment VariantDetailFields "))
+
+    async def test_dump_variants(self):
+        stub = StubCivicGraphql(variant_ids=list(range(1, 24)))
+        api_url = await self.start_stub(stub)
+        dumper = GraphqlBatchDump(api_url=api_url, batch_size=5, concurrency=2, page_size=10)
+
+        out_f = io.BytesIO()
+        async with aiohttp.ClientSession() as session:
+            variant_ids = await dumper.get_variants_list(session)
+            count = await dumper.dump_variants(session, variant_ids, out_f)
+
+        self.assertEqual(list(range(1, 24)), variant_ids)
+        self.assertEqual(23, count)
+        # 3 pages of ids, 5 batches of variants
+        self.assertEqual(3 + 5, len(stub.requests))
+
+        records = {r["variant_id"]: r for r in map(orjson.loads, out_f.getvalue().splitlines())}
+        self.assertEqual(set(range(1, 24)), set(records))
+        self.assertEqual({"id": 7, "query": "VariantDetail"}, records[7]["VariantDetail"]["data"]["variant"])
+        self.assertEqual({"id": 7, "query": "ContributorAvatars"}, records[7]["ContributorAvatars"]["data"]["contributors"])
+
+    async def test_retry(self):
+        stub = StubCivicGraphql(variant_ids=[1, 2, 3], fail_first=2)
+        api_url = await self.start_stub(stub)
+        dumper = GraphqlBatchDump(api_url=api_url, batch_size=5, backoff_base=0.01)
+
+        out_f = io.BytesIO()
+        async with aiohttp.ClientSession() as session:
+            count = await dumper.dump_variants(session, [1, 2, 3], out_f)
+
+        self.assertEqual(3, count)
+        self.assertEqual(3, len(stub.requests))
+
+    async def test_retry_partial_errors(self):
+        stub = StubCivicGraphql(variant_ids=[1, 2, 3])
+        stub.failing_aliases = {"VariantDetail_2": 2}
+        api_url = await self.start_stub(stub)
+        dumper = GraphqlBatchDump(api_url=api_url, batch_size=5, backoff_base=0.01)
+
+        out_f = io.BytesIO()
+        async with aiohttp.ClientSession() as session:
+            count = await dumper.dump_variants(session, [1, 2, 3], out_f)
+
+        self.assertEqual(3, count)
+        # only the failed variant is requested again
+        self.assertEqual(3, len(stub.requests))
+        self.assertEqual(["2", "2", "2", "2"], [v for _, v in StubCivicGraphql.ALIAS_PATTERN.findall(stub.requests[-1]["query"])])
+        records = {r["variant_id"]: r for r in map(orjson.loads, out_f.getvalue().splitlines())}
+        self.assertEqual({"id": 2, "query": "VariantDetail"}, records[2]["VariantDetail"]["data"]["variant"])
+
+    async def test_partial_errors_give_up(self):
+        stub = StubCivicGraphql(variant_ids=[1, 2, 3])
+        stub.failing_aliases = {"GeneVariant_3": 10}
+        api_url = await self.start_stub(stub)
+        dumper = GraphqlBatchDump(api_url=api_url, batch_size=5, max_retries=2, backoff_base=0.01)
+
+        out_f = io.BytesIO()
+        async with aiohttp.ClientSession() as session:
+            with self.assertRaises(ValueError):
+                await dumper.dump_variants(session, [1, 2, 3], out_f)
+        self.assertEqual(3, len(stub.requests))
+        self.assertEqual(b"", out_f.getvalue())
+
+    async def test_dump_incremental(self):
+        stub = StubCivicGraphql(variant_ids=list(range(1, 11)))
+        api_url = await self.start_stub(stub)
+        dumper = GraphqlBatchDump(api_url=api_url, batch_size=4, page_size=10)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            previous_file = os.path.join(tmp_dir, "previous", "variants.ndjson")
+            os.makedirs(os.path.dirname(previous_file))
+            fetched, carried = await dumper.dump_incremental(previous_file)
+            self.assertEqual((10, 0), (fetched, carried))
+            self.assertEqual(set(map(str, range(1, 11))), set(load_manifest(previous_file)))
+
+            # variant 3 is modified, variant 10 is removed, variant 11 is new
+            stub.revisions[3] = "2024-02-01"
+            stub.variant_ids = list(range(1, 10)) + [11]
+            stub.revisions[11] = "2024-02-01"
+            stub.requests = []
+
+            localfile = os.path.join(tmp_dir, "variants.ndjson")
+            fetched, carried = await dumper.dump_incremental(localfile, previous_file=previous_file)
+            self.assertEqual((2, 8), (fetched, carried))
+            # 1 page of markers, 1 batch of variants
+            self.assertEqual(2, len(stub.requests))
+
+            with open(localfile, "rb") as in_f:
+                records = [orjson.loads(line) for line in in_f]
+            self.assertEqual(list(range(1, 10)) + [11], sorted(r["variant_id"] for r in records))
+
+            manifest = load_manifest(localfile)
+            self.assertEqual(load_manifest(previous_file)["1"], manifest["1"])
+            self.assertNotEqual(load_manifest(previous_file)["3"]["marker"], manifest["3"]["marker"])
+
+    async def test_dump_incremental_incomplete_record(self):
+        stub = StubCivicGraphql(variant_ids=[1, 2, 3])
+        api_url = await self.start_stub(stub)
+        dumper = GraphqlBatchDump(api_url=api_url, batch_size=4, page_size=10)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            previous_file = os.path.join(tmp_dir, "previous", "variants.ndjson")
+            os.makedirs(os.path.dirname(previous_file))
+            await dumper.dump_incremental(previous_file)
+            # a previous dump broke the record of variant 2 but kept its marker
+            with open(previous_file, "rb") as in_f:
+                records = [orjson.loads(line) for line in in_f]
+            with open(previous_file, "wb") as out_f:
+                for record in records:
+                    if record["variant_id"] == 2:
+                        record["GeneVariant"]["data"]["variant"] = None
+                    out_f.write(orjson.dumps(record) + b"\n")
+            stub.requests = []
+
+            localfile = os.path.join(tmp_dir, "variants.ndjson")
+            fetched, carried = await dumper.dump_incremental(localfile, previous_file=previous_file)
+            self.assertEqual((1, 2), (fetched, carried))
+            with open(localfile, "rb") as in_f:
+                records = {r["variant_id"]: r for r in map(orjson.loads, in_f)}
+            self.assertEqual({"id": 2, "query": "GeneVariant"}, records[2]["GeneVariant"]["data"]["variant"])
+            self.assertEqual(hash_record(records[2]), load_manifest(localfile)["2"]["hash"])
+
+    async def test_dump_variants_incomplete_record(self):
+        dumper = GraphqlBatchDump(api_url="http://localhost")
+        record = {"variant_id": 1, "ContributorAvatars": {"data": {"contributors": {}}},
+                  "GeneVariant": {"data": {"variant": None}}, "VariantDetail": {"data": {"variant": {}}},
+                  "VariantSummary": {"data": {"variant": {}}}}
+
+        async def fetch_batch(session, variant_ids):
+            return [record]
+        dumper.fetch_batch = fetch_batch
+
+        manifest = {"1": {"marker": "abc"}}
+        await dumper.dump_variants(None, [1], io.BytesIO(), manifest=manifest)
+        self.assertEqual({}, manifest)
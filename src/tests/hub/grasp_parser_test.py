@@ -0,0 +1,136 @@
+import json
+import random
+import unittest
+from itertools import groupby
+
+from biothings.utils.dataload import dict_sweep, list_split, unlist, value_convert_to_number, merge_duplicate_rows
+
+from hub.dataload.sources.grasp.grasp_parser import VALID_COLUMN_NO, _map_line_to_json, merge_duplicates
+
+
+# hand-written mapping replaced by the declarative columns, kept as reference
+def legacy_map_line_to_json(fields, hgvs_ids):
+    # lines in fh
+    assert len(fields) == VALID_COLUMN_NO
+
+    for HGVS in hgvs_ids:
+        one_snp_json = {
+
+            "_id": HGVS,
+            "grasp":
+                {
+                    'hg19':
+                        {
+                            'chr': fields[5],
+                            'pos': fields[6]
+                        },
+                    'hupfield': fields[1],
+                    'last_curation_date': fields[2],
+                    'creation_date': fields[3],
+                    'srsid': fields[4],
+                    'publication':
+                        {
+                            'journal': fields[16],
+                            'title': fields[17],
+                            'pmid': fields[7],
+                            'snpid': fields[8],
+                            'location_within_paper': fields[9],
+                            'p_value': fields[10],
+                            'phenotype': fields[11],
+                            'paper_phenotype_description': fields[12],
+                            'paper_phenotype_categories': fields[13],
+                            'date_pub': fields[14]
+                        },
+                    'includes_male_female_only_analyses': fields[18],
+                    'exclusively_male_female': fields[19],
+                    'initial_sample_description': fields[20],
+                    'replication_sample_description': fields[21],
+                    'platform_snps_passing_qc': fields[22],
+                    'gwas_ancestry_description': fields[23],
+                    'discovery':
+                        {
+                            'total_samples': fields[25],
+                            'european': fields[26],
+                            'african': fields[27],
+                            'east_asian': fields[28],
+                            'indian_south_asian': fields[29],
+                            'hispanic': fields[30],
+                            'native': fields[31],
+                            'micronesian': fields[32],
+                            'arab_me': fields[33],
+                            'mixed': fields[34],
+                            'unspecified': fields[35],
+                            'filipino': fields[36],
+                            'indonesian': fields[37]
+                        },
+                    'replication':
+                        {
+                            'total_samples': fields[38],
+                            'european': fields[39],
+                            'african': fields[40],
+                            'east_asian': fields[41],
+                            'indian_south_asian': fields[42],
+                            'hispanic': fields[43],
+                            'native': fields[44],
+                            'micronesian': fields[45],
+                            'arab_me': fields[46],
+                            'mixed': fields[47],
+                            'unspecified': fields[48],
+                            'filipino': fields[49],
+                            'indonesian': fields[50]
+                        },
+                    'in_gene': fields[51],
+                    'nearest_gene': fields[52],
+                    'in_lincrna': fields[53],
+                    'in_mirna': fields[54],
+                    'in_mirna_bs': fields[55],
+                    'oreg_anno': fields[61],
+                    'conserv_pred_tfbs': fields[62],
+                    'human_enhancer': fields[63],
+                    'rna_edit': fields[64],
+                    'polyphen2': fields[65],
+                    'sift': fields[66],
+                    'ls_snp': fields[67],
+                    'uniprot': fields[68],
+                    'eqtl_meth_metab_study': fields[69]
+                }
+            }
+        yield list_split(dict_sweep(unlist(value_convert_to_number(one_snp_json)), [""]), ",")
+
+
+def random_rows(count, seed=42):
+    rng = random.Random(seed)
+    values = ["", "0", "12", "3.5e-08", "European", "Cancer,Lung", "a, b,", "NR"]
+    for _ in range(count):
+        row = [rng.choice(values) for _ in range(VALID_COLUMN_NO)]
+        row[8] = "rs%d" % rng.randint(1, 20)
+        yield row
+
+
+def dumps(docs):
+    # key order doesn't matter
+    return json.dumps(docs, sort_keys=True)
+
+
+class TestGraspParser(unittest.TestCase):
+    def test_map_line_to_json(self):
+        for row in random_rows(500):
+            hgvs_ids = ["chr1:g.%sA>T" % row[8][2:], "chr1:g.%sA>C" % row[8][2:]]
+            expected = list(legacy_map_line_to_json(list(row), hgvs_ids))
+            result = list(_map_line_to_json(list(row), hgvs_ids))
+            self.assertEqual(2, len(result))
+            self.assertEqual(dumps(expected), dumps(result))
+
+    def test_no_hgvs_ids(self):
+        row = next(random_rows(1))
+        self.assertEqual([], list(_map_line_to_json(row, [])))
+
+    def test_merge_duplicates(self):
+        rows = sorted(random_rows(500), key=lambda row: row[8])
+        docs = [doc for row in rows for doc in legacy_map_line_to_json(row, ["chr1:g.%sA>T" % row[8][2:]])]
+        expected = [merge_duplicate_rows(group, "grasp") for _, group in groupby(docs, lambda doc: doc["_id"])]
+
+        docs = [doc for row in rows for doc in _map_line_to_json(row, ["chr1:g.%sA>T" % row[8][2:]])]
+        result = list(merge_duplicates(docs, "grasp"))
+        self.assertEqual(20, len(result))
+        self.assertEqual(dumps(expected), dumps(result))
@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+
+import hub.databuild.mapper as mapper
+from hub.databuild.mapper import SetChrom
+
+
+class StubMapper:
+    name = "stub"
+
+    def load(self, *args, **kwargs):
+        pass
+
+    def process(self, docs):
+        yield from docs
+
+
+class TestSetChrom(unittest.TestCase):
+    def setUp(self):
+        self.set_chrom = SetChrom(StubMapper(), report_name="target_chrom", src_name="dbsnp",
+                                  chrom_fields={"dbsnp": "chrom", "clinvar": "chrom"})
+
+    def test_chrom_from_id(self):
+        doc = {"_id": "chrX:g.1337588C>A"}
+        self.assertIsNone(self.set_chrom.set_chrom(doc))
+        self.assertEqual("X", doc["chrom"])
+
+    def test_id_wins_over_source(self):
+        # the source agrees with the _id
+        doc = {"_id": "chr1:g.100A>G", "dbsnp": {"chrom": "1"}}
+        self.assertIsNone(self.set_chrom.set_chrom(doc))
+        self.assertEqual("1", doc["chrom"])
+        # the source disagrees: the _id still wins, and the discrepancy is reported
+        doc = {"_id": "chr1:g.100A>G", "dbsnp": {"chrom": 2}}
+        self.assertEqual("disagreed", self.set_chrom.set_chrom(doc))
+        self.assertEqual("1", doc["chrom"])
+
+    def test_chrom_from_source(self):
+        # _id isn't genomic, the first source chrom field found is used
+        doc = {"_id": "rs58991260", "clinvar": {"chrom": 7}}
+        self.assertIsNone(self.set_chrom.set_chrom(doc))
+        self.assertEqual("7", doc["chrom"])
+
+    def test_missing(self):
+        doc = {"_id": "rs58991260", "clinvar": {"rcv": "RCV000000001"}}
+        self.assertEqual("missing", self.set_chrom.set_chrom(doc))
+        self.assertNotIn("chrom", doc)
+
+    def test_process(self):
+        docs = [
+            {"_id": "chr2:g.5A>G", "hg19": {"start": 5, "end": 5}},
+            {"_id": "chr2:g.6A>G", "dbsnp": {"chrom": "3"}},
+            {"_id": "rs1"},
+        ]
+        with mock.patch.object(mapper, "get_target_db") as get_target_db:
+            processed = list(self.set_chrom.process(docs))
+        self.assertEqual(["2", "2"], [doc.get("chrom") for doc in processed[:2]])
+        self.assertEqual({"hg19": 20000000005}, processed[0]["genomic_key"])
+        self.assertNotIn("genomic_key", processed[1])
+
+        report_col = get_target_db.return_value["target_chrom"]
+        (query, report), _ = report_col.replace_one.call_args
+        self.assertEqual({"_id": "dbsnp/chr2:g.5A>G"}, query)
+        self.assertEqual({"count": 1, "examples": ["chr2:g.6A>G"]}, report["disagreed"])
+        self.assertEqual({"count": 1, "examples": ["rs1"]}, report["missing"])
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import biothings.hub  # noqa: F401, sets biothings.config up, as the hub does before loading its modules
+from biothings.utils.common import dump
+
+import hub.databuild.syncer as syncer
+from bulk_test import FakeClient
+from hub.databuild.syncer import sync_es_routed_jsondiff_worker
+
+
+class TestSyncESRoutedJsondiffWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.client = FakeClient()
+        indexer = SimpleNamespace(_es=self.client, _index="myvariant_test")
+        patcher = mock.patch.object(syncer, "create_backend", return_value=SimpleNamespace(target_esidxer=indexer))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def index(self, *docs):
+        for doc in docs:
+            self.client.docs[doc["_id"]] = (doc["_id"].split(":")[0][3:], {k: v for k, v in doc.items() if k != "_id"})
+
+    def dump_diff(self, add=(), update=(), delete=()):
+        diff_file = os.path.join(self.tmp_dir.name, "diff_1.pyobj")
+        dump({"add": list(add), "update": list(update), "delete": list(delete), "source": "myvariant_new"}, diff_file)
+        return diff_file
+
+    def sync(self, diff_file, **kwargs):
+        return sync_es_routed_jsondiff_worker(diff_file, ("localhost:9200", "myvariant_test", "variant"),
+                                              "myvariant_new", batch_size=2, cnt=1, selfcontained=True, **kwargs)
+
+    def test_sync(self):
+        self.index({"_id": "chr1:g.100A>G", "pos": 100}, {"_id": "chrX:g.5A>G", "pos": 5},
+                   {"_id": "chrMT:g.7A>G", "pos": 7})
+        diff_file = self.dump_diff(
+            add=[{"_id": "chr2:g.3A>G", "pos": 3, "_timestamp": "2026-10-19"}, {"_id": "chrY:g.4A>G", "pos": 4}],
+            update=[
+                {"_id": "chr1:g.100A>G", "patch": [{"op": "add", "path": "/chrom", "value": "1"}]},
+                {"_id": "chrX:g.5A>G", "patch": [{"op": "replace", "path": "/pos", "value": 6}]},
+                # not indexed
+                {"_id": "chr3:g.9A>G", "patch": [{"op": "replace", "path": "/pos", "value": 10}]},
+            ],
+            delete=["chrMT:g.7A>G", "chr4:g.1A>G"])
+
+        res = self.sync(diff_file)
+        self.assertEqual({"added": 2, "updated": 2, "deleted": 1, "skipped": 2}, res)
+        self.assertEqual({
+            "chr1:g.100A>G": ("1", {"pos": 100, "chrom": "1"}),
+            "chrX:g.5A>G": ("X", {"pos": 6}),
+            "chr2:g.3A>G": ("2", {"pos": 3}),
+            "chrY:g.4A>G": ("Y", {"pos": 4}),
+        }, self.client.docs)
+
+        # the diff file is marked as synced, and skipped if synced again
+        self.assertFalse(os.path.exists(diff_file))
+        self.assertTrue(os.path.exists(diff_file + ".synced"))
+        self.assertEqual({"added": 0, "updated": 0, "deleted": 0, "skipped": 7}, self.sync(diff_file))
+
+    def test_update_already_applied(self):
+        self.index({"_id": "chr1:g.100A>G", "pos": 100})
+        patch = [{"op": "remove", "path": "/chrom"}]
+        diff_file = self.dump_diff(update=[{"_id": "chr1:g.100A>G", "patch": patch}])
+        res = self.sync(diff_file)
+        self.assertEqual({"added": 0, "updated": 0, "deleted": 0, "skipped": 1}, res)
+        self.assertEqual({"chr1:g.100A>G": ("1", {"pos": 100})}, self.client.docs)
+        self.assertEqual([], self.client.requests)
+
+    def test_coldhot(self):
+        # documents added to the hot collection are merged with their version from the cold one
+        self.index({"_id": "chr1:g.100A>G", "pos": 100, "cadd": {"phred": 1.0}})
+        diff_file = self.dump_diff(add=[{"_id": "chr1:g.100A>G", "clinvar": {"rcv": "RCV1"}}])
+        self.sync(diff_file, coldhot=True)
+        self.assertEqual(
+            {"chr1:g.100A>G": ("1", {"pos": 100, "cadd": {"phred": 1.0}, "clinvar": {"rcv": "RCV1"}})},
+            self.client.docs)
+
+        # without coldhot, the added document overwrites the indexed one
+        os.rename(diff_file + ".synced", diff_file)
+        self.sync(diff_file)
+        self.assertEqual({"chr1:g.100A>G": ("1", {"clinvar": {"rcv": "RCV1"}})}, self.client.docs)
+
+
+if __name__ == "__main__":
+    unittest.main()
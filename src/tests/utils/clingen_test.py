@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from utils.clingen import ClingenResolver, ClingenResolverCache, parse_myvariant_ids
+
+try:
+    import requests  # noqa
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+
+class StubClingenHandler(BaseHTTPRequestHandler):
+    """
+    A local stub of the ClinGen Allele Registry "alleles?file=hgvs" endpoint.
+    Each input HGVS "NM_X:c.<n>..." resolves to "chr1:g.<n>A>G". The first `fail_first` requests get a 503.
+    """
+    fail_first = 0
+    requests_received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        cls = self.__class__
+        cls.requests_received.append(body)
+        if len(cls.requests_received) <= cls.fail_first:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        docs = []
+        for hgvs in body.split("\n"):
+            pos = hgvs.split(":c.")[1].rstrip("delup")
+            docs.append({"externalRecords": {"MyVariantInfo_hg19": [{"id": "chr1:g.%sA>G" % pos}]}})
+        payload = json.dumps(docs).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestClingenResolver(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "clingen_cache.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def start_stub(self, fail_first=0):
+        StubClingenHandler.fail_first = fail_first
+        StubClingenHandler.requests_received = []
+        server = HTTPServer(("127.0.0.1", 0), StubClingenHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:%d/alleles?file=hgvs" % server.server_port
+
+    def test_parse_myvariant_ids(self):
+        doc = {"externalRecords": {"MyVariantInfo_hg38": [{"id": "chr1:g.1A>G"}, {"id": "chr1:g.1A>T"}]}}
+        self.assertEqual(["chr1:g.1A>G", "chr1:g.1A>T"], parse_myvariant_ids(doc, "hg38"))
+        self.assertEqual([], parse_myvariant_ids(doc, "hg19"))
+        self.assertEqual([], parse_myvariant_ids({"errorType": "HgvsParsingError"}, "hg19"))
+
+    def test_offline(self):
+        cache = ClingenResolverCache(self.cache_path)
+        cache.set_many({"NM_1:c.1del": ["chr1:g.1del"], "NM_1:c.2del": []}, "hg19")
+        cache.close()
+
+        with ClingenResolver(cache_path=self.cache_path, offline=True) as resolver:
+            mapping = resolver.resolve(["NM_1:c.1del", "NM_1:c.2del", "NM_1:c.3del", "NM_1:c.1del"], "hg19")
+            self.assertEqual({"NM_1:c.1del": ["chr1:g.1del"], "NM_1:c.2del": [], "NM_1:c.3del": []}, mapping)
+
+            # nothing cached for the other assembly
+            self.assertEqual({"NM_1:c.1del": []}, resolver.resolve(["NM_1:c.1del"], "hg38"))
+
+    @unittest.skipUnless(HAS_REQUESTS, "requests is not installed")
+    def test_resolve_with_cache_and_retry(self):
+        url = self.start_stub(fail_first=1)
+        hgvs_ids = ["NM_1:c.%ddel" % i for i in range(1, 11)]
+
+        with ClingenResolver(cache_path=self.cache_path, url=url, batch_size=3, max_workers=2, backoff_base=0.01) as resolver:
+            mapping = resolver.resolve(hgvs_ids, "hg19")
+        self.assertEqual({"NM_1:c.%ddel" % i: ["chr1:g.%dA>G" % i] for i in range(1, 11)}, mapping)
+        # 4 batches, 1 of them retried
+        self.assertEqual(5, len(StubClingenHandler.requests_received))
+
+        # second run: all from cache, only the new id is submitted
+        StubClingenHandler.fail_first = 0
+        StubClingenHandler.requests_received = []
+        with ClingenResolver(cache_path=self.cache_path, url=url, batch_size=3) as resolver:
+            mapping = resolver.resolve(hgvs_ids + ["NM_1:c.42del"], "hg19")
+        self.assertEqual(["chr1:g.42A>G"], mapping["NM_1:c.42del"])
+        self.assertEqual(["NM_1:c.42del"], StubClingenHandler.requests_received)
+
+    @unittest.skipUnless(HAS_REQUESTS, "requests is not installed")
+    def test_negative_ttl(self):
+        url = self.start_stub()
+        cache = ClingenResolverCache(self.cache_path)
+        cache.set_many({"NM_1:c.1del": [], "NM_1:c.2del": ["chr1:g.2del"]}, "hg19")
+        cache.conn.execute("UPDATE clingen_cache SET cached_at = cached_at - 100")
+        cache.conn.commit()
+        cache.close()
+
+        # not expired yet
+        with ClingenResolver(cache_path=self.cache_path, url=url, negative_ttl=1000) as resolver:
+            self.assertEqual({"NM_1:c.1del": [], "NM_1:c.2del": ["chr1:g.2del"]},
+                             resolver.resolve(["NM_1:c.1del", "NM_1:c.2del"], "hg19"))
+        self.assertEqual([], StubClingenHandler.requests_received)
+
+        # expired, submitted again (resolved ids never expire)
+        with ClingenResolver(cache_path=self.cache_path, url=url, negative_ttl=10) as resolver:
+            self.assertEqual({"NM_1:c.1del": ["chr1:g.1A>G"], "NM_1:c.2del": ["chr1:g.2del"]},
+                             resolver.resolve(["NM_1:c.1del", "NM_1:c.2del"], "hg19"))
+        self.assertEqual(["NM_1:c.1del"], StubClingenHandler.requests_received)
@@ -0,0 +1,50 @@
+import unittest
+
+from utils.docvalues import docvalue_fields, docvalue_source, is_docvalue_field
+
+MAPPINGS = {
+    "cadd": {"properties": {
+        "phred": {"type": "float"},
+        "gene": {"properties": {"genename": {"type": "keyword", "normalizer": "keyword_lowercase_normalizer"}}},
+    }},
+    "dbnsfp": {"properties": {"revel": {"properties": {"score": {"type": "float"}}}}},
+    "dbsnp": {"properties": {"rsid": {"type": "keyword"}, "vartype": {"type": "text"}}},
+    "hg19": {"properties": {"start": {"type": "integer"}}},
+    "observed": {"type": "boolean", "doc_values": False},
+}
+
+
+class TestDocValues(unittest.TestCase):
+    def test_is_docvalue_field(self):
+        self.assertTrue(is_docvalue_field(MAPPINGS, "cadd.phred"))
+        self.assertTrue(is_docvalue_field(MAPPINGS, "dbsnp.rsid"))
+        self.assertFalse(is_docvalue_field(MAPPINGS, "cadd"))
+        self.assertFalse(is_docvalue_field(MAPPINGS, "cadd.gene.genename"))
+        self.assertFalse(is_docvalue_field(MAPPINGS, "dbsnp.vartype"))
+        self.assertFalse(is_docvalue_field(MAPPINGS, "observed"))
+        self.assertFalse(is_docvalue_field(MAPPINGS, "cadd.phred.raw"))
+        self.assertFalse(is_docvalue_field(MAPPINGS, "clinvar.rsid"))
+
+    def test_docvalue_fields(self):
+        self.assertEqual(["cadd.phred", "dbnsfp.revel.score"],
+                         docvalue_fields(["cadd.phred", "dbnsfp.revel.score", "cadd.phred"], MAPPINGS))
+        self.assertIsNone(docvalue_fields(None, MAPPINGS))
+        self.assertIsNone(docvalue_fields(["all"], MAPPINGS))
+        self.assertIsNone(docvalue_fields(["cadd.*"], MAPPINGS))
+        self.assertIsNone(docvalue_fields(["cadd.phred", "-dbsnp.rsid"], MAPPINGS))
+        self.assertIsNone(docvalue_fields(["cadd.phred", "dbsnp"], MAPPINGS))
+
+    def test_docvalue_source(self):
+        self.assertEqual({
+            "cadd": {"phred": 23.4},
+            "dbnsfp": {"revel": {"score": [0.1, 0.5]}},
+            "hg19": {"start": 100},
+        }, docvalue_source({
+            "cadd.phred": [23.399999618530273],
+            "dbnsfp.revel.score": [0.10000000149011612, 0.5],
+            "hg19.start": [100],
+            "dbsnp.rsid": [],
+        }))
+        # double values left as is
+        self.assertEqual({"score": 0.1}, docvalue_source({"score": [0.1]}))
+        self.assertEqual({}, docvalue_source({}))
@@ -0,0 +1,56 @@
+import os
+import random
+import unittest
+
+from utils.extsort import ExternalSorter, external_sort, external_groupby, unique_sorted
+
+
+class TestExternalSorter(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.docs = [{"_id": "chr%d:g.%d" % (rng.randint(1, 5), rng.randint(1, 50)), "seq": i} for i in range(2000)]
+
+    def test_sorted_in_memory(self):
+        with ExternalSorter(key=lambda d: d["_id"]) as sorter:
+            sorter.extend(self.docs)
+            result = list(sorter.sorted())
+            self.assertEqual(0, sorter.run_count)
+
+        self.assertEqual(sorted(self.docs, key=lambda d: d["_id"]), result)
+
+    def test_sorted_with_spilled_runs(self):
+        with ExternalSorter(key=lambda d: d["_id"], memory_limit=4096) as sorter:
+            sorter.extend(self.docs)
+            result = list(sorter.sorted())
+            self.assertGreater(sorter.run_count, 1)
+            run_dir = sorter._run_dir
+            self.assertTrue(os.path.isdir(run_dir))
+
+        # stable sort, same as python's `sorted()`
+        self.assertEqual(sorted(self.docs, key=lambda d: d["_id"]), result)
+        self.assertFalse(os.path.exists(run_dir))
+
+    def test_groupby_with_spilled_runs(self):
+        expected = {}
+        for doc in self.docs:
+            expected.setdefault(doc["_id"], []).append(doc)
+
+        groups = list(external_groupby(self.docs, key=lambda d: d["_id"], memory_limit=4096))
+
+        self.assertEqual(sorted(expected.keys()), [key for key, _ in groups])
+        for key, group in groups:
+            self.assertEqual(expected[key], group)
+
+    def test_external_sort(self):
+        values = [random.random() for _ in range(1000)]
+        self.assertEqual(sorted(values), list(external_sort(values, key=lambda v: v, memory_limit=1024)))
+
+    def test_unique_sorted(self):
+        lines = ["b\n", "a\n", "c\n", "a\n", "b\n"]
+        self.assertEqual(["a\n", "b\n", "c\n"], list(unique_sorted(lines, memory_limit=16)))
+
+    def test_add_after_close(self):
+        sorter = ExternalSorter(key=lambda d: d["_id"])
+        sorter.close()
+        with self.assertRaises(ValueError):
+            sorter.add({"_id": "chr1:g.1A>C"})
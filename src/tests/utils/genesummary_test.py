@@ -0,0 +1,50 @@
+import unittest
+
+from utils.genesummary import GeneSummaryAccumulator, variant_genes
+
+
+class TestGeneSummary(unittest.TestCase):
+    def setUp(self):
+        self.docs = [
+            {
+                "_id": "chr13:g.32900000A>T", "chrom": "13",
+                "clinvar": {"gene": {"symbol": "BRCA2", "id": 675},
+                            "rcv": [{"clinical_significance": "Pathogenic"}, {"clinical_significance": "Pathogenic"}]},
+                "snpeff": {"ann": [{"genename": "BRCA2", "putative_impact": "HIGH", "effect": "stop_gained"},
+                                   {"genename": "BRCA2", "putative_impact": "HIGH", "effect": "stop_gained"}],
+                           "lof": {"genename": "BRCA2"}},
+                "cadd": {"phred": 40.0},
+                "hg19": {"start": 32900000, "end": 32900000},
+            },
+            {
+                "_id": "chr13:g.32950000_32950002del", "chrom": "13",
+                "snpeff": {"ann": {"genename": "BRCA2", "putative_impact": "MODERATE", "effect": "inframe_deletion"}},
+                "dbnsfp": {"genename": ["BRCA2"], "revel": {"score": [0.5, 0.7]}},
+                "cadd": {"phred": 12.5},
+                "hg19": {"start": 32950000, "end": 32950002},
+            },
+            {
+                "_id": "chr13:g.1000A>T", "chrom": "13",
+                "snpeff": {"ann": {"genename": "GENE1-GENE2", "putative_impact": "MODIFIER", "effect": "intergenic_region"}},
+            },
+        ]
+
+    def test_variant_genes(self):
+        self.assertEqual({"BRCA2": {675}}, variant_genes(self.docs[0]))
+        self.assertEqual({}, variant_genes(self.docs[2]))
+
+    def test_summaries(self):
+        accumulator = GeneSummaryAccumulator()
+        for doc in self.docs:
+            accumulator.add(doc)
+        self.assertEqual([{
+            "_id": "BRCA2",
+            "symbol": "BRCA2",
+            "entrezgene": [675],
+            "chrom": "13",
+            "variant_count": 2,
+            "clinvar": {"variant_count": 1, "clinical_significance": {"pathogenic": 1}},
+            "snpeff": {"putative_impact": {"high": 1, "moderate": 1}, "lof_count": 1},
+            "max_score": {"cadd_phred": 40.0, "revel": 0.7},
+            "hg19": {"start": 32900000, "end": 32950002},
+        }], list(accumulator.summaries()))
@@ -0,0 +1,23 @@
+import unittest
+
+from utils.genomickey import add_genomic_keys, genomic_key
+
+
+class TestGenomicKey(unittest.TestCase):
+    def test_genomic_key(self):
+        self.assertEqual(1 * 10 ** 10 + 100, genomic_key("1", 100))
+        self.assertEqual(23 * 10 ** 10 + 5, genomic_key("x", "5"))
+        self.assertIsNone(genomic_key("Un", 100))
+        # ordered by chromosome, then position
+        self.assertLess(genomic_key("2", 10 ** 9 - 1), genomic_key("3", 0))
+        self.assertLess(genomic_key("22", 0), genomic_key("X", 0))
+
+    def test_add_genomic_keys(self):
+        doc = add_genomic_keys({"_id": "chr1:g.100_102del", "chrom": "1",
+                                "hg19": {"start": 100, "end": 102}, "hg38": [{"start": 250}, {"start": 200}]})
+        self.assertEqual({"hg19": 10 ** 10 + 100, "hg38": 10 ** 10 + 200}, doc["genomic_key"])
+
+        doc = add_genomic_keys({"_id": "rs1", "dbsnp": {"rsid": "rs1"}})
+        self.assertNotIn("genomic_key", doc)
+        doc = add_genomic_keys({"_id": "chrUn:g.1A>T", "chrom": "Un", "hg19": {"start": 1}})
+        self.assertNotIn("genomic_key", doc)
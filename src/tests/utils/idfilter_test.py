@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+from utils.idfilter import BloomFilter, build_id_filter, definitely_absent, extend_id_filter, filter_key
+
+
+class TestIdFilter(unittest.TestCase):
+    def test_bloom_filter(self):
+        bloom = BloomFilter.create(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(b"key%d" % i)
+        self.assertTrue(all(b"key%d" % i in bloom for i in range(1000)))
+        false_positives = sum(b"other%d" % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "index.idfilter")
+            bloom.save(path)
+            loaded = BloomFilter.load(path)
+            self.assertEqual((bloom.num_bits, bloom.num_hashes, 1000), (loaded.num_bits, loaded.num_hashes, loaded.count))
+            self.assertEqual((1000, 0.01), (loaded.capacity, loaded.error_rate))
+            self.assertTrue(all(b"key%d" % i in loaded for i in range(1000)))
+            self.assertEqual(false_positives, sum(b"other%d" % i in loaded for i in range(10000)))
+
+            with open(path, "r+b") as f:
+                f.write(b"INVALID!")
+            self.assertRaises(ValueError, BloomFilter.load, path)
+
+    def test_id_filter(self):
+        docs = [
+            {"_id": "chr1:g.100A>T", "dbsnp": {"rsid": "rs100"}, "clingen": {"caid": "CA100"}},
+            {"_id": "chr1:g.200C>G", "dbsnp": [{"rsid": "rs200"}, {"rsid": "rs201"}]},
+        ]
+        bloom = build_id_filter(docs, capacity=6)
+        self.assertEqual(6, bloom.count)
+        self.assertIn(filter_key("dbsnp.rsid", "rs201"), bloom)
+        self.assertFalse(definitely_absent(bloom, "chr1:g.100a>t", "_id"))
+        self.assertFalse(definitely_absent(bloom, "CA100", ["_id", "clingen.caid"]))
+        self.assertFalse(definitely_absent(bloom, "RS200", ["dbsnp.rsid"]))
+        self.assertTrue(definitely_absent(bloom, "chr1:g.300A>T", ["_id", "clingen.caid"]))
+        # not filtered
+        self.assertFalse(definitely_absent(bloom, "chr1:g.300A>T", ["_id", "clinvar.hgvs.genomic"]))
+        self.assertFalse(definitely_absent(bloom, "chr1:g.300A>T", []))
+
+    def test_extend_id_filter(self):
+        docs = [{"_id": "chr1:g.100A>T", "dbsnp": {"rsid": "rs100"}}]
+        bloom = build_id_filter(docs, capacity=10)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "index.idfilter")
+            bloom.save(path)
+            reader = BloomFilter.load(path)
+            extended = extend_id_filter(path, [{"_id": "chr2:g.200C>G", "clingen": {"caid": "CA200"}}])
+            self.assertEqual(4, extended.count)
+            loaded = BloomFilter.load(path)
+            self.assertEqual(bytes(extended.bits), bytes(loaded.bits))
+            self.assertFalse(definitely_absent(loaded, "chr1:g.100A>T", "_id"))
+            self.assertFalse(definitely_absent(loaded, "CA200", "clingen.caid"))
+            # filters already loaded are left as they were
+            self.assertTrue(definitely_absent(reader, "CA200", "clingen.caid"))
+
+    def test_rebuild_full_id_filter(self):
+        docs = [{"_id": "chr1:g.%dA>T" % pos} for pos in range(1, 4)]
+        bloom = build_id_filter(docs[:1], capacity=2, error_rate=0.05)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "index.idfilter")
+            bloom.save(path)
+            # within its capacity, the filter is extended
+            extended = extend_id_filter(path, docs[1:2], all_docs=lambda: self.fail("filter rebuilt"))
+            self.assertEqual((2, 2), (extended.count, extended.capacity))
+            # past its capacity, it's rebuilt from all the documents (here, the second document was deleted)
+            all_docs = [docs[0], docs[2]]
+            rebuilt = extend_id_filter(path, docs[2:], all_docs=lambda: iter(all_docs))
+            self.assertEqual((2, 6, 0.05), (rebuilt.count, rebuilt.capacity, rebuilt.error_rate))
+            loaded = BloomFilter.load(path)
+            self.assertEqual((rebuilt.num_bits, 2, 6), (loaded.num_bits, loaded.count, loaded.capacity))
+            self.assertTrue(definitely_absent(loaded, docs[1]["_id"], "_id"))
+            self.assertFalse(definitely_absent(loaded, docs[2]["_id"], "_id"))
+            # without the documents of the index, it's only extended
+            extended = extend_id_filter(path, [{"_id": "chr2:g.%dA>T" % pos} for pos in range(10)])
+            self.assertEqual((12, 6), (extended.count, extended.capacity))
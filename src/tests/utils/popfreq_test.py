@@ -0,0 +1,28 @@
+import unittest
+
+from utils.popfreq import popfreq_summary
+
+
+class TestPopfreqSummary(unittest.TestCase):
+    def test_summary(self):
+        doc = {
+            "_id": "chr1:g.100A>T",
+            "gnomad_exome": {"af": {"af": 0.01, "af_afr": 0.03, "af_asj": 0.2, "af_afr_female": 0.5}},
+            "gnomad_genome": [{"af": {"af": 0.02, "af_nfe": 0.025}}],
+            "exac": {"af": 0.015, "ac": {"ac_eas": 4}, "an": {"an_eas": 100}},
+            "dbsnp": {"alt": "T", "alleles": [{"allele": "A", "freq": {"1000g": 0.9}},
+                                              {"allele": "T", "freq": {"1000g": 0.1, "topmed": float("inf")}}]},
+        }
+        self.assertEqual({
+            # asj is left out of popmax, but not of the maximum frequency
+            "max_af": 0.2, "max_af_source": "gnomad_exome",
+            "popmax_af": 0.04, "popmax_af_source": "exac", "popmax_population": "eas",
+        }, popfreq_summary(doc))
+
+    def test_without_populations(self):
+        doc = {"dbsnp": {"alt": "T", "alleles": {"allele": "T", "freq": {"1000g": 0.1, "topmed": "0.2"}}}}
+        self.assertEqual({"max_af": 0.2, "max_af_source": "dbsnp"}, popfreq_summary(doc))
+
+    def test_no_frequency(self):
+        self.assertIsNone(popfreq_summary({"_id": "chr1:g.100A>T", "cadd": {"phred": 10}}))
+        self.assertIsNone(popfreq_summary({"exac": {"af": None, "an": {"an_afr": 0}, "ac": {"ac_afr": 0}}}))
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from utils.hgvs import DocEncoder
+from utils.posindex import PositionIndex, build_position_index, parse_hgvs_keys, position_key, snv_key
+
+
+class TestPositionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_dir = os.path.join(self.tmp_dir.name, "position_index_hg19")
+        self.ids = [
+            "chr1:g.100A>T",
+            "chr1:g.100A>G",
+            "chr1:g.101_103del",
+            "chrX:g.5000C>T",
+            "chr1:g.100A>T",  # duplicated id
+            "rs12345",  # invalid id
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_hgvs_keys(self):
+        self.assertEqual([("1", snv_key(100, "A", "T"))], parse_hgvs_keys("chr1:g.100A>T"))
+        self.assertEqual([("1", position_key(100)), ("1", position_key(101))], parse_hgvs_keys("chr1:g.101_103del"))
+        self.assertEqual([("MT", position_key(9)), ("MT", position_key(10))], parse_hgvs_keys("chrMT:g.10_11insT"))
+        self.assertEqual([], parse_hgvs_keys("rs12345"))
+        # SNV keys of a position sort after its position key
+        self.assertLess(position_key(100), snv_key(100, "A", "C"))
+        self.assertLess(snv_key(100, "T", "G"), position_key(101))
+
+    def test_build_and_lookup(self):
+        count = build_position_index(self.ids, self.index_dir, meta={"version": 1}, memory_limit=64)
+        self.assertEqual(5, count)
+
+        with PositionIndex(self.index_dir) as index:
+            self.assertEqual(["1", "X"], index.meta["contigs"])
+            self.assertIn("chr1:g.100A>T", index)
+            self.assertNotIn("chr1:g.100A>C", index)
+            self.assertIn("chr1:g.101_103del", index)
+            self.assertNotIn("chr2:g.100A>T", index)
+
+            self.assertTrue(index.has_positions("1", 99, 100))
+            self.assertFalse(index.has_positions("1", 101, 200))
+            self.assertTrue(index.has_positions("X", 0))
+            self.assertFalse(index.has_positions("Y", 0))
+
+    def test_matcher(self):
+        build_position_index(self.ids, self.index_dir)
+
+        with PositionIndex(self.index_dir) as index:
+            matcher = index.matcher("1")
+            # VCF-style variants, by increasing positions
+            rows = [(99, "A", "C"), (100, "A", "C"), (100, "A", "G"), (100, "AC", "A"), (100, "ACAG", "A"),
+                    (100, "A", "T"), (101, "C", "T"), (101, "CAG", "C")]
+            # indels at a known position match on their HGVS id only: chr1:g.101del and chr1:g.102_103del are unknown
+            self.assertEqual([False, False, True, False, True, True, False, False], [matcher(*row) for row in rows])
+            self.assertEqual([], index.keys("Y"))
+            self.assertEqual([], index.hashes("Y"))
+
+    def test_indels_match_exactly(self):
+        build_position_index(self.ids, self.index_dir)
+
+        with PositionIndex(self.index_dir) as index:
+            self.assertIn("chr1:g.101_103del", index)
+            # same position, other indels
+            self.assertNotIn("chr1:g.101_102del", index)
+            self.assertNotIn("chr1:g.101_102insA", index)
+
+    def test_long_indel_ids(self):
+        insertion = "A" + "CGT" * 10
+        hgvs_id = "chr1:g.100_101ins" + insertion[1:]
+        _, doc = DocEncoder.encode_long_hgvs_id({"_id": hgvs_id}, max_len=40)
+        # the id is stored encoded in the source collection
+        build_position_index([doc["_id"]], self.index_dir)
+
+        with PositionIndex(self.index_dir) as index:
+            self.assertTrue(index.matcher("1", max_id_length=40)(100, "A", insertion))
+            self.assertFalse(index.matcher("1", max_id_length=40)(100, "A", insertion + "A"))
+
+    def test_rebuild_replaces_index(self):
+        build_position_index(["chr1:g.100A>T"], self.index_dir)
+        build_position_index(["chr2:g.100A>T"], self.index_dir)
+
+        with PositionIndex(self.index_dir) as index:
+            self.assertEqual(["2"], index.meta["contigs"])
+            self.assertNotIn("chr1:g.100A>T", index)
+            self.assertIn("chr2:g.100A>T", index)
@@ -0,0 +1,18 @@
+import unittest
+
+from utils.routing import chrom_routing, id_routing
+
+
+class TestRouting(unittest.TestCase):
+    def test_id_routing(self):
+        self.assertEqual("1", id_routing("chr1:g.100A>T"))
+        self.assertEqual("X", id_routing("chrX:g.100_101del"))
+        self.assertEqual("other", id_routing("chrUn_gl000220:g.100A>T"))
+
+    def test_chrom_routing(self):
+        # interval queries are case insensitive
+        self.assertEqual("X", chrom_routing("x"))
+        self.assertEqual("MT", chrom_routing("chrMT"))
+        self.assertEqual("22", chrom_routing(22))
+        self.assertEqual("other", chrom_routing("Un"))
+        self.assertEqual(id_routing("chr7:g.100A>T"), chrom_routing("7"))
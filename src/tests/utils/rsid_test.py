@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from utils.rsid import RsidIndex, build_rsid_index, parse_rsnum
+
+
+class TestRsidIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_dir = os.path.join(self.tmp_dir.name, "rsid_index_hg19")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_rsnum(self):
+        self.assertEqual(12345, parse_rsnum("rs12345"))
+        self.assertIsNone(parse_rsnum("12345"))
+        self.assertIsNone(parse_rsnum("rs"))
+        self.assertIsNone(parse_rsnum(None))
+
+    def test_build_and_lookup(self):
+        pairs = [
+            ("rs58991260", "chr1:g.218631822G>A"),
+            ("rs2", "chr2:g.2A>T"),
+            ("rs10", "chr3:g.10A>T"),
+            ("rs2", "chr2:g.2A>C"),
+            ("rs2", "chr2:g.2A>T"),  # duplicated pair
+            ("", "chr4:g.4A>T"),  # invalid rsid
+        ]
+        count = build_rsid_index(pairs, self.index_dir, meta={"version": "20240101"}, memory_limit=64)
+        self.assertEqual(3, count)
+
+        with RsidIndex(self.index_dir) as index:
+            self.assertEqual(3, len(index))
+            self.assertEqual({"version": "20240101", "count": 3}, index.meta)
+            self.assertEqual(["chr2:g.2A>T", "chr2:g.2A>C"], index.get("rs2"))
+            self.assertEqual(["chr1:g.218631822G>A"], index.get("rs58991260"))
+            self.assertEqual([], index.get("rs3"))
+            self.assertEqual([], index.get("rs99999999999"))
+
+            self.assertEqual({"rs10": ["chr3:g.10A>T"], "rs2": ["chr2:g.2A>T", "chr2:g.2A>C"]},
+                             index.get_many(["rs10", "rs3", "rs2", "rs2", "foo"]))
+
+    def test_rebuild_replaces_index(self):
+        build_rsid_index([("rs1", "chr1:g.1A>T")], self.index_dir)
+        build_rsid_index([("rs2", "chr2:g.2A>T")], self.index_dir)
+
+        with RsidIndex(self.index_dir) as index:
+            self.assertEqual([], index.get("rs1"))
+            self.assertEqual(["chr2:g.2A>T"], index.get("rs2"))
+
+    def test_empty_index(self):
+        build_rsid_index([], self.index_dir)
+
+        with RsidIndex(self.index_dir) as index:
+            self.assertEqual(0, len(index))
+            self.assertEqual([], index.get("rs1"))
+            self.assertEqual({}, index.get_many(["rs1"]))
@@ -0,0 +1,35 @@
+import unittest
+
+from utils.slim import body_fields, covered, slim_compatible
+
+
+class TestSlim(unittest.TestCase):
+    def test_covered(self):
+        allowlist = ["dbsnp.rsid", "cadd.phred", "hg19"]
+        self.assertTrue(covered("dbsnp.rsid", allowlist))
+        self.assertTrue(covered("hg19.start", allowlist))
+        self.assertTrue(covered("_id", allowlist))
+        self.assertFalse(covered("dbsnp", allowlist))
+        self.assertFalse(covered("cadd.*", allowlist))
+        self.assertFalse(covered("dbsnp.rsid_extra", allowlist))
+
+    def test_body_fields(self):
+        body = {
+            "query": {"bool": {"filter": [{"match": {"chrom": "1"}}, {"range": {"hg19.start": {"lte": 100}}}],
+                               "must": [{"multi_match": {"query": "rs58991260", "fields": ["dbsnp.rsid^2", "_id"]}}]}},
+            "_source": {"includes": ["cadd.phred"], "excludes": []},
+            "sort": [{"genomic_key.hg19": {"order": "asc"}}, "-popfreq.max_af"],
+            "aggs": {"impact": {"terms": {"field": "snpeff.ann.effect"}}},
+        }
+        self.assertEqual({"chrom", "hg19.start", "dbsnp.rsid", "_id", "cadd.phred", "genomic_key.hg19",
+                          "popfreq.max_af", "snpeff.ann.effect"}, body_fields(body))
+        self.assertTrue(slim_compatible(body))
+
+    def test_not_slim_compatible(self):
+        # all fields
+        self.assertFalse(slim_compatible({"query": {"ids": {"values": ["chr1:g.100A>T"]}}}))
+        # not allowlisted
+        self.assertFalse(slim_compatible({"query": {"match_all": {}}, "_source": ["dbnsfp.genename"]}))
+        self.assertFalse(slim_compatible({"query": {"term": {"clinvar.gene.symbol": "brca2"}}, "_source": ["cadd.phred"]}))
+        # fields can't be told
+        self.assertFalse(slim_compatible({"query": {"query_string": {"query": "cadd.phred:>20"}}, "_source": ["cadd.phred"]}))
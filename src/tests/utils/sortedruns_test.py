@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from utils.sortedruns import RunWriter, has_runs, merge_sources_runs, partition_of, read_source_runs, run_paths
+
+
+class SkipMapper:
+    def load(self):
+        pass
+
+    def process(self, docs):
+        for doc in docs:
+            if doc["_id"] != "chr1:g.300A>T":
+                yield doc
+
+
+class TestSortedRuns(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_runs(self, name, *batches):
+        run_dir = os.path.join(self.tmp_dir.name, name)
+        for docs in batches:
+            # tiny memory limit, to go through the external sort spills
+            with RunWriter(run_dir, memory_limit=64) as writer:
+                writer.extend(docs)
+                writer.commit()
+        return run_dir
+
+    def test_partition_of(self):
+        self.assertEqual("1", partition_of("chr1:g.100A>T"))
+        self.assertEqual("MT", partition_of("chrMT:g.100A>T"))
+        self.assertEqual("other", partition_of("chrUn_gl000220:g.100A>T"))
+        self.assertEqual("other", partition_of("rs12345"))
+
+    def test_write_and_read(self):
+        run_dir = self.write_runs("dbsnp", [
+            {"_id": "chr2:g.100A>T", "dbsnp": {"rsid": "rs3"}},
+            {"_id": "chr1:g.200A>T", "dbsnp": {"rsid": "rs2"}},
+            {"_id": "chr1:g.100A>T", "dbsnp": {"rsid": "rs1"}},
+        ], [
+            {"_id": "chr1:g.150A>T", "dbsnp": {"rsid": "rs4"}},
+            {"_id": "chr1:g.100A>T", "dbsnp": {"rsid": "rs5"}},  # duplicated
+        ])
+        self.assertTrue(has_runs(run_dir))
+        self.assertEqual(2, len(run_paths(run_dir, "1")))
+        self.assertEqual(1, len(run_paths(run_dir, "2")))
+        self.assertEqual([], run_paths(run_dir, "X"))
+
+        docs = list(read_source_runs(run_dir, "1"))
+        self.assertEqual(["chr1:g.100A>T", "chr1:g.150A>T", "chr1:g.200A>T"], [doc["_id"] for doc in docs])
+        self.assertIn(docs[0]["dbsnp"]["rsid"], ("rs1", "rs5"))
+
+    def test_merge_sources_runs(self):
+        dbsnp_dir = self.write_runs("dbsnp", [
+            {"_id": "chr1:g.100A>T", "dbsnp": {"rsid": "rs1"}, "chrom": "1"},
+            {"_id": "chr1:g.300A>T", "dbsnp": {"rsid": "rs3"}},
+        ])
+        cadd_dir = self.write_runs("cadd", [
+            {"_id": "chr1:g.200A>T", "cadd": {"phred": 1.5}},
+            {"_id": "chr1:g.100A>T", "cadd": {"phred": 3.2}, "chrom": "1"},
+            {"_id": "chr1:g.300A>T", "cadd": {"phred": 0.5}},
+        ])
+        merged = list(merge_sources_runs([(dbsnp_dir, None), (cadd_dir, SkipMapper())], "1"))
+        self.assertEqual([
+            ({"_id": "chr1:g.100A>T", "dbsnp": {"rsid": "rs1"}, "cadd": {"phred": 3.2}, "chrom": "1"}, [0, 1]),
+            ({"_id": "chr1:g.200A>T", "cadd": {"phred": 1.5}}, [1]),
+            ({"_id": "chr1:g.300A>T", "dbsnp": {"rsid": "rs3"}}, [0]),
+        ], merged)
@@ -0,0 +1,97 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from utils.table import TableColumn
+from utils.tabular import TabularMapper, iter_rows, merge_duplicates, number_or_list, to_number
+
+
+class TestTabularMapper(unittest.TestCase):
+    def setUp(self):
+        self.columns = [
+            TableColumn(name="#Chrom", dest="chrom", tag="chrom"),
+            TableColumn(name="Pos", dest="pos", tag="pos"),
+            None,
+            TableColumn(name="GerpN", dest="gerp.n"),
+            TableColumn(name="GerpS", dest="gerp.s", transform=float),
+            TableColumn(name="Domain", dest="gene.prot.domain", transform=lambda v: None if v == "-" else v),
+        ]
+
+    def test_to_number(self):
+        self.assertEqual(12, to_number("12"))
+        self.assertEqual(0.5, to_number("0.5"))
+        self.assertEqual(1e-05, to_number("1e-05"))
+        self.assertEqual("A,T", to_number("A,T"))
+
+    def test_number_or_list(self):
+        convert = number_or_list(",")
+        self.assertEqual(12, convert("12"))
+        self.assertEqual(["a", " b"], convert("a, b,"))
+        self.assertEqual("a", convert("a"))
+
+    def test_map_row(self):
+        mapper = TabularMapper(root="cadd", columns=self.columns, na_values={"NA"})
+        self.assertEqual({"chrom": "X", "pos": 10001, "gerp": {"n": 4.5, "s": 1.0}, "gene": {"prot": {"domain": "ndomain"}}},
+                         mapper(["X", "10001", "ignored", "4.5", "1", "ndomain"]))
+
+    def test_na_values(self):
+        mapper = TabularMapper(root="cadd", columns=self.columns, na_values={"NA", ""})
+        # empty nested fields are not created
+        self.assertEqual({"chrom": 1, "pos": 10001}, mapper(["1", "10001", "NA", "NA", "", "-"]))
+
+    def test_strict(self):
+        mapper = TabularMapper(root="cadd", columns=self.columns)
+        with self.assertRaises(ValueError):
+            mapper(["1", "10001"])
+
+    def test_tags(self):
+        mapper = TabularMapper(root="cadd", columns=self.columns)
+        self.assertEqual(1, mapper.index_of("pos"))
+        self.assertEqual(["1", "10001"], mapper.getter("chrom", "pos")(["1", "10001", "", "", "", ""]))
+
+    def test_to_doc(self):
+        mapper = TabularMapper(root="cadd", columns=self.columns[:2])
+        self.assertEqual({"_id": "chr1:g.10001T>A", "cadd": {"chrom": 1, "pos": 10001}},
+                         mapper.to_doc(["1", "10001"], "chr1:g.10001T>A"))
+
+
+class TestMergeDuplicates(unittest.TestCase):
+    def test_merge_duplicates(self):
+        docs = [
+            {"_id": "a", "src": {"x": 1, "y": 2}},
+            {"_id": "a", "src": {"x": 1, "y": 3}},
+            {"_id": "a", "src": {"x": 1, "y": 4, "z": 5}},
+            {"_id": "b", "src": {"x": 1}},
+            {"_id": "a", "src": {"x": 2}},
+        ]
+        self.assertEqual([
+            # "z" is missing from the first doc, kept
+            {"_id": "a", "src": {"x": 1, "y": [2, 3, 4], "z": 5}},
+            {"_id": "b", "src": {"x": 1}},
+            {"_id": "a", "src": {"x": 2}},
+        ], list(merge_duplicates(docs, "src")))
+
+
+class TestIterRows(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.content = "## comment\n#Chrom\tPos\n1\t10001\nX\t10002\n"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_plain(self):
+        path = os.path.join(self.tmp_dir.name, "rows.tsv")
+        with open(path, "w") as out_f:
+            out_f.write(self.content)
+        self.assertEqual([["1", "10001"], ["X", "10002"]], list(iter_rows(path, comment="#")))
+        self.assertEqual([["#Chrom", "Pos"], ["1", "10001"], ["X", "10002"]], list(iter_rows(path, skip_lines=1)))
+
+    def test_bgzip(self):
+        # bgzip files are multi-member gzip files
+        path = os.path.join(self.tmp_dir.name, "rows.tsv.bgz")
+        with open(path, "wb") as out_f:
+            for line in self.content.splitlines(keepends=True):
+                out_f.write(gzip.compress(line.encode()))
+        self.assertEqual([["1", "10001"], ["X", "10002"]], list(iter_rows(path, comment="#")))
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import hub.dataload.sources.cadd.cadd_parser as cadd_parser
+from utils.cadd import COLUMNS
+from utils.posindex import PositionIndex, build_position_index
+from web.lazy import CaddTabixSource, iter_hits, requested_fields, select_fields
+
+
+class FakeTabix:
+    contigs = ["1"]
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def fetch(self, contig, start, end):
+        return [line for line in self.lines if start < int(line.split("\t")[1]) <= end]
+
+
+def cadd_line(pos, ref, alt, phred):
+    row = ["NA"] * 116
+    row[0:5] = ["1", str(pos), ref, ref[0], alt]
+    row[114:116] = ["1.5", phred]
+    return "\t".join(row)
+
+
+class TestRequestedFields(unittest.TestCase):
+    def test_requested_fields(self):
+        self.assertTrue(requested_fields(None, "cadd"))
+        self.assertTrue(requested_fields(["all"], "cadd"))
+        self.assertTrue(requested_fields(["cadd", "dbsnp.rsid"], "cadd"))
+        self.assertTrue(requested_fields(["cad*"], "cadd"))
+        self.assertEqual(["cadd.phred", "cadd.gerp.*"], requested_fields(["cadd.phred", "cadd.gerp.*", "dbsnp"], "cadd"))
+        self.assertIsNone(requested_fields(["dbsnp.rsid"], "cadd"))
+        self.assertIsNone(requested_fields(["-cadd"], "cadd"))
+
+    def test_select_fields(self):
+        doc = {"phred": 12, "gerp": {"n": 1, "s": 2}, "polyphen": {"cat": "benign"}}
+        self.assertEqual({"phred": 12, "gerp": {"n": 1, "s": 2}},
+                         select_fields(doc, ["cadd.phred", "cadd.gerp"], "cadd"))
+        self.assertEqual({"gerp": {"n": 1}}, select_fields(doc, ["cadd.gerp.n"], "cadd"))
+        self.assertEqual({"gerp": {"n": 1, "s": 2}}, select_fields(doc, ["cadd.gerp.*"], "cadd"))
+
+    def test_iter_hits(self):
+        response = {"hits": {"hits": [{"_id": "a"}]}}
+        self.assertEqual([{"_id": "a"}], list(iter_hits(response)))
+        self.assertEqual([{"_id": "a"}], list(iter_hits([response, {"error": "failed"}])))
+
+
+class TestCaddTabixSource(unittest.TestCase):
+    def setUp(self):
+        self.source = CaddTabixSource.__new__(CaddTabixSource)
+        self.source.batch_size = 2
+        self.source.executor = None
+        tabix = FakeTabix([cadd_line(100, "A", "T", "12"), cadd_line(100, "A", "T", "12"),
+                           cadd_line(100, "A", "G", "3"), cadd_line(104, "TCA", "T", "20")])
+        self.source._tabix = lambda: tabix
+
+    def test_lookup(self):
+        result = self.source.lookup(["chr1:g.100A>T", "chr1:g.105_106del", "chr1:g.100A>C", "chr2:g.100A>T"])
+        self.assertEqual(["chr1:g.100A>T", "chr1:g.105_106del"], sorted(result))
+        self.assertEqual(12, result["chr1:g.100A>T"]["phred"])
+        self.assertEqual(20, result["chr1:g.105_106del"]["phred"])
+
+    def test_missing_pysam(self):
+        with mock.patch.dict("sys.modules", {"pysam": None}):
+            with self.assertRaisesRegex(ImportError, "pysam is required"):
+                CaddTabixSource("cadd.tsv.gz")
+
+    def test_annotate(self):
+        result = asyncio.run(self.source.annotate(["chr1:g.100A>T", "chr1:g.100A>G", "chr1:g.100A>T"]))
+        self.assertEqual({"chr1:g.100A>T": 12, "chr1:g.100A>G": 3}, {k: v["phred"] for k, v in result.items()})
+
+
+class TestLazyIndexedEquivalence(unittest.TestCase):
+    """
+    CADD served from the tabix file is the same as CADD indexed by the hub.
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_dir = os.path.join(self.tmp_dir.name, "position_index_hg19")
+        build_position_index(["chr1:g.100A>T", "chr1:g.105_106del"], self.index_dir)
+        cadd_parser.position_index = PositionIndex(self.index_dir)
+
+    def tearDown(self):
+        cadd_parser.position_index.close()
+        self.tmp_dir.cleanup()
+
+    def test_multiple_rows(self):
+        genename_column = next(i for i, column in enumerate(COLUMNS) if column and column.dest == "gene.genename")
+        lines = []
+        # several rows per variant, the first ones without gene
+        for pos, ref, alt, annotype, genename in [(100, "A", "T", "Intergenic", "NA"),
+                                                  (100, "A", "T", "CodingTranscript", "BRCA2"),
+                                                  (100, "A", "T", "RegulatoryFeature", "NA"),
+                                                  (104, "TCA", "T", "CodingTranscript", "BRCA2"),
+                                                  (104, "TCA", "T", "CodingTranscript", "ZAR1L")]:
+            row = cadd_line(pos, ref, alt, "12").split("\t")
+            row[9] = annotype
+            row[genename_column] = genename
+            lines.append("\t".join(row))
+        tabix = FakeTabix(lines)
+        source = CaddTabixSource.__new__(CaddTabixSource)
+        source._tabix = lambda: tabix
+        cadd_parser.tabix = FakeTabix(lines)
+
+        indexed = {doc["_id"]: doc["cadd"] for doc in cadd_parser.load_region("1", 0, 1000)}
+        self.assertEqual(["chr1:g.100A>T", "chr1:g.105_106del"], sorted(indexed))
+        self.assertEqual({"genename": "BRCA2"}, indexed["chr1:g.100A>T"]["gene"])
+        self.assertEqual(indexed, source.lookup(["chr1:g.100A>T", "chr1:g.105_106del"]))
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+
+from elasticsearch_dsl import MultiSearch, Search
+
+from utils.idfilter import build_id_filter
+from web.pipeline import MVQueryBackend
+
+
+class FakeAsyncClient:
+    """
+    Records the multi-search requests, and answers each search with one hit of its queried id.
+    """
+    def __init__(self):
+        self.requests = []
+
+    async def msearch(self, body, index):
+        self.requests.append((index, body))
+        return {"responses": [{"hits": {"total": 1, "hits": [{"_id": search["query"]["multi_match"]["query"]}]}}
+                              for search in body[1::2]]}
+
+
+def id_search(_id, **params):
+    return Search().query("multi_match", query=_id, fields=["_id"]).params(**params)
+
+
+class TestMVQueryBackend(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeAsyncClient()
+        self.backend = MVQueryBackend(self.client, {None: "myvariant_hg19"})
+        self.bloom = build_id_filter([{"_id": "chr1:g.100A>T"}, {"_id": "chr2:g.200C>G"}], capacity=10)
+
+    def test_execute_known_ids(self):
+        query = MultiSearch().add(id_search("chr1:g.100A>T", routing="1")) \
+            .add(id_search("chr3:g.300G>A", routing="3")) \
+            .add(id_search("chr2:g.200C>G").index("myvariant_hg19"))
+        responses = asyncio.run(self.backend._execute_known_ids(query, self.bloom))
+        self.assertEqual([["chr1:g.100A>T"], [], ["chr2:g.200C>G"]],
+                         [[hit["_id"] for hit in response["hits"]["hits"]] for response in responses])
+        # the searches of known ids are sent as they were built
+        (index, body), = self.client.requests
+        self.assertEqual("myvariant_hg19", index)
+        request = query.to_dict()
+        self.assertEqual(request[:2] + request[4:], body)
+
+    def test_execute_missing_ids(self):
+        query = MultiSearch().add(id_search("chr3:g.300G>A")).add(id_search("chr4:g.400G>A"))
+        responses = asyncio.run(self.backend._execute_known_ids(query, self.bloom))
+        self.assertEqual([0, 0], [response["hits"]["total"] for response in responses])
+        self.assertEqual([], self.client.requests)
+
+        response = asyncio.run(self.backend._execute_known_ids(id_search("chr3:g.300G>A"), self.bloom))
+        self.assertEqual([], response["hits"]["hits"])
+        self.assertEqual([], self.client.requests)
+
+    def test_adjust_index(self):
+        self.backend.SLIM_INDEX = True
+        self.backend.slim_indices["myvariant_hg19"] = ("myvariant_hg19_slim", 0)
+        slim = id_search("chr1:g.100A>T").source(["_id", "vcf.ref"])
+        full = id_search("chr1:g.100A>T")
+        self.assertEqual("myvariant_hg19_slim", self.backend.adjust_index("myvariant_hg19", slim))
+        self.assertEqual("myvariant_hg19", self.backend.adjust_index("myvariant_hg19", full))
+        self.assertEqual("myvariant_hg19_slim",
+                         self.backend.adjust_index("myvariant_hg19", MultiSearch().add(slim).add(slim)))
+        self.assertEqual("myvariant_hg19",
+                         self.backend.adjust_index("myvariant_hg19", MultiSearch().add(slim).add(full)))
+
+
+if __name__ == "__main__":
+    unittest.main()
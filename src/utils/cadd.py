@@ -0,0 +1,142 @@
+"""
+Columns of the CADD annotation files (http://cadd.gs.washington.edu/download), shared by the CADD parser and by
+the web layer when CADD is annotated at query time from the tabix file (see `web.lazy`).
+"""
+
+from utils.hgvs import get_hgvs_from_vcf
+from utils.table import TableColumn
+from utils.tabular import TabularMapper
+
+# one column per field/annotation, in file order
+COLUMNS = [
+    TableColumn(name="#Chrom", dest="chrom", tag="chrom"),
+    TableColumn(name="Pos", dest="pos", tag="pos"),
+    TableColumn(name="Ref", dest="ref", tag="ref"),
+    TableColumn(name="Anc", dest="anc"),
+    TableColumn(name="Alt", dest="alt", tag="alt"),
+    TableColumn(name="Type", dest="type"),
+    TableColumn(name="Length", dest="length"),
+    TableColumn(name="isTv", dest="istv"),
+    TableColumn(name="isDerived", dest="isderived"),
+    TableColumn(name="AnnoType", dest="annotype"),
+    TableColumn(name="Consequence", dest="consequence"),
+    TableColumn(name="ConsScore", dest="consscore"),
+    TableColumn(name="ConsDetail", dest="consdetail"),
+    TableColumn(name="GC", dest="gc"),
+    TableColumn(name="CpG", dest="cpg"),
+    TableColumn(name="mapAbility20bp", dest="mapability.20bp"),
+    TableColumn(name="mapAbility35bp", dest="mapability.35bp"),
+    TableColumn(name="scoreSegDup", dest="scoresegdup"),
+    TableColumn(name="priPhCons", dest="phast_cons.primate"),
+    TableColumn(name="mamPhCons", dest="phast_cons.mammalian"),
+    TableColumn(name="verPhCons", dest="phast_cons.vertebrate"),
+    TableColumn(name="priPhyloP", dest="phylop.primate"),
+    TableColumn(name="mamPhyloP", dest="phylop.mammalian"),
+    TableColumn(name="verPhyloP", dest="phylop.vertebrate"),
+    TableColumn(name="GerpN", dest="gerp.n"),
+    TableColumn(name="GerpS", dest="gerp.s"),
+    TableColumn(name="GerpRS", dest="gerp.rs"),
+    TableColumn(name="GerpRSpval", dest="gerp.rs_pval"),
+    TableColumn(name="bStatistic", dest="bstatistic"),
+    TableColumn(name="mutIndex", dest="mutindex"),
+    TableColumn(name="dnaHelT", dest="dna.helt"),
+    TableColumn(name="dnaMGW", dest="dna.mgw"),
+    TableColumn(name="dnaProT", dest="dna.prot"),
+    TableColumn(name="dnaRoll", dest="dna.roll"),
+    TableColumn(name="mirSVR-Score", dest="mirsvr.score"),
+    TableColumn(name="mirSVR-E", dest="mirsvr.e"),
+    TableColumn(name="mirSVR-Aln", dest="mirsvr.aln"),
+    TableColumn(name="targetScan", dest="targetscans"),
+    TableColumn(name="fitCons", dest="fitcons"),
+    TableColumn(name="cHmmTssA", dest="chmm.tssa"),
+    TableColumn(name="cHmmTssAFlnk", dest="chmm.tssaflnk"),
+    TableColumn(name="cHmmTxFlnk", dest="chmm.txflnk"),
+    TableColumn(name="cHmmTx", dest="chmm.tx"),
+    TableColumn(name="cHmmTxWk", dest="chmm.txwk"),
+    TableColumn(name="cHmmEnhG", dest="chmm.enh"),
+    None,  # cHmmEnh, not loaded ("chmm.enh" is taken by cHmmEnhG)
+    TableColumn(name="cHmmZnfRpts", dest="chmm.znfrpts"),
+    TableColumn(name="cHmmHet", dest="chmm.het"),
+    TableColumn(name="cHmmTssBiv", dest="chmm.tssbiv"),
+    TableColumn(name="cHmmBivFlnk", dest="chmm.bivflnk"),
+    TableColumn(name="cHmmEnhBiv", dest="chmm.enhbiv"),
+    TableColumn(name="cHmmReprPC", dest="chmm.reprpc"),
+    TableColumn(name="cHmmReprPCWk", dest="chmm.reprpcwk"),
+    TableColumn(name="cHmmQuies", dest="chmm.quies"),
+    TableColumn(name="EncExp", dest="encode.exp"),
+    TableColumn(name="EncH3K27Ac", dest="encode.h3k27ac"),
+    TableColumn(name="EncH3K4Me1", dest="encode.h3k4me1"),
+    TableColumn(name="EncH3K4Me3", dest="encode.h3k4me3"),
+    TableColumn(name="EncNucleo", dest="encode.nucleo"),
+    TableColumn(name="EncOCC", dest="encode.occ"),
+    TableColumn(name="EncOCCombPVal", dest="encode.p_val.comb"),
+    TableColumn(name="EncOCDNasePVal", dest="encode.p_val.dnas"),
+    TableColumn(name="EncOCFairePVal", dest="encode.p_val.faire"),
+    TableColumn(name="EncOCpolIIPVal", dest="encode.p_val.polii"),
+    TableColumn(name="EncOCctcfPVal", dest="encode.p_val.ctcf"),
+    TableColumn(name="EncOCmycPVal", dest="encode.p_val.mycp"),
+    TableColumn(name="EncOCDNaseSig", dest="encode.sig.dnase"),
+    TableColumn(name="EncOCFaireSig", dest="encode.sig.faire"),
+    TableColumn(name="EncOCpolIISig", dest="encode.sig.polii"),
+    TableColumn(name="EncOCctcfSig", dest="encode.sig.ctcf"),
+    TableColumn(name="EncOCmycSig", dest="encode.sig.myc"),
+    TableColumn(name="Segway", dest="segway"),
+    TableColumn(name="tOverlapMotifs", dest="motif.toverlap"),
+    TableColumn(name="motifDist", dest="motif.dist"),
+    TableColumn(name="motifECount", dest="motif.ecount"),
+    TableColumn(name="motifEName", dest="motif.ename"),
+    TableColumn(name="motifEHIPos", dest="motif.ehipos"),
+    TableColumn(name="motifEScoreChng", dest="motif.escorechng"),
+    TableColumn(name="TFBS", dest="tf.bs"),
+    TableColumn(name="TFBSPeaks", dest="tf.bs_peaks"),
+    TableColumn(name="TFBSPeaksMax", dest="tf.bs_peaks_max"),
+    TableColumn(name="isKnownVariant", dest="isknownvariant"),
+    TableColumn(name="ESP_AF", dest="esp.af"),
+    TableColumn(name="ESP_AFR", dest="esp.afr"),
+    TableColumn(name="ESP_EUR", dest="esp.eur"),
+    TableColumn(name="TG_AF", dest="1000g.af"),
+    TableColumn(name="TG_ASN", dest="1000g.asn"),
+    TableColumn(name="TG_AMR", dest="1000g.amr"),
+    TableColumn(name="TG_AFR", dest="1000g.afr"),
+    TableColumn(name="TG_EUR", dest="1000g.eur"),
+    TableColumn(name="minDistTSS", dest="min_dist_tss"),
+    TableColumn(name="minDistTSE", dest="min_dist_tse"),
+    TableColumn(name="GeneID", dest="gene.gene_id"),
+    TableColumn(name="FeatureID", dest="gene.feature_id"),
+    TableColumn(name="CCDS", dest="gene.ccds_id"),
+    TableColumn(name="GeneName", dest="gene.genename"),
+    TableColumn(name="cDNApos", dest="gene.cds.cdna_pos"),
+    TableColumn(name="relcDNApos", dest="gene.cds.rel_cdna_pos"),
+    TableColumn(name="CDSpos", dest="gene.cds.cds_pos"),
+    TableColumn(name="relCDSpos", dest="gene.cds.rel_cds_pos"),
+    TableColumn(name="protPos", dest="gene.prot.protpos"),
+    TableColumn(name="relProtPos", dest="gene.prot.rel_prot_pos"),
+    TableColumn(name="Domain", dest="gene.prot.domain"),
+    TableColumn(name="Dst2Splice", dest="dst2splice"),
+    TableColumn(name="Dst2SplType", dest="dst2spltype"),
+    TableColumn(name="Exon", dest="exon"),
+    TableColumn(name="Intron", dest="intron"),
+    TableColumn(name="oAA", dest="oaa"),  # ref aa
+    TableColumn(name="nAA", dest="naa"),  # alt aa
+    TableColumn(name="Grantham", dest="grantham"),
+    TableColumn(name="PolyPhenCat", dest="polyphen.cat"),
+    TableColumn(name="PolyPhenVal", dest="polyphen.val"),
+    TableColumn(name="SIFTcat", dest="sift.cat"),
+    TableColumn(name="SIFTval", dest="sift.val"),
+    TableColumn(name="RawScore", dest="rawscore"),  # raw CADD score
+    TableColumn(name="PHRED", dest="phred"),  # log-percentile of raw CADD score
+]
+VALID_COLUMN_NO = len(COLUMNS)
+
+MAPPER = TabularMapper(root="cadd", columns=COLUMNS, na_values={"NA"})
+get_vcf_fields = MAPPER.getter("chrom", "pos", "ref", "alt")
+
+
+# convert one snp to json
+def map_line_to_json(fields):
+    HGVS = get_hgvs_from_vcf(*get_vcf_fields(fields))
+
+    # load as json data
+    if HGVS is None:
+        return
+    yield MAPPER.to_doc(fields, HGVS)
@@ -0,0 +1,196 @@
+"""
+Resolution of (non-genomic) HGVS ids to MyVariant ids through the ClinGen Allele Registry
+(http://reg.genome.network/), e.g. "NM_007294.3:c.5266dupC" => ["chr17:g.41209079_41209080insG"].
+
+Resolved ids are stored in a persistent SQLite cache, keyed by assembly and input HGVS, so that reloading a source
+only submits the ids never seen before (or no request at all in offline mode). Ids ClinGen has no MyVariant id for
+are submitted again once their cache entry is older than `NEGATIVE_TTL`, as they may have been registered since.
+"""
+
+import logging
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import orjson
+
+CLINGEN_ALLELES_URL = "http://reg.genome.network/alleles?file=hgvs"
+
+# name of the external record holding MyVariant ids in ClinGen documents
+ASSEMBLY_MAPPING = {
+    "hg19": "MyVariantInfo_hg19",
+    "hg38": "MyVariantInfo_hg38"
+}
+
+# seconds unresolved ids are cached for
+NEGATIVE_TTL = 30 * 24 * 3600
+
+
+def parse_myvariant_ids(doc, assembly):
+    """
+    Retrieve the MyVariant ids from a document returned by ClinGen, e.g.
+
+        {"externalRecords": {"MyVariantInfo_hg19": [{"id": "chr17:g.41209079_41209080insG"}], ...}, ...}
+    """
+    records = doc.get("externalRecords") if isinstance(doc, dict) else None
+    if not records:
+        return []
+    res = records.get(ASSEMBLY_MAPPING[assembly])
+    if not res:
+        return []
+    return [_doc['id'] for _doc in res if _doc]
+
+
+class ClingenResolverCache:
+    """
+    SQLite-backed cache of {(assembly, hgvs): [myvariant_ids]}, with the time each entry was cached at.
+    An empty list is a valid cached value, meaning that ClinGen has no MyVariant id for this HGVS (yet).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS clingen_cache "
+                          "(assembly TEXT NOT NULL, hgvs TEXT NOT NULL, ids BLOB NOT NULL, "
+                          "cached_at REAL NOT NULL, PRIMARY KEY (assembly, hgvs))")
+        self.conn.commit()
+
+    def get_many(self, hgvs_ids, assembly, negative_ttl=None, chunk_size=500):
+        """
+        Return a dict of {hgvs: [myvariant_ids]} for the cached ids among `hgvs_ids`, leaving out the empty lists
+        cached more than `negative_ttl` seconds ago (if not None).
+        """
+        hgvs_ids = list(hgvs_ids)
+        expired = time.time() - negative_ttl if negative_ttl is not None else None
+        result = {}
+        for i in range(0, len(hgvs_ids), chunk_size):
+            chunk = hgvs_ids[i:i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.conn.execute("SELECT hgvs, ids, cached_at FROM clingen_cache "
+                                       f"WHERE assembly = ? AND hgvs IN ({placeholders})", [assembly] + chunk)
+            for hgvs, ids, cached_at in cursor:
+                ids = orjson.loads(ids)
+                if ids or expired is None or cached_at >= expired:
+                    result[hgvs] = ids
+        return result
+
+    def set_many(self, mapping: dict, assembly):
+        cached_at = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO clingen_cache (assembly, hgvs, ids, cached_at) VALUES (?, ?, ?, ?)",
+                              [(assembly, hgvs, orjson.dumps(ids), cached_at) for hgvs, ids in mapping.items()])
+        self.conn.commit()
+
+    def count(self, assembly=None):
+        if assembly is None:
+            return self.conn.execute("SELECT COUNT(*) FROM clingen_cache").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM clingen_cache WHERE assembly = ?", (assembly,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class ClingenResolver:
+    """
+    Resolve HGVS ids to MyVariant ids with the ClinGen Allele Registry.
+
+    Ids not found in the cache are submitted by batches of `batch_size`, with at most `max_workers` batches in flight.
+    Failed batches are retried `max_retries` times with exponential backoff. Ids cached as unresolved more than
+    `negative_ttl` seconds ago are submitted again. In `offline` mode, no request is sent and only cached ids are
+    resolved.
+
+    Usage:
+
+        with ClingenResolver(cache_path="/data/clingen_cache.sqlite") as resolver:
+            mapping = resolver.resolve(hgvs_ids, assembly="hg19")  # {hgvs: [myvariant_ids]}
+    """
+    def __init__(self, cache_path: str, url: str = CLINGEN_ALLELES_URL, batch_size=1000, max_workers=4,
+                 max_retries=5, backoff_base=2.0, backoff_max=120.0, timeout=600, offline=False,
+                 negative_ttl=NEGATIVE_TTL, logger=None):
+        self.cache = ClingenResolverCache(cache_path)
+        self.url = url
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.offline = offline
+        self.negative_ttl = negative_ttl
+        self.logger = logger or logging.getLogger("clingen_resolver")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.cache.close()
+
+    def _post_batch(self, batch):
+        # `requests` is only needed when actually querying ClinGen, offline resolution works without it
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = requests.post(self.url, data="\n".join(batch), headers={'content-type': "text/plain"},
+                                    timeout=self.timeout)
+                res.raise_for_status()
+                docs = res.json()
+                if len(docs) != len(batch):
+                    raise ValueError("Expecting %d documents from ClinGen, got %d" % (len(batch), len(docs)))
+                return docs
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError, ValueError) as e:
+                # ClinGen answers 500s/429s under load, other HTTP errors are not worth retrying
+                if isinstance(e, requests.HTTPError) and e.response is not None and \
+                        e.response.status_code < 500 and e.response.status_code != 429:
+                    raise
+                if attempt == self.max_retries:
+                    self.logger.error("Giving up on ClinGen batch after %d attempts: %s" % (attempt + 1, e))
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * (0.5 + random.random() / 2)
+                self.logger.warning("Error querying ClinGen (%s), retrying in %.1fs" % (e, delay))
+                time.sleep(delay)
+
+    def resolve(self, hgvs_ids, assembly):
+        """
+        Return a dict of {hgvs: [myvariant_ids]} for each distinct id in `hgvs_ids`.
+        In offline mode, ids missing from the cache are resolved to an empty list.
+        """
+        if assembly not in ASSEMBLY_MAPPING:
+            raise ValueError("Unknown assembly '%s'" % assembly)
+
+        hgvs_ids = list(set(hgvs_ids))
+        # offline, expired entries are still the best answer
+        hgvs_dict = self.cache.get_many(hgvs_ids, assembly, negative_ttl=None if self.offline else self.negative_ttl)
+        missing = [_id for _id in hgvs_ids if _id not in hgvs_dict]
+        self.logger.info("%d HGVS ids found in ClinGen cache, %d to resolve" % (len(hgvs_dict), len(missing)))
+
+        if self.offline:
+            if missing:
+                self.logger.warning("Offline mode, %d HGVS ids left unresolved" % len(missing))
+            for _id in missing:
+                hgvs_dict[_id] = []
+            return hgvs_dict
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._post_batch, batch): batch for batch in batches}
+            for cnt, future in enumerate(as_completed(futures), start=1):
+                batch = futures[future]
+                # loop through clingen results and input hgvs id in parallel
+                batch_dict = {_id: parse_myvariant_ids(_doc, assembly) for _doc, _id in zip(future.result(), batch)}
+                # caching from the calling thread only, sqlite connections can't be shared between threads
+                self.cache.set_many(batch_dict, assembly)
+                hgvs_dict.update(batch_dict)
+                self.logger.debug("Resolved ClinGen batch %d/%d" % (cnt, len(batches)))
+
+        return hgvs_dict
+
+
+def default_cache_path(data_folder):
+    """
+    Cache location shared by all the releases of a source, i.e. in the parent of its release folder.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(data_folder)), "clingen_cache.sqlite")
@@ -0,0 +1,94 @@
+"""
+Doc values fast path: when the requested fields are all scalar fields stored in doc values, a search can return
+them with `docvalue_fields` and `_source: false`, so ES doesn't load and decompress the whole `_source` of each hit
+(by far the biggest cost of narrow batch annotation queries). E.g. "fields=cadd.phred,dbnsfp.revel.score" returns
+
+    {"_id": "chr1:g.100A>T", "fields": {"cadd.phred": [23.399999618530273], "dbnsfp.revel.score": [0.1, 0.5]}}
+
+rebuilt as the `_source` of the hit by `docvalue_source()`:
+
+    {"_id": "chr1:g.100A>T", "_source": {"cadd": {"phred": 23.4}, "dbnsfp": {"revel": {"score": [0.1, 0.5]}}}}
+
+Doc values aren't the documents, so the rebuilt `_source` differs from the stored one in a few ways:
+multi-valued fields are the sorted, distinct values, a list of a single value is a single value, and objects in
+lists are merged (e.g. "snpeff.ann.effect" as one list instead of one value per "snpeff.ann" object).
+That's why the fast path is an option of the query builder (see web.pipeline.DocValueQueryBuilder).
+"""
+
+import struct
+
+# field types whose doc values are their values, as indexed
+# (e.g. not "scaled_float", rounded, or "date", formatted)
+DOCVALUE_TYPES = {"keyword", "long", "integer", "short", "byte", "double", "float", "boolean"}
+
+
+def _field_mapping(mappings: dict, field: str):
+    mapping = {"properties": mappings}
+    for key in field.split("."):
+        mapping = (mapping.get("properties") or {}).get(key)
+        if not isinstance(mapping, dict):
+            return None
+    return mapping
+
+
+def is_docvalue_field(mappings: dict, field: str):
+    """
+    Whether `field` is a scalar field with doc values holding all its values, in `mappings` (the properties of an
+    index mapping).
+    """
+    mapping = _field_mapping(mappings, field)
+    return bool(
+        mapping
+        and mapping.get("type") in DOCVALUE_TYPES
+        and mapping.get("doc_values", True)
+        # normalized or too long keywords aren't stored as such in doc values
+        and "normalizer" not in mapping
+        and "ignore_above" not in mapping
+    )
+
+
+def docvalue_fields(fields, mappings: dict):
+    """
+    The fields of a projection (the `_source` option) to request as `docvalue_fields`, None if it can't be.
+    """
+    if not isinstance(fields, list) or not fields or not mappings:
+        return None
+    if any(field == "all" or field.startswith("-") or "*" in field for field in fields):
+        return None
+    if not all(is_docvalue_field(mappings, field) for field in fields):
+        return None
+    return list(dict.fromkeys(fields))
+
+
+def _float_value(value: float):
+    # "float" doc values are returned as doubles, e.g. 23.4 as 23.399999618530273:
+    # the shortest decimal of the same single precision value is the indexed one
+    try:
+        single = struct.pack("f", value)
+    except OverflowError:
+        return value
+    if struct.unpack("f", single)[0] != value:
+        # not a single precision value
+        return value
+    for digits in range(1, 10):
+        candidate = float(f"{value:.{digits}g}")
+        if struct.pack("f", candidate) == single:
+            return candidate
+    return value
+
+
+def docvalue_source(hit_fields: dict):
+    """
+    Rebuild the `_source` of a hit from its doc values (its "fields"), see module docstring.
+    """
+    source = {}
+    for field, values in sorted(hit_fields.items()):
+        values = [_float_value(value) if isinstance(value, float) else value for value in values]
+        if not values:
+            continue
+        *path, key = field.split(".")
+        subdoc = source
+        for parent in path:
+            subdoc = subdoc.setdefault(parent, {})
+        subdoc[key] = values[0] if len(values) == 1 else values
+    return source
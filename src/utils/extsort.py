@@ -0,0 +1,161 @@
+"""
+Disk-backed external sort, for parsers which would otherwise have to materialize a whole source in memory just to
+sort or group its documents (e.g. by `_id`).
+
+Items are serialized (with the highest pickle protocol) as soon as they are added, and buffered as (key, bytes) pairs.
+Once the buffered bytes exceed the memory budget, the buffer is sorted by key and spilled as a "run" to a temporary
+file. When all items are added, the runs are k-way merged back into a single sorted stream.
+"""
+
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Iterable
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 ** 2  # 256MB of serialized items
+
+
+class ExternalSorter:
+    """
+    Sort items by `key`, using at most (roughly) `memory_limit` bytes of serialized items in memory.
+
+    Usage:
+
+        with ExternalSorter(key=lambda doc: doc["_id"]) as sorter:
+            sorter.extend(doc_generator)
+            for _id, docs in sorter.groupby():
+                ...
+
+    Sorting is stable, i.e. items with equal keys are returned in their insertion order.
+    Temporary files are created under `tmp_dir` (system default if None) and deleted when the sorter is closed.
+    """
+    def __init__(self, key: Callable, memory_limit: int = DEFAULT_MEMORY_LIMIT, tmp_dir: str = None):
+        self.key = key
+        self.memory_limit = memory_limit
+        self.tmp_dir = tmp_dir
+
+        self._buffer = []  # list of (key, serialized_item)
+        self._buffer_size = 0
+        self._run_dir = None
+        self._run_paths = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def run_count(self):
+        return len(self._run_paths)
+
+    def add(self, item):
+        if self._closed:
+            raise ValueError("Cannot add items to a closed ExternalSorter")
+
+        blob = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        self._buffer.append((self.key(item), blob))
+        self._buffer_size += len(blob)
+        if self._buffer_size >= self.memory_limit:
+            self._spill()
+
+    def extend(self, items: Iterable):
+        for item in items:
+            self.add(item)
+
+    def _spill(self):
+        if not self._buffer:
+            return
+
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix="extsort_", dir=self.tmp_dir)
+
+        self._buffer.sort(key=itemgetter(0))
+        path = os.path.join(self._run_dir, "run_%06d" % len(self._run_paths))
+        with open(path, "wb") as run_file:
+            pickler = pickle.Pickler(run_file, protocol=pickle.HIGHEST_PROTOCOL)
+            for entry in self._buffer:
+                pickler.dump(entry)
+                # the pickler memoizes every dumped object, which would keep the whole run alive in memory
+                pickler.clear_memo()
+        self._run_paths.append(path)
+
+        self._buffer = []
+        self._buffer_size = 0
+
+    @classmethod
+    def _read_run(cls, path):
+        with open(path, "rb") as run_file:
+            unpickler = pickle.Unpickler(run_file)
+            while True:
+                try:
+                    yield unpickler.load()
+                except EOFError:
+                    return
+
+    def _sorted_entries(self):
+        if not self._run_paths:
+            # everything fits in memory, no need to touch the disk
+            self._buffer.sort(key=itemgetter(0))
+            return iter(self._buffer)
+
+        self._spill()
+        # `heapq.merge` favors earlier runs on equal keys, which keeps the sort stable
+        return heapq.merge(*[self._read_run(path) for path in self._run_paths], key=itemgetter(0))
+
+    def sorted(self):
+        """
+        Yield all the added items, sorted by key.
+        """
+        for _, blob in self._sorted_entries():
+            yield pickle.loads(blob)
+
+    def groupby(self):
+        """
+        Yield a tuple of (key, list-of-items) for each distinct key, in sorted order of the keys.
+        """
+        for key, entries in groupby(self._sorted_entries(), key=itemgetter(0)):
+            yield key, [pickle.loads(blob) for _, blob in entries]
+
+    def close(self):
+        self._closed = True
+        self._buffer = []
+        self._buffer_size = 0
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+        self._run_paths = []
+
+
+def external_sort(items: Iterable, key: Callable, memory_limit: int = DEFAULT_MEMORY_LIMIT, tmp_dir: str = None):
+    """
+    Generator version of `ExternalSorter.sorted()`. Temporary files are deleted once the generator is exhausted or closed.
+    """
+    with ExternalSorter(key=key, memory_limit=memory_limit, tmp_dir=tmp_dir) as sorter:
+        sorter.extend(items)
+        yield from sorter.sorted()
+
+
+def external_groupby(items: Iterable, key: Callable, memory_limit: int = DEFAULT_MEMORY_LIMIT, tmp_dir: str = None):
+    """
+    Generator version of `ExternalSorter.groupby()`. Temporary files are deleted once the generator is exhausted or closed.
+
+    Unlike `itertools.groupby()`, items with the same key don't have to be adjacent in the input.
+    """
+    with ExternalSorter(key=key, memory_limit=memory_limit, tmp_dir=tmp_dir) as sorter:
+        sorter.extend(items)
+        yield from sorter.groupby()
+
+
+def unique_sorted(items: Iterable, key: Callable = None, memory_limit: int = DEFAULT_MEMORY_LIMIT, tmp_dir: str = None):
+    """
+    Yield the distinct items in sorted order, a disk-backed replacement of `sorted(set(items))` for hashable items.
+    """
+    key = key or (lambda item: item)
+    for _, group in external_groupby(items, key=key, memory_limit=memory_limit, tmp_dir=tmp_dir):
+        yield group[0]
@@ -0,0 +1,174 @@
+"""
+Per-gene variant summaries: for each gene (by symbol), the number of variants annotated with it, their counts by
+ClinVar clinical significance and by snpEff putative impact, the number of snpEff loss-of-function calls, the
+maximum of a few scores, and the genomic extent of the variants per assembly. E.g.
+
+    {
+        "_id": "BRCA2",
+        "symbol": "BRCA2",
+        "entrezgene": [675],
+        "chrom": "13",
+        "variant_count": 31250,
+        "clinvar": {"variant_count": 12345, "clinical_significance": {"pathogenic": 3012, "benign": 840, ...}},
+        "snpeff": {"putative_impact": {"high": 1520, "moderate": 9870, ...}, "lof_count": 1498},
+        "max_score": {"cadd_phred": 52.0, "revel": 0.989},
+        "hg19": {"start": 32889611, "end": 32973805},
+        "hg38": {"start": 32315474, "end": 32400266},
+    }
+
+Summaries are computed from the merged documents after the merge (see MyVariantDataBuilder.post_merge_scan()),
+and indexed next to the variant index (see BaseVariantIndexer.index_gene_summary()), so the questions about a gene
+are answered by a single document lookup instead of aggregations over the variant index.
+"""
+
+import math
+from collections import Counter
+
+from utils.genomickey import ASSEMBLIES
+
+GENE_SUMMARY_SUFFIX = "_gene_summary"
+
+# root keys of the merged documents a summary is computed from
+GENE_SUMMARY_SOURCES = ("clinvar", "snpeff", "cadd", "dbnsfp") + ASSEMBLIES
+GENE_SUMMARY_PROJECTION = {
+    "chrom": 1,
+    "clinvar.gene": 1, "clinvar.rcv.clinical_significance": 1,
+    "snpeff.ann.genename": 1, "snpeff.ann.putative_impact": 1, "snpeff.ann.effect": 1, "snpeff.lof.genename": 1,
+    "cadd.phred": 1,
+    "dbnsfp.genename": 1, "dbnsfp.revel.score": 1,
+    "hg19": 1, "hg38": 1,
+}
+# name in the summary: dotfield in the variant documents
+SCORE_FIELDS = {
+    "cadd_phred": "cadd.phred",
+    "revel": "dbnsfp.revel.score",
+}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _values(doc, dotfield: str):
+    """
+    All the values found under `dotfield` in `doc`, through lists.
+    """
+    values = [doc]
+    for key in dotfield.split("."):
+        values = [value.get(key) for item in values for value in _as_list(item) if isinstance(value, dict)]
+    return [value for item in values for value in _as_list(item) if value is not None]
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def variant_genes(doc: dict):
+    """
+    The symbols of the genes a variant is annotated with (by snpEff, ClinVar or dbNSFP), and the Entrez ids known
+    for them, as {symbol: set of Entrez ids}.
+    """
+    genes = {}
+    for ann in _values(doc, "snpeff.ann"):
+        # an intergenic region is named after its neighbour genes
+        if isinstance(ann, dict) and ann.get("genename") and ann.get("effect") != "intergenic_region":
+            genes.setdefault(str(ann["genename"]), set())
+    for gene in _values(doc, "clinvar.gene"):
+        if isinstance(gene, dict) and gene.get("symbol"):
+            genes.setdefault(str(gene["symbol"]), set()).update(_values(gene, "id"))
+    for symbol in _values(doc, "dbnsfp.genename"):
+        genes.setdefault(str(symbol), set())
+    return genes
+
+
+class GeneSummaryAccumulator:
+    """
+    Accumulate the summaries of the genes of variant documents, see module docstring.
+    """
+    def __init__(self):
+        self.genes = {}
+
+    def _summary(self, symbol: str):
+        if symbol not in self.genes:
+            self.genes[symbol] = {
+                "entrezgene": set(),
+                "chrom": Counter(),
+                "variant_count": 0,
+                "clinvar_count": 0,
+                "clinical_significance": Counter(),
+                "putative_impact": Counter(),
+                "lof_count": 0,
+                "max_score": {},
+                "extent": {},
+            }
+        return self.genes[symbol]
+
+    def add(self, doc: dict):
+        genes = variant_genes(doc)
+        if not genes:
+            return
+        significances = {str(value).lower() for value in _values(doc, "clinvar.rcv.clinical_significance")}
+        scores = {}
+        for name, dotfield in SCORE_FIELDS.items():
+            numbers = [number for number in map(_number, _values(doc, dotfield)) if number is not None]
+            if numbers:
+                scores[name] = max(numbers)
+        positions = {assembly: [pos for pos in _values(doc, assembly) if isinstance(pos, dict)]
+                     for assembly in ASSEMBLIES}
+        lof_genes = {str(name) for name in _values(doc, "snpeff.lof.genename")}
+        chroms = _values(doc, "chrom")
+
+        for symbol, entrez_ids in genes.items():
+            summary = self._summary(symbol)
+            summary["entrezgene"].update(entrez_ids)
+            summary["chrom"].update(str(chrom) for chrom in chroms[:1])
+            summary["variant_count"] += 1
+            if significances:
+                summary["clinvar_count"] += 1
+                summary["clinical_significance"].update(significances)
+            impacts = {str(ann["putative_impact"]).lower() for ann in _values(doc, "snpeff.ann")
+                       if isinstance(ann, dict) and ann.get("genename") == symbol and ann.get("putative_impact")}
+            summary["putative_impact"].update(impacts)
+            if symbol in lof_genes:
+                summary["lof_count"] += 1
+            for name, score in scores.items():
+                summary["max_score"][name] = max(score, summary["max_score"].get(name, score))
+            for assembly, assembly_positions in positions.items():
+                for pos in assembly_positions:
+                    start, end = _number(pos.get("start")), _number(pos.get("end", pos.get("start")))
+                    if start is None or end is None:
+                        continue
+                    extent = summary["extent"].setdefault(assembly, {"start": start, "end": end})
+                    extent["start"], extent["end"] = min(extent["start"], start), max(extent["end"], end)
+
+    def summaries(self):
+        """
+        The gene summary documents, by gene symbol.
+        """
+        for symbol, summary in sorted(self.genes.items()):
+            doc = {
+                "_id": symbol,
+                "symbol": symbol,
+                "entrezgene": sorted(summary["entrezgene"]),
+                "variant_count": summary["variant_count"],
+                "clinvar": {
+                    "variant_count": summary["clinvar_count"],
+                    "clinical_significance": dict(summary["clinical_significance"]),
+                },
+                "snpeff": {
+                    "putative_impact": dict(summary["putative_impact"]),
+                    "lof_count": summary["lof_count"],
+                },
+                "max_score": summary["max_score"],
+            }
+            if summary["chrom"]:
+                doc["chrom"] = summary["chrom"].most_common(1)[0][0]
+            for assembly, extent in summary["extent"].items():
+                doc[assembly] = {"start": int(extent["start"]), "end": int(extent["end"])}
+            yield doc
@@ -0,0 +1,49 @@
+"""
+Genomic keys: a single sortable number per assembly for the position of a variant, its chromosome ordinal (1..22,
+X=23, Y=24, MT=25) times 10^10 plus its start, stored as `genomic_key.<assembly>` in merged documents (set while
+merging by hub.databuild.mapper.SetChrom), so it's part of diffs and incremental syncs like any other field. Indices
+can be sorted by the key of their assembly (the "index_sort" option of the indexer, see config_hub), so range
+queries on it read contiguous, position-ordered documents.
+"""
+
+from utils.routing import chrom_routing
+from utils.sortedruns import CHROM_PARTITIONS
+
+GENOMIC_KEY_FIELD = "genomic_key"
+ASSEMBLIES = ("hg19", "hg38")
+CHROM_ORDINALS = {chrom: ordinal for ordinal, chrom in enumerate(CHROM_PARTITIONS, 1)}
+CHROM_SPAN = 10 ** 10
+
+
+def genomic_key(chrom, position: int):
+    """
+    The genomic key of `position` on `chrom`, None if `chrom` isn't a chromosome.
+    """
+    ordinal = CHROM_ORDINALS.get(chrom_routing(chrom))
+    if ordinal is None:
+        return None
+    return ordinal * CHROM_SPAN + int(position)
+
+
+def add_genomic_keys(doc: dict):
+    """
+    Set the genomic key of each assembly position (`hg19.start`, `hg38.start`) of `doc`, from its `chrom` field.
+    """
+    chrom = doc.get("chrom")
+    if isinstance(chrom, list):
+        chrom = chrom[0] if chrom else None
+    if not chrom:
+        return doc
+    keys = {}
+    for assembly in ASSEMBLIES:
+        positions = doc.get(assembly)
+        if isinstance(positions, dict):
+            positions = [positions]
+        starts = [pos["start"] for pos in positions or [] if isinstance(pos, dict) and pos.get("start") is not None]
+        if starts:
+            key = genomic_key(chrom, min(starts))
+            if key is not None:
+                keys[assembly] = key
+    if keys:
+        doc[GENOMIC_KEY_FIELD] = keys
+    return doc
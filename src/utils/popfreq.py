@@ -0,0 +1,123 @@
+"""
+Population allele frequency summary: the maximum allele frequency of a variant across the population frequency
+sources, and its maximum frequency among continental populations ("popmax", computed like gnomAD does, i.e.
+leaving out bottlenecked or mixed populations), each with the source providing it. Stored at the root of merged
+documents, so "rare variants" queries need a single range filter instead of one clause per source field:
+
+    "popfreq": {
+        "max_af": 0.0123,
+        "max_af_source": "gnomad_genome",
+        "popmax_af": 0.0310,
+        "popmax_af_source": "gnomad_exome",
+        "popmax_population": "afr",
+    }
+
+The summary is computed from merged documents (see MyVariantDataBuilder.post_merge_scan()), so it's part of the
+build, its diffs and incremental syncs like any other field.
+"""
+
+import math
+
+POPFREQ_FIELD = "popfreq"
+
+POPULATIONS = {"afr", "ami", "amr", "asj", "eas", "fin", "mid", "nfe", "oth", "sas"}
+POPMAX_POPULATIONS = {"afr", "amr", "eas", "nfe", "sas"}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _frequency(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and 0 <= value <= 1 else None
+
+
+def gnomad_frequencies(subdoc: dict):
+    """
+    The overall allele frequency of a gnomAD sub-document, and its frequency per population, from "af.af_<pop>".
+    """
+    af = subdoc.get("af")
+    if not isinstance(af, dict):
+        return None, {}
+    populations = {key[3:]: _frequency(value) for key, value in af.items()
+                   if key.startswith("af_") and key[3:] in POPULATIONS}
+    return _frequency(af.get("af")), populations
+
+
+def exac_frequencies(subdoc: dict):
+    """
+    The overall allele frequency of an ExAC sub-document, and its frequency per population, as "ac.ac_<pop>" /
+    "an.an_<pop>".
+    """
+    ac = subdoc.get("ac") if isinstance(subdoc.get("ac"), dict) else {}
+    an = subdoc.get("an") if isinstance(subdoc.get("an"), dict) else {}
+    populations = {}
+    for population in POPULATIONS:
+        allele_count, allele_number = ac.get("ac_" + population), an.get("an_" + population)
+        if isinstance(allele_count, (int, float)) and isinstance(allele_number, (int, float)) and allele_number > 0:
+            populations[population] = _frequency(allele_count / allele_number)
+    return _frequency(subdoc.get("af")), populations
+
+
+def dbsnp_frequencies(subdoc: dict):
+    """
+    The maximum frequency of the alternate allele across the studies of a dbSNP sub-document ("alleles.freq.*").
+    Studies aren't populations, so there's no popmax.
+    """
+    freqs = [_frequency(value) for allele in _as_list(subdoc.get("alleles"))
+             if isinstance(allele, dict) and allele.get("allele") == subdoc.get("alt")
+             for value in (allele.get("freq") or {}).values()]
+    freqs = [freq for freq in freqs if freq is not None]
+    return (max(freqs) if freqs else None), {}
+
+
+POPFREQ_SOURCES = {
+    "gnomad_exome": gnomad_frequencies,
+    "gnomad_genome": gnomad_frequencies,
+    "exac": exac_frequencies,
+    "exac_nontcga": exac_frequencies,
+    "dbsnp": dbsnp_frequencies,
+}
+
+# the fields needed to compute the summary, as a MongoDB projection
+POPFREQ_PROJECTION = {
+    POPFREQ_FIELD: 1,
+    "gnomad_exome.af": 1,
+    "gnomad_genome.af": 1,
+    "exac.af": 1, "exac.ac": 1, "exac.an": 1,
+    "exac_nontcga.af": 1, "exac_nontcga.ac": 1, "exac_nontcga.an": 1,
+    "dbsnp.alt": 1, "dbsnp.alleles": 1,
+}
+
+
+def popfreq_summary(doc: dict):
+    """
+    The population allele frequency summary of a merged document (see module docstring), None if it has no frequency.
+    """
+    max_af = popmax = None
+    for source, frequencies in POPFREQ_SOURCES.items():
+        for subdoc in _as_list(doc.get(source)):
+            if not isinstance(subdoc, dict):
+                continue
+            overall, populations = frequencies(subdoc)
+            # a source without overall frequency is still as frequent as its most frequent population
+            candidates = [overall] + list(populations.values())
+            candidates = [freq for freq in candidates if freq is not None]
+            if candidates and (max_af is None or max(candidates) > max_af[0]):
+                max_af = (max(candidates), source)
+            for population, freq in populations.items():
+                if population in POPMAX_POPULATIONS and freq is not None and (popmax is None or freq > popmax[0]):
+                    popmax = (freq, source, population)
+
+    if max_af is None:
+        return None
+    summary = {"max_af": max_af[0], "max_af_source": max_af[1]}
+    if popmax is not None:
+        summary.update(popmax_af=popmax[0], popmax_af_source=popmax[1], popmax_population=popmax[2])
+    return summary
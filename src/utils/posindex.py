@@ -0,0 +1,273 @@
+"""
+A compact, memory-mapped set of the variants known to a group of sources, keyed by contig and position, to decide
+whether a row of a huge positional file (e.g. CADD's ~8.6 billion rows) is worth parsing at all, from its raw
+position/ref/alt fields and before any HGVS id is built.
+
+Each variant is encoded as an unsigned 64-bit key: `pos << 5 | code`, where `code` is:
+
+    - 1 + 4 * ref + alt for single nucleotide variants (bases A, C, G, T being 0..3), so that SNVs match exactly
+    - 0 for any other variant, at the VCF position of the variant and at its HGVS start position, so that indels
+      are found by position (HGVS and VCF positions differ by the anchor base)
+
+Indels found by position then match exactly on their HGVS id, of which the index holds a 64-bit hash (see
+`hgvs_hash()`), so that an unknown indel sharing the position of a known variant is not loaded.
+
+An index is a folder of one "<contig>.bin" file per contig, holding its sorted distinct keys, one "<contig>.hgvs" file
+per contig, holding the sorted distinct hashes of its indels' HGVS ids, plus a "meta.json" file.
+"""
+
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable
+
+from utils.extsort import ExternalSorter, DEFAULT_MEMORY_LIMIT
+from utils.hgvs import DocEncoder, get_hgvs_from_vcf
+from utils.rsid import UINT64
+
+META_FILENAME = "meta.json"
+BIN_SUFFIX = ".bin"
+HGVS_SUFFIX = ".hgvs"
+# length above which source storages encode the ids (MAX_ID_LENGTH in config_hub)
+MAX_ID_LENGTH = 512
+# version of the index layout, an index of another version is rebuilt by `get_sources_position_index()`
+INDEX_FORMAT = 2
+
+BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+POS_SHIFT = 5
+
+SNV_PATTERN = re.compile(r"^chr(\w+):g\.(\d+)([ACGT])>([ACGT])$")
+POS_PATTERN = re.compile(r"^chr(\w+):g\.(\d+)")
+
+
+def snv_key(pos: int, ref: str, alt: str):
+    return pos << POS_SHIFT | (1 + 4 * BASE_CODES[ref] + BASE_CODES[alt])
+
+
+def position_key(pos: int):
+    return pos << POS_SHIFT
+
+
+def hgvs_hash(hgvs_id: str):
+    return UINT64.unpack(hashlib.blake2b(hgvs_id.encode(), digest_size=UINT64.size).digest())[0]
+
+
+def parse_hgvs_keys(hgvs_id: str):
+    """
+    Return the (contig, key) pairs of a genomic HGVS id, e.g.
+
+        "chr1:g.100A>T"      => [("1", snv_key(100, "A", "T"))]
+        "chr1:g.101_103del"  => [("1", position_key(100)), ("1", position_key(101))]
+
+    or an empty list if the id cannot be parsed (see `hgvs_hash()` for the exact match of indels).
+    """
+    match = SNV_PATTERN.match(hgvs_id)
+    if match:
+        chrom, pos, ref, alt = match.groups()
+        if ref != alt:
+            return [(chrom, snv_key(int(pos), ref, alt))]
+    match = POS_PATTERN.match(hgvs_id)
+    if not match:
+        return []
+    chrom, pos = match.group(1), int(match.group(2))
+    return [(chrom, position_key(pos - 1)), (chrom, position_key(pos))]
+
+
+def build_position_index(hgvs_ids: Iterable, index_dir: str, meta: dict = None, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """
+    Build an index in `index_dir` from an iterable of HGVS ids, in any order (ids which can't be parsed are ignored).
+    The index is written to a temporary folder first and then moved to `index_dir`, so readers never see a partial
+    index. Return the number of distinct keys.
+    """
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".position_index_", dir=parent)
+
+    count = 0
+    contigs = []
+    # (contig, file suffix, key or hash), so each contig's keys and then hashes come out sorted
+    with ExternalSorter(key=lambda entry: entry, memory_limit=memory_limit, tmp_dir=parent) as sorter:
+        for hgvs_id in hgvs_ids:
+            keys = parse_hgvs_keys(hgvs_id)
+            sorter.extend((chrom, BIN_SUFFIX, key) for chrom, key in keys)
+            if len(keys) > 1:
+                # not an SNV
+                sorter.extend([(keys[0][0], HGVS_SUFFIX, hgvs_hash(hgvs_id))])
+
+        for (chrom, suffix), group in groupby(sorter.sorted(), key=itemgetter(0, 1)):
+            previous = None
+            with open(os.path.join(tmp_dir, chrom + suffix), "wb") as out_f:
+                for _, _, key in group:
+                    if key != previous:
+                        out_f.write(UINT64.pack(key))
+                        previous = key
+                        count += suffix == BIN_SUFFIX
+            if suffix == BIN_SUFFIX:
+                contigs.append(chrom)
+
+    with open(os.path.join(tmp_dir, META_FILENAME), "w") as meta_f:
+        json.dump(dict(meta or {}, count=count, contigs=contigs, format=INDEX_FORMAT), meta_f)
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.rename(tmp_dir, index_dir)
+    return count
+
+
+class PositionIndex:
+    """
+    Read-only access to an index built by `build_position_index()`. Contig files are memory-mapped on first access,
+    so opening an index is cheap and pages are shared between processes reading the same index.
+    """
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILENAME)) as meta_f:
+            self.meta = json.load(meta_f)
+        self._keys = {}
+        self._files = []
+        self._mmaps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for keys in self._keys.values():
+            if isinstance(keys, memoryview):
+                keys.release()
+        self._keys = {}
+        for mm in self._mmaps:
+            mm.close()
+        for in_f in self._files:
+            in_f.close()
+        self._mmaps, self._files = [], []
+
+    def _load(self, chrom: str, suffix: str):
+        if (chrom, suffix) not in self._keys:
+            path = os.path.join(self.index_dir, chrom + suffix)
+            if chrom not in self.meta["contigs"] or not os.path.exists(path) or os.path.getsize(path) == 0:
+                self._keys[chrom, suffix] = []
+            else:
+                in_f = open(path, "rb")
+                mm = mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._files.append(in_f)
+                self._mmaps.append(mm)
+                self._keys[chrom, suffix] = memoryview(mm).cast("Q")
+        return self._keys[chrom, suffix]
+
+    def keys(self, chrom: str):
+        """
+        Sorted keys of contig `chrom` (empty if the contig is unknown).
+        """
+        return self._load(chrom, BIN_SUFFIX)
+
+    def hashes(self, chrom: str):
+        """
+        Sorted hashes of the HGVS ids of the indels of contig `chrom` (empty if the contig is unknown).
+        """
+        return self._load(chrom, HGVS_SUFFIX)
+
+    def __contains__(self, hgvs_id: str):
+        keys = parse_hgvs_keys(hgvs_id)
+        if len(keys) == 1:
+            return self.contains_key(*keys[0])
+        return bool(keys) and _contains(self.hashes(keys[0][0]), hgvs_hash(hgvs_id))
+
+    def contains_key(self, chrom: str, key: int):
+        return _contains(self.keys(chrom), key)
+
+    def has_positions(self, chrom: str, start: int, end: int = None):
+        """
+        Whether any variant of contig `chrom` is keyed between positions `start` (excluded) and `end` (included).
+        """
+        keys = self.keys(chrom)
+        lo = bisect.bisect_left(keys, position_key(start + 1))
+        if end is None:
+            return lo < len(keys)
+        return lo < bisect.bisect_left(keys, position_key(end + 1), lo)
+
+    def matcher(self, chrom: str, max_id_length=MAX_ID_LENGTH):
+        return ContigMatcher(chrom, self.keys(chrom), self.hashes(chrom), max_id_length)
+
+
+def _contains(keys, key):
+    pos = bisect.bisect_left(keys, key)
+    return pos < len(keys) and keys[pos] == key
+
+
+class ContigMatcher:
+    """
+    Membership test of VCF-style (pos, ref, alt) variants on one contig, for variants coming by increasing positions
+    (e.g. from a tabix fetch): each binary search starts from where the previous one ended. Indels found by position
+    are then turned into HGVS ids, matched exactly against the hashes of the contig. Ids longer than `max_id_length`
+    are encoded as source storages do (see utils.hgvs.DocEncoder), so they match the ids of the source collections.
+    """
+    def __init__(self, chrom, keys, hashes, max_id_length=MAX_ID_LENGTH):
+        self.chrom = chrom
+        self.keys = keys
+        self.hashes = hashes
+        self.max_id_length = max_id_length
+        self.lo = 0
+
+    def _contains(self, key):
+        keys = self.keys
+        lo = bisect.bisect_left(keys, key, self.lo)
+        # keep the hint at or before the start of the current position, shared by its SNVs and indels
+        self.lo = bisect.bisect_left(keys, key >> POS_SHIFT << POS_SHIFT, self.lo, lo)
+        return lo < len(keys) and keys[lo] == key
+
+    def __call__(self, pos: int, ref: str, alt: str):
+        if len(ref) == len(alt) == 1 and ref in BASE_CODES and alt in BASE_CODES:
+            return self._contains(snv_key(pos, ref, alt))
+        if not self._contains(position_key(pos)):
+            return False
+        try:
+            hgvs_id = get_hgvs_from_vcf(self.chrom, pos, ref, alt)
+        except ValueError:
+            return False
+        if len(hgvs_id) > self.max_id_length:
+            _, doc = DocEncoder.encode_long_hgvs_id({"_id": hgvs_id}, max_len=self.max_id_length)
+            hgvs_id = doc["_id"]
+        return _contains(self.hashes, hgvs_hash(hgvs_id))
+
+
+def get_sources_position_index(col_names: list, index_dir: str, memory_limit=DEFAULT_MEMORY_LIMIT, logger=None):
+    """
+    Open the position index of the variants from the `col_names` source collections, (re)building it first if it
+    doesn't exist or if any of the collections changed since (based on their document counts).
+    """
+    import biothings.utils.mongo as mongo
+
+    src_db = mongo.get_src_db()
+    missing = [col_name for col_name in col_names if col_name not in src_db.list_collection_names()]
+    if missing:
+        raise ValueError("Collections %s are missing, run their uploaders first" % missing)
+    version = {col_name: src_db[col_name].estimated_document_count() for col_name in col_names}
+
+    meta_path = os.path.join(index_dir, META_FILENAME)
+    if os.path.exists(meta_path):
+        with open(meta_path) as meta_f:
+            meta = json.load(meta_f)
+            if meta.get("version") == version and meta.get("format") == INDEX_FORMAT:
+                return PositionIndex(index_dir)
+
+    def iter_ids():
+        for col_name in col_names:
+            if logger:
+                logger.info("Indexing positions of collection '%s'" % col_name)
+            for ids in mongo.id_feeder(src_db[col_name], batch_size=100000):
+                yield from ids
+
+    count = build_position_index(iter_ids(), index_dir, meta={"version": version}, memory_limit=memory_limit)
+    if logger:
+        logger.info("Position index built in '%s', %d distinct keys" % (index_dir, count))
+    return PositionIndex(index_dir)
@@ -0,0 +1,25 @@
+"""
+Chromosome routing: variant documents are indexed with their chromosome as `_routing` value, so all the variants of
+a chromosome are stored in the same shard (or in the same `routing_partition_size` shards) and the queries bound to a
+chromosome (interval/position queries and `_id` lookups) only hit those shards instead of all of them.
+
+The routing value is computed from the `chrN:` prefix of the `_id` ("other" for any other `_id`), so it can be
+computed again from the `_id` alone at query time. Documents whose `_id` has no chromosome prefix are only found by
+unrouted queries.
+"""
+
+from utils.sortedruns import CHROM_PARTITIONS, OTHER_PARTITION, partition_of
+
+
+def id_routing(_id: str):
+    return partition_of(_id)
+
+
+def chrom_routing(chrom: str):
+    """
+    The routing value of the variants of `chrom` (e.g. "1", "x", "chrMT").
+    """
+    chrom = str(chrom).upper()
+    if chrom.startswith("CHR"):
+        chrom = chrom[3:]
+    return chrom if chrom in CHROM_PARTITIONS else OTHER_PARTITION
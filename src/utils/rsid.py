@@ -0,0 +1,227 @@
+"""
+A compact, memory-mapped index of dbSNP rsid => HGVS `_id`s, built once per assembly from the dbSNP collection, to
+replace per-document `dbsnp_col.find({"dbsnp.rsid": rsid})` queries (see `utils.hgvs.get_hgvs_from_rsid()`).
+
+An index is a folder of 3 files:
+
+    - "rsnums.bin":  sorted, distinct rs numbers (unsigned 64-bit integers)
+    - "offsets.bin": for the i-th rs number, its `_id`s are stored in "ids.bin" between offsets[i] and offsets[i+1]
+                     (unsigned 64-bit integers, one more than the number of rs numbers)
+    - "ids.bin":     the `_id`s of all rs numbers, utf-8 encoded, newline separated, in the order of "rsnums.bin"
+
+plus a "meta.json" file recording the version of the dbSNP data it was built from.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from typing import Iterable
+
+from utils.extsort import ExternalSorter, DEFAULT_MEMORY_LIMIT
+
+RSNUMS_FILENAME = "rsnums.bin"
+OFFSETS_FILENAME = "offsets.bin"
+IDS_FILENAME = "ids.bin"
+META_FILENAME = "meta.json"
+
+# native byte order, as read back by `memoryview.cast("Q")`
+UINT64 = struct.Struct("=Q")
+
+
+def parse_rsnum(rsid):
+    """
+    "rs12345" => 12345. Return None if `rsid` is not a valid rsid.
+    """
+    if not isinstance(rsid, str) or not rsid.startswith("rs") or not rsid[2:].isdigit():
+        return None
+    return int(rsid[2:])
+
+
+def build_rsid_index(pairs: Iterable, index_dir: str, meta: dict = None, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """
+    Build an index in `index_dir` from an iterable of (rsid, _id) pairs, in any order.
+    Pairs with an invalid rsid are ignored. The index is written to a temporary folder first and then moved to
+    `index_dir`, so readers never see a partial index.
+    """
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".rsid_index_", dir=parent)
+
+    count = 0
+    with ExternalSorter(key=lambda pair: pair[0], memory_limit=memory_limit, tmp_dir=parent) as sorter:
+        for rsid, _id in pairs:
+            rsnum = parse_rsnum(rsid)
+            if rsnum is not None:
+                sorter.add((rsnum, _id))
+
+        with open(os.path.join(tmp_dir, RSNUMS_FILENAME), "wb") as rsnums_f, \
+                open(os.path.join(tmp_dir, OFFSETS_FILENAME), "wb") as offsets_f, \
+                open(os.path.join(tmp_dir, IDS_FILENAME), "wb") as ids_f:
+            offset = 0
+            for rsnum, group in sorter.groupby():
+                # dedupe while keeping the order
+                ids = list(dict.fromkeys(_id for _, _id in group))
+                blob = "\n".join(ids).encode("utf-8")
+                rsnums_f.write(UINT64.pack(rsnum))
+                offsets_f.write(UINT64.pack(offset))
+                ids_f.write(blob)
+                offset += len(blob)
+                count += 1
+            offsets_f.write(UINT64.pack(offset))
+
+    with open(os.path.join(tmp_dir, META_FILENAME), "w") as meta_f:
+        json.dump(dict(meta or {}, count=count), meta_f)
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.rename(tmp_dir, index_dir)
+    return count
+
+
+class RsidIndex:
+    """
+    Read-only access to an index built by `build_rsid_index()`. Files are memory-mapped, so opening an index is cheap
+    and pages are shared between processes reading the same index.
+    """
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILENAME)) as meta_f:
+            self.meta = json.load(meta_f)
+
+        self._files = []
+        self._mmaps = []
+        self.rsnums = self._map_array(RSNUMS_FILENAME)
+        self.offsets = self._map_array(OFFSETS_FILENAME)
+        self.ids = self._map_bytes(IDS_FILENAME)
+
+    def _map_bytes(self, filename):
+        path = os.path.join(self.index_dir, filename)
+        if os.path.getsize(path) == 0:
+            # empty files cannot be memory-mapped
+            return b""
+        in_f = open(path, "rb")
+        mm = mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append(in_f)
+        self._mmaps.append(mm)
+        return mm
+
+    def _map_array(self, filename):
+        data = self._map_bytes(filename)
+        if not data:
+            return []
+        return memoryview(data).cast("Q")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.rsnums)
+
+    def close(self):
+        for view in (self.rsnums, self.offsets):
+            if isinstance(view, memoryview):
+                view.release()
+        self.rsnums = self.offsets = []
+        for mm in self._mmaps:
+            mm.close()
+        for in_f in self._files:
+            in_f.close()
+        self._mmaps, self._files = [], []
+
+    def _ids_at(self, pos):
+        start, end = self.offsets[pos], self.offsets[pos + 1]
+        return self.ids[start:end].decode("utf-8").split("\n")
+
+    def _find(self, rsnum, lo=0):
+        pos = bisect.bisect_left(self.rsnums, rsnum, lo)
+        return pos, (pos < len(self.rsnums) and self.rsnums[pos] == rsnum)
+
+    def get(self, rsid):
+        """
+        Return the list of `_id`s for `rsid` (empty if not found).
+        """
+        rsnum = parse_rsnum(rsid)
+        if rsnum is None:
+            return []
+        pos, found = self._find(rsnum)
+        return self._ids_at(pos) if found else []
+
+    def get_many(self, rsids: Iterable):
+        """
+        Batch lookup, return a dict of {rsid: [_ids]} for the found rsids only.
+        Queries are sorted, so that each binary search starts from where the previous one ended.
+        """
+        queries = sorted({(parse_rsnum(rsid), rsid) for rsid in rsids if parse_rsnum(rsid) is not None})
+        result = {}
+        lo = 0
+        for rsnum, rsid in queries:
+            lo, found = self._find(rsnum, lo)
+            if found:
+                result[rsid] = self._ids_at(lo)
+        return result
+
+
+def _iter_dbsnp_pairs(dbsnp_col):
+    for doc in dbsnp_col.find({}, {"_id": 1, "dbsnp.rsid": 1}, no_cursor_timeout=True):
+        dbsnp = doc.get("dbsnp", {})
+        for _dbsnp in (dbsnp if isinstance(dbsnp, list) else [dbsnp]):
+            yield _dbsnp.get("rsid"), doc["_id"]
+
+
+def get_dbsnp_rsid_index(dbsnp_col, index_dir: str, version=None, memory_limit=DEFAULT_MEMORY_LIMIT, logger=None):
+    """
+    Open the rsid index of a dbSNP collection, (re)building it from the collection first if it doesn't exist or if it
+    was built from another `version` of the collection (if `version` is None, the document count is used).
+    """
+    version = version or dbsnp_col.estimated_document_count()
+    meta_path = os.path.join(index_dir, META_FILENAME)
+    if os.path.exists(meta_path):
+        with open(meta_path) as meta_f:
+            meta = json.load(meta_f)
+        if meta.get("collection") == dbsnp_col.name and meta.get("version") == version:
+            return RsidIndex(index_dir)
+
+    if logger:
+        logger.info("Building rsid index of collection '%s' (version %s) in '%s'" % (dbsnp_col.name, version, index_dir))
+    count = build_rsid_index(_iter_dbsnp_pairs(dbsnp_col), index_dir, meta={"collection": dbsnp_col.name, "version": version},
+                             memory_limit=memory_limit)
+    if logger:
+        logger.info("rsid index built, %d distinct rsids" % count)
+    return RsidIndex(index_dir)
+
+
+def get_rsid_index_folder():
+    """
+    Root folder of the rsid indices, one sub-folder per assembly (see config.RSID_INDEX_FOLDER).
+    """
+    from biothings import config as btconfig
+
+    folder = getattr(btconfig, "RSID_INDEX_FOLDER", None)
+    return folder or os.path.join(btconfig.DATA_ARCHIVE_ROOT, "rsid_index")
+
+
+def get_assembly_rsid_index(assembly: str, index_root: str = None, logger=None):
+    """
+    Open the rsid index of the "dbsnp_<assembly>" source collection, stored as "<index_root>/<assembly>"
+    (`get_rsid_index_folder()` by default). The index is rebuilt whenever a new dbSNP release is uploaded.
+    The index is memory-mapped, close it (or use it as a context manager) once done.
+    """
+    import biothings.utils.mongo as mongo
+
+    col_name = "dbsnp_%s" % assembly
+    src_db = mongo.get_src_db()
+    if col_name not in src_db.list_collection_names():
+        raise ValueError("'%s' collection is missing, run dbsnp uploader first" % col_name)
+
+    src_doc = mongo.get_src_dump().find_one({"_id": "dbsnp"}) or {}
+    version = src_doc.get("upload", {}).get("jobs", {}).get(col_name, {}).get("release")
+
+    index_dir = os.path.join(index_root or get_rsid_index_folder(), assembly)
+    return get_dbsnp_rsid_index(src_db[col_name], index_dir, version=version, logger=logger)
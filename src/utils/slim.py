@@ -0,0 +1,126 @@
+"""
+Slim indices: next to each variant index, an index of the same documents restricted to an allowlist of the most
+requested fields, much smaller so it stays in the page/query caches. A query is sent to the slim index when all the
+fields it returns, queries, sorts or aggregates on are in the allowlist (see `slim_compatible()`), otherwise to the
+full index. The hub builds "<index>_slim" after indexing (see BaseVariantIndexer.build_slim_index()), applies the
+incremental syncs of the index to it (see MyVariantBaseSyncer.sync_slim_index()), and MVQueryBackend routes queries
+to the slim index of the index an alias points to when enabled.
+
+Both sides must use the same allowlist.
+"""
+
+SLIM_SUFFIX = "_slim"
+# key of the fields of a slim index in its mapping "_meta"
+SLIM_FIELDS_META = "slim_fields"
+
+# fields always kept, needed by position queries
+SLIM_BASE_FIELDS = ["chrom", "vcf", "hg19", "hg38", "observed", "genomic_key", "popfreq"]
+DEFAULT_SLIM_FIELDS = SLIM_BASE_FIELDS + [
+    "dbsnp.rsid",
+    "clinvar.rcv.clinical_significance",
+    "cadd.phred",
+    "gnomad_exome.af",
+    "gnomad_genome.af",
+    "snpeff.ann.effect",
+]
+
+# query clauses of {<field>: <params>}
+_FIELD_CLAUSES = {"match", "match_phrase", "match_phrase_prefix", "term", "terms", "range", "prefix", "wildcard",
+                  "regexp", "fuzzy"}
+# query clauses without fields
+_NO_FIELD_CLAUSES = {"ids", "match_all", "match_none"}
+# compound query clauses, with sub-queries
+_COMPOUND_CLAUSES = {"bool", "constant_score", "function_score", "dis_max", "boosting"}
+_SUB_QUERY_KEYS = {"must", "filter", "should", "must_not", "query", "queries", "positive", "negative"}
+# metadata fields, always available
+_META_FIELDS = {"_id", "_score", "_doc", "_index"}
+
+
+class UnknownFields(Exception):
+    """
+    The fields used by a query can't be told (e.g. a query string query, or a script).
+    """
+
+
+def covered(field: str, allowlist):
+    """
+    Whether `field` (a field or an object) only holds allowlisted fields.
+    """
+    if field in _META_FIELDS:
+        return True
+    if "*" in field:
+        return False
+    return any(field == allowed or field.startswith(allowed + ".") for allowed in allowlist)
+
+
+def _query_fields(query, fields: set):
+    if isinstance(query, list):
+        for sub_query in query:
+            _query_fields(sub_query, fields)
+        return
+    if not isinstance(query, dict):
+        raise UnknownFields(query)
+    for clause, params in query.items():
+        if clause in _FIELD_CLAUSES:
+            fields.update(key for key in params if key not in ("boost", "_name"))
+        elif clause == "exists":
+            fields.add(params["field"])
+        elif clause == "multi_match":
+            fields.update(field.split("^")[0] for field in params["fields"])
+        elif clause in _NO_FIELD_CLAUSES:
+            continue
+        elif clause in _COMPOUND_CLAUSES:
+            for key, sub_query in params.items():
+                if key in _SUB_QUERY_KEYS:
+                    _query_fields(sub_query, fields)
+        else:
+            raise UnknownFields(clause)
+
+
+def _aggs_fields(aggs: dict, fields: set):
+    for agg in aggs.values():
+        for agg_type, params in agg.items():
+            if agg_type in ("aggs", "aggregations"):
+                _aggs_fields(params, fields)
+            elif agg_type == "filter":
+                _query_fields(params, fields)
+            elif isinstance(params, dict) and "field" in params and "script" not in params:
+                fields.add(params["field"])
+            else:
+                raise UnknownFields(agg_type)
+
+
+def body_fields(body: dict):
+    """
+    The fields a search request body returns, queries, sorts or aggregates on, None if they can't be told.
+    """
+    fields = set()
+    try:
+        source = body.get("_source")
+        if isinstance(source, dict):
+            source = source.get("includes")
+        if source is False:
+            source = []
+        if not isinstance(source, list) or not source:
+            # all fields
+            return None
+        fields.update(source)
+        _query_fields(body.get("query", {"match_all": {}}), fields)
+        for sort in body.get("sort", []):
+            fields.add(sort.lstrip("-") if isinstance(sort, str) else next(iter(sort)))
+        _aggs_fields(body.get("aggs", {}), fields)
+        if "post_filter" in body:
+            _query_fields(body["post_filter"], fields)
+        if "script_fields" in body:
+            return None
+    except (UnknownFields, AttributeError, KeyError, TypeError, StopIteration):
+        return None
+    return fields
+
+
+def slim_compatible(body: dict, allowlist=DEFAULT_SLIM_FIELDS):
+    """
+    Whether the search request `body` can be answered from a slim index of `allowlist`.
+    """
+    fields = body_fields(body)
+    return fields is not None and all(covered(field, allowlist) for field in fields)
@@ -0,0 +1,148 @@
+"""
+Sorted runs: the parsed documents of a source, stored as compressed files of documents sorted by `_id` and partitioned
+by chromosome, so that sources can be merged by a sequential k-way merge of files instead of being written to and
+read back from MongoDB.
+
+The runs of a source are stored in its own folder, as "<partition>.<token>.run.gz" files (one set of files per upload
+job, so parallelized uploaders don't have to coordinate). A partition is a chromosome ("1".."22", "X", "Y", "MT",
+from the "chrN:" prefix of the `_id`) or "other" for any other `_id`.
+
+E.g.
+
+    with RunWriter(run_dir) as writer:
+        writer.extend(docs)
+        writer.commit()
+
+    for doc, ranks in merge_sources_runs([(run_dir, mapper), ...], partition="1"):
+        ...
+"""
+
+import glob
+import gzip
+import heapq
+import os
+import pickle
+import re
+import uuid
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable
+
+from utils.extsort import ExternalSorter, DEFAULT_MEMORY_LIMIT
+
+CHROM_PARTITIONS = [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]
+OTHER_PARTITION = "other"
+RUN_SUFFIX = ".run.gz"
+
+_PARTITION_PATTERN = re.compile("^chr(%s):" % "|".join(CHROM_PARTITIONS))
+
+
+def partition_of(_id: str):
+    match = _PARTITION_PATTERN.match(_id)
+    return match.group(1) if match else OTHER_PARTITION
+
+
+class RunWriter:
+    """
+    Collect the documents of a source and write them as sorted runs in `run_dir` when committed. Documents are
+    externally sorted by (partition, `_id`), using at most (roughly) `memory_limit` bytes of memory.
+    """
+    def __init__(self, run_dir: str, memory_limit: int = DEFAULT_MEMORY_LIMIT, compresslevel: int = 1):
+        self.run_dir = run_dir
+        self.compresslevel = compresslevel
+        os.makedirs(run_dir, exist_ok=True)
+        self._sorter = ExternalSorter(key=lambda doc: (partition_of(doc["_id"]), doc["_id"]),
+                                      memory_limit=memory_limit, tmp_dir=run_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, doc: dict):
+        self._sorter.add(doc)
+
+    def extend(self, docs: Iterable):
+        self._sorter.extend(docs)
+
+    def commit(self):
+        """
+        Write the runs, return the number of documents written per partition. Each run file is written under a
+        temporary name first, so readers never see a partial run.
+        """
+        token = uuid.uuid4().hex[:12]
+        counts = {}
+        for partition, docs in groupby(self._sorter.sorted(), key=lambda doc: partition_of(doc["_id"])):
+            path = os.path.join(self.run_dir, "%s.%s%s" % (partition, token, RUN_SUFFIX))
+            with gzip.open(path + ".tmp", "wb", compresslevel=self.compresslevel) as run_file:
+                pickler = pickle.Pickler(run_file, protocol=pickle.HIGHEST_PROTOCOL)
+                counts[partition] = 0
+                for doc in docs:
+                    pickler.dump(doc)
+                    pickler.clear_memo()
+                    counts[partition] += 1
+            os.rename(path + ".tmp", path)
+        return counts
+
+    def close(self):
+        self._sorter.close()
+
+
+def run_paths(run_dir: str, partition: str):
+    return sorted(glob.glob(os.path.join(run_dir, "%s.*%s" % (partition, RUN_SUFFIX))))
+
+
+def has_runs(run_dir: str):
+    return bool(glob.glob(os.path.join(run_dir, "*" + RUN_SUFFIX)))
+
+
+def read_run(path: str):
+    with gzip.open(path, "rb") as run_file:
+        unpickler = pickle.Unpickler(run_file)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+def read_source_runs(run_dir: str, partition: str):
+    """
+    The documents of a source in `partition`, sorted by `_id`, from all its runs. When an `_id` is found more than
+    once, only the first document is kept (as a storage ignoring duplicates would do).
+    """
+    runs = [read_run(path) for path in run_paths(run_dir, partition)]
+    docs = heapq.merge(*runs, key=itemgetter("_id"))
+    for _, group in groupby(docs, key=itemgetter("_id")):
+        yield next(group)
+
+
+def merge_sources_runs(sources: list, partition: str):
+    """
+    k-way merge the runs of `sources`, a list of (run_dir, mapper) pairs in merge order, into merged documents of
+    `partition`, sorted by `_id`. Each source's documents go through its mapper (if any, and which must keep them
+    sorted), then the documents sharing an `_id` are merged key by key, later sources overriding earlier ones, like
+    successive `$set` updates would.
+
+    Yield (doc, ranks) tuples, `ranks` being the positions in `sources` of the sources the document was merged from.
+    """
+    def ranked(docs, rank):
+        for doc in docs:
+            yield doc["_id"], rank, doc
+
+    streams = []
+    for rank, (run_dir, mapper) in enumerate(sources):
+        docs = read_source_runs(run_dir, partition)
+        if mapper is not None:
+            mapper.load()
+            docs = mapper.process(docs)
+        streams.append(ranked(docs, rank))
+
+    for _, group in groupby(heapq.merge(*streams, key=itemgetter(0, 1)), key=itemgetter(0)):
+        merged = {}
+        ranks = []
+        for _, rank, doc in group:
+            merged.update(doc)
+            ranks.append(rank)
+        yield merged, ranks
@@ -3,18 +3,10 @@ from elasticsearch import Elasticsearch
 
 
 def update_stats(idxer: ESIndexer, assembly):
-    # compute stats
-    stats = dict()
-    stats["total"] = idxer.count()
-    for k in [assembly, "observed", "vcf"]:
-        q = {"query": {"exists": {"field": k}}}
-        stats[k] = idxer._es.count(index=idxer._index, doc_type=idxer._doc_type, body=q)["count"]
-
-    # now update _meta.stats
-    m = idxer.get_mapping_meta()
-    m["_meta"].get("stats", {}).update(stats)
-    idxer.update_mapping_meta(m)
-    return m["_meta"]["stats"]
+    # compute stats, and update _meta.stats
+    mapping_service = ESMappingMetaStatsService(client=idxer._es, index_name=idxer._index)
+    stats, _ = mapping_service.update_mapping_meta_stats(assembly=assembly)
+    return stats
 
 
 class ESReleaseException(Exception):
@@ -42,12 +34,46 @@ class ESMappingMetaStatsService:
         if release < required_min_release:
             raise ESReleaseException(f"Required ES minimum release is {required_min_release}, found version {version} installed.")
 
-    def update_mapping_meta_stats(self, assembly):
+    # top-level fields of the mapping which are not data sources
+    NON_SOURCE_FIELDS = {"chrom", "observed", "vcf", "hg19", "hg38", "_seqhashed", "genomic_key", "popfreq"}
+
+    def refresh(self, timeout="10m"):
+        """
+        Make all the documents indexed so far visible to searches (instead of waiting for the periodic refresh),
+        then wait for the index's primary shards to be allocated.
         """
-        Update the "stats" entry inside the "_meta" field of the index's mapping. Return the updated "meta._stats" field of the mapping.
+        self.client.indices.refresh(index=self.index_name)
+        self.client.cluster.health(index=self.index_name, wait_for_status="yellow", timeout=timeout)
+
+    def compute_stats(self, assembly, sources=()):
+        """
+        Count the documents of the index, and the documents having each of the `assembly`, "observed" and "vcf"
+        fields, and each of the `sources` root fields, in one request (a "filters" aggregation).
+        Return a tuple of (stats, source stats).
+        """
+        fields = [assembly, "observed", "vcf"]
+        filters = {field: {"exists": {"field": field}} for field in fields + list(sources)}
+        body = {
+            "size": 0,
+            "track_total_hits": True,
+            "aggs": {"stats": {"filters": {"filters": filters}}}
+        }
+        response = self.client.search(index=self.index_name, body=body)
+        buckets = response["aggregations"]["stats"]["buckets"]
+
+        stats = {"total": response["hits"]["total"]["value"]}
+        stats.update({field: buckets[field]["doc_count"] for field in fields})
+        src_stats = {src: buckets[src]["doc_count"] for src in sources}
+        return stats, src_stats
+
+    def update_mapping_meta_stats(self, assembly, refresh=True):
+        """
+        Update the "stats" entry inside the "_meta" field of the index's mapping, and its "src_stats" entry (number of
+        documents per source). Return the updated "_meta.stats" and "_meta.src_stats" fields of the mapping.
 
         Args:
             assembly (str): a string of "hg19" or "hg38"
+            refresh (bool): refresh the index first, so that all indexed documents are counted
         """
 
         """
@@ -75,19 +101,22 @@ class ESMappingMetaStatsService:
 
         The goal here is to update the "stats" field inside.
         """
-
-        stats = dict()
-        stats["total"] = self.client.count(index=self.index_name)["count"]
-        for field in [assembly, "observed", "vcf"]:
-            body = {"query": {"exists": {"field": field}}}
-            stats[field] = self.client.count(index=self.index_name, body=body)["count"]
+        if refresh:
+            self.refresh()
 
         mapping = self.client.indices.get_mapping(index=self.index_name)
-        meta = mapping[self.index_name]["mappings"]["_meta"]  # Get the current meta field from mapping
+        mappings = mapping[self.index_name]["mappings"]
+        # data sources are the top-level object fields, e.g. "dbsnp", "cadd"
+        sources = sorted(field for field, field_mapping in mappings.get("properties", {}).items()
+                         if "properties" in field_mapping and field not in self.NON_SOURCE_FIELDS and field != assembly)
+        stats, src_stats = self.compute_stats(assembly, sources)
+
+        meta = mappings["_meta"]  # Get the current meta field from mapping
         meta.get("stats", {}).update(stats)  # Update the meta content
+        meta["src_stats"] = src_stats
         self.client.indices.put_mapping(body={"_meta": meta}, index=self.index_name)  # Write the modified meta to ES mapping
 
-        return meta["stats"]
+        return meta["stats"], meta["src_stats"]
 
 
 class BuildDocMetaStatsService:
@@ -96,9 +125,10 @@ class BuildDocMetaStatsService:
         self.build_name = build_name
         self.logger = logger
 
-    def update_build_meta_stats(self, meta_stats):
+    def update_build_meta_stats(self, meta_stats, src_stats=None):
         """
-        Update the "stats" entry inside the "_meta" field of the build doc. Return the updated "meta._stats" field of the build_doc.
+        Update the "stats" entry inside the "_meta" field of the build doc, and its "src_stats" entry if given. Return the updated
+        "meta._stats" field of the build_doc.
         """
         build_doc = self.src_build.find_one({"_id": self.build_name})
 
@@ -107,6 +137,8 @@ class BuildDocMetaStatsService:
                              f"before post-index")
 
         build_doc["_meta"].get("stats", {}).update(meta_stats)
+        if src_stats is not None:
+            build_doc["_meta"]["src_stats"] = src_stats
 
         result = self.src_build.replace_one({"_id": self.build_name}, build_doc)
         if result.matched_count != 1:
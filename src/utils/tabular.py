@@ -0,0 +1,171 @@
+"""
+A declarative engine for tabular (TSV/CSV) sources.
+
+A source declares its columns, in file order, as a list of `TableColumn`s whose `dest` are dotfield paths inside the
+source's root field (`None` entries mark ignored columns). `TabularMapper` compiles the declaration once into a
+positional row => nested doc function, with NA values dropped and numeric strings converted, instead of each parser
+hand-writing a `fields[i]` dict literal and sweeping/converting it afterwards with generic recursive helpers.
+
+E.g.
+
+    COLUMNS = [
+        TableColumn(name="#Chrom", dest="chrom", tag="chrom"),
+        TableColumn(name="Pos", dest="pos", tag="pos"),
+        None,  # ignored column
+        TableColumn(name="PHRED", dest="phred", transform=float),
+    ]
+    mapper = TabularMapper(root="cadd", columns=COLUMNS, na_values={"NA"})
+    mapper(["1", "10001", "T", "0.12"])  # => {"chrom": 1, "pos": 10001, "phred": 0.12}
+"""
+
+import csv
+import gzip
+from itertools import groupby
+from typing import Callable, Iterable
+
+from utils.table import TableColumn, create_tag_column_map
+
+DEFAULT_NA_VALUES = frozenset({""})
+
+
+def to_number(value: str):
+    """
+    Convert a numeric string to int or float, return any other value as-is.
+    Same rule as `biothings.utils.dataload.value_convert_to_number()`.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def number_or_list(sep: str):
+    """
+    Numeric conversion first, then split the non-numeric strings containing `sep` into lists (trailing separators
+    ignored), as `value_convert_to_number()` followed by `biothings.utils.dataload.list_split()` would do.
+    """
+    def _convert(value: str):
+        value = to_number(value)
+        if isinstance(value, str) and len(value.split(sep)) > 1:
+            return value.rstrip().rstrip(sep).split(sep)
+        return value
+
+    return _convert
+
+
+class TabularMapper:
+    """
+    Compiled mapping of positional rows to nested docs.
+
+    For each declared column, a non-NA value is passed to the column's `transform`; when the result is still a string,
+    it is then passed to `convert` (numeric conversion by default). Values transformed to None are dropped, and so are
+    nested fields left empty.
+    """
+    def __init__(self, root: str, columns: list, na_values: Iterable = DEFAULT_NA_VALUES,
+                 convert: Callable = to_number, strict: bool = True):
+        self.root = root
+        self.columns = list(columns)
+        self.na_values = frozenset(na_values)
+        self.convert = convert or TableColumn.identity_function
+        self.strict = strict  # rows must have exactly one field per declared column
+
+        self.tag_column_map = create_tag_column_map([c for c in self.columns if c is not None])
+        self._index = {id(c): i for i, c in enumerate(self.columns) if c is not None}
+        # (position, parent path, leaf key, transform), in file order
+        self._plan = []
+        for i, column in enumerate(self.columns):
+            if column is None:
+                continue
+            *parents, leaf = column.dest.split(".")
+            self._plan.append((i, tuple(parents), leaf, column.transform))
+
+    def __len__(self):
+        return len(self.columns)
+
+    def index_of(self, tag: str):
+        """
+        Position of the (first) column tagged `tag`.
+        """
+        return self._index[id(self.tag_column_map[tag][0])]
+
+    def getter(self, *tags: str):
+        """
+        A function returning the raw values of the columns tagged `tags` from a row, e.g. to build `_id`s.
+        """
+        indices = [self.index_of(tag) for tag in tags]
+        return lambda row: [row[i] for i in indices]
+
+    def __call__(self, row: list):
+        if self.strict and len(row) != len(self.columns):
+            raise ValueError("Expecting %d fields, got %d" % (len(self.columns), len(row)))
+
+        doc = {}
+        na_values, convert = self.na_values, self.convert
+        for i, parents, leaf, transform in self._plan:
+            value = row[i]
+            if value in na_values:
+                continue
+            value = transform(value)
+            if isinstance(value, str):
+                value = convert(value)
+            if value is None:
+                continue
+            node = doc
+            for key in parents:
+                node = node.setdefault(key, {})
+            node[leaf] = value
+        return doc
+
+    def to_doc(self, row: list, _id: str):
+        return {"_id": _id, self.root: self(row)}
+
+
+def merge_duplicates(docs: Iterable, root: str):
+    """
+    Merge consecutive docs sharing the same `_id`, the way `biothings.utils.dataload.merge_duplicate_rows()` does:
+    over the keys of all the docs, a key missing from the first doc takes the value of the first following doc
+    having it, and a key having different values in the following docs becomes the list of these values.
+    """
+    for _, group in groupby(docs, key=lambda doc: doc["_id"]):
+        first_doc, *others = group
+        first = first_doc[root]
+        keys = list(dict.fromkeys(key for doc in [first_doc, *others] for key in doc[root]))
+        for doc in others:
+            other = doc[root]
+            for key in keys:
+                if key not in other:
+                    continue
+                if key not in first:
+                    first[key] = other[key]
+                elif other[key] != first[key]:
+                    values = first[key]
+                    if not isinstance(values, list):
+                        values = [values]
+                    values.append(other[key])
+                    first[key] = values
+        yield first_doc
+
+
+def open_text(path: str, encoding: str = "utf-8"):
+    """
+    Open a plain, gzip or bgzip (multi-member gzip) file as text.
+    """
+    if path.endswith((".gz", ".bgz")):
+        return gzip.open(path, "rt", encoding=encoding, newline="")
+    return open(path, encoding=encoding, newline="")
+
+
+def iter_rows(path: str, delimiter: str = "\t", encoding: str = "utf-8", comment: str = None, skip_lines: int = 0,
+              **reader_kwargs):
+    """
+    Stream the rows of a tabular file, skipping its first `skip_lines` lines and the lines starting with `comment`.
+    `reader_kwargs` are passed to `csv.reader()`.
+    """
+    with open_text(path, encoding=encoding) as in_f:
+        for _ in range(skip_lines):
+            next(in_f, None)
+        lines = (line for line in in_f if not line.startswith(comment)) if comment else in_f
+        yield from csv.reader(lines, delimiter=delimiter, **reader_kwargs)
@@ -1,6 +1,7 @@
-from tornado.web import RequestHandler
+from tornado.web import HTTPError, RequestHandler
 
 from biothings.web.handlers import (
+    BaseAPIHandler,
     MetadataFieldHandler,
     MetadataSourceHandler)
 
@@ -18,3 +19,22 @@ class MVMetadataFieldHandler(AssemblyAwareMixin, MetadataFieldHandler):
 
 class MVMetadataSourceHandler(AssemblyAwareMixin, MetadataSourceHandler):
     pass
+
+
+class GeneSummaryHandler(BaseAPIHandler):
+    """
+    GET /v1/gene-summary/<gene>
+
+    The variant summary of a gene, by symbol or Entrez id, precomputed by the hub (see utils.genesummary).
+    """
+    name = "gene_summary"
+
+    async def get(self, gene):
+        index = self.biothings.config.ES_GENE_SUMMARY_INDICES[self.args.assembly]
+        field = "entrezgene" if gene.isdigit() else "symbol"
+        res = await self.biothings.elasticsearch.async_client.search(
+            index=index, body={"query": {"term": {field: gene}}}, size=10)
+        hits = [dict(hit["_source"], _id=hit["_id"]) for hit in res["hits"]["hits"]]
+        if not hits:
+            raise HTTPError(404, reason=f"No summary found for gene '{gene}'.")
+        self.finish(hits[0] if len(hits) == 1 else hits)
@@ -0,0 +1,149 @@
+"""
+"Lazy" sources: sub-documents computed at query time from local files instead of being stored in the index.
+
+CADD (116 columns) is one of the heaviest sub-documents of the hg19 index while most queries don't request it.
+With `LazyCaddQueryBackend`, the "cadd" field of the hits is read from the local bgzipped/tabix CADD file, with
+the same mapping as the CADD parser, whenever the requested fields include it. To enable it, in config_web:
+
+    ES_QUERY_BACKEND = "web.lazy.LazyCaddQueryBackend"
+
+and set the CADD_TABIX_FILE environment variable to the path of the CADD file (pysam must be installed).
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
+from utils.cadd import map_line_to_json
+from utils.hgvs import get_hgvs_from_vcf
+from utils.posindex import POS_PATTERN
+from utils.tabular import merge_duplicates
+from web.pipeline import MVQueryBackend, iter_hits
+
+
+def requested_fields(source, root: str):
+    """
+    From the `_source` option (the "fields" parameter), decide whether sub-document `root` is requested.
+    Return None if it's not, True if all of it is, or the list of requested "root.*" fields.
+    """
+    if source is None or source is True:
+        return True
+    excludes = [field[1:] for field in source if field.startswith("-")]
+    if any(fnmatch(root, field) for field in excludes):
+        return None
+    includes = [field for field in source if not field.startswith("-")]
+    if not includes or "all" in includes or any(fnmatch(root, field) for field in includes):
+        return True
+    fields = [field for field in includes if field.startswith(root + ".")]
+    return fields or None
+
+
+def select_fields(doc: dict, fields: list, prefix: str):
+    """
+    The part of `doc` (found under dotfield `prefix`) matching any of the dotfield patterns in `fields`.
+    """
+    selected = {}
+    for key, value in doc.items():
+        path = prefix + "." + key
+        if any(path == field or path.startswith(field + ".") or fnmatch(path, field) for field in fields):
+            selected[key] = value
+        elif isinstance(value, dict):
+            value = select_fields(value, fields, path)
+            if value:
+                selected[key] = value
+    return selected
+
+
+class CaddTabixSource:
+    """
+    Build "cadd" sub-documents of variants from a bgzipped, tabix-indexed CADD file.
+    Lookups are run by a pool of `max_workers` threads (each with its own tabix handle), by batches of `batch_size`
+    variants sorted by position.
+    """
+    root = "cadd"
+
+    def __init__(self, path: str, max_workers=4, batch_size=100):
+        # only needed when CADD is served from the tabix file
+        try:
+            import pysam
+        except ImportError as e:
+            raise ImportError("pysam is required to serve CADD from the tabix file (web.lazy.LazyCaddQueryBackend), "
+                              "install it with `pip install 'pysam>=0.8.1'`") from e
+
+        self.pysam = pysam
+        self.path = path
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cadd_tabix")
+        self._local = threading.local()
+
+    def _tabix(self):
+        # tabix handles can't be shared between threads
+        if not hasattr(self._local, "tabix"):
+            self._local.tabix = self.pysam.TabixFile(self.path)
+        return self._local.tabix
+
+    @staticmethod
+    def _position(hgvs_id: str):
+        match = POS_PATTERN.match(hgvs_id)
+        return (match.group(1), int(match.group(2))) if match else None
+
+    def lookup(self, hgvs_ids):
+        """
+        Return a dict of {hgvs_id: cadd_doc} for the ids found in the CADD file.
+        """
+        tabix = self._tabix()
+        contigs = set(tabix.contigs)
+        positions = sorted((pos, hgvs_id) for hgvs_id, pos in ((_id, self._position(_id)) for _id in hgvs_ids) if pos)
+        result = {}
+        for (chrom, pos), hgvs_id in positions:
+            if chrom not in contigs:
+                continue
+            # the VCF position of an indel is the base before its HGVS start
+            rows = (line.split("\t") for line in tabix.fetch(chrom, max(pos - 2, 0), pos))
+            rows = (row for row in rows if get_hgvs_from_vcf(row[0], row[1], row[2], row[4]) == hgvs_id)
+            docs = (doc for row in rows for doc in map_line_to_json(row))
+            for doc in merge_duplicates(docs, self.root):
+                result[hgvs_id] = doc[self.root]
+        return result
+
+    async def annotate(self, hgvs_ids):
+        hgvs_ids = list(dict.fromkeys(hgvs_ids))
+        loop = asyncio.get_running_loop()
+        batches = [hgvs_ids[i:i + self.batch_size] for i in range(0, len(hgvs_ids), self.batch_size)]
+        result = {}
+        for batch_result in await asyncio.gather(*(loop.run_in_executor(self.executor, self.lookup, batch)
+                                                   for batch in batches)):
+            result.update(batch_result)
+        return result
+
+
+class LazyCaddQueryBackend(MVQueryBackend):
+    """
+    Query backend adding the "cadd" field to hg19 hits from the local CADD file, see module docstring.
+    """
+    CADD_TABIX_FILE = os.environ.get("CADD_TABIX_FILE")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.CADD_TABIX_FILE:
+            raise ValueError("CADD_TABIX_FILE must be set to serve CADD from the tabix file")
+        self.cadd = CaddTabixSource(self.CADD_TABIX_FILE)
+
+    async def execute(self, query, **options):
+        response = await super().execute(query, **options)
+
+        fields = requested_fields(options.get("_source"), self.cadd.root)
+        if options.get("assembly") == "hg38" or fields is None:
+            return response
+
+        hits = [hit for hit in iter_hits(response) if self.cadd.root not in hit.get("_source", {})]
+        cadd_docs = await self.cadd.annotate(hit["_id"] for hit in hits)
+        for hit in hits:
+            cadd_doc = cadd_docs.get(hit["_id"])
+            if cadd_doc and fields is not True:
+                cadd_doc = select_fields(cadd_doc, fields, self.cadd.root)
+            if cadd_doc:
+                hit.setdefault("_source", {})[self.cadd.root] = cadd_doc
+        return response
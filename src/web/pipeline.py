@@ -1,9 +1,18 @@
+import os
 import re
+import time
 from typing import Dict, Optional
 
-from elasticsearch_dsl import Search
+from elasticsearch import NotFoundError
+from elasticsearch_dsl import MultiSearch, Search
 from biothings.web.query import ESQueryBuilder, AsyncESQueryBackend
 
+from utils.docvalues import docvalue_fields, docvalue_source
+from utils.genomickey import GENOMIC_KEY_FIELD, genomic_key
+from utils.idfilter import ID_FILTER_SUFFIX, BloomFilter, definitely_absent
+from utils.routing import OTHER_PARTITION, chrom_routing, id_routing
+from utils.slim import DEFAULT_SLIM_FIELDS, SLIM_SUFFIX, slim_compatible
+
 
 INTERVAL_PATTERN = re.compile(
     r"""
@@ -26,6 +35,18 @@ INTERVAL_PATTERN = re.compile(
 
 
 class MVQueryBuilder(ESQueryBuilder):
+    # when the indices are routed by chromosome (see utils.routing), send the queries bound to a chromosome
+    # to its shards only, see ChromRoutingQueryBuilder
+    CHROM_ROUTING = False
+    # fields in which an HGVS id can only match the document of that `_id`
+    ID_SCOPES = {"_id", "clingen.caid"}
+    # request the fields from doc values instead of `_source` when they all are scalar fields stored in doc values,
+    # see utils.docvalues and DocValueQueryBuilder
+    DOCVALUE_FIELDS = False
+    # tiebreaker of the position-ordered interval queries, so their `search_after` pages are stable
+    # (sorting on `_id` needs indices.id_field_data.enabled on ES 8)
+    SORT_TIEBREAKER = "_id"
+
     @staticmethod
     def _parse_interval_query(q: str) -> Optional[Dict[str, str]]:
         """
@@ -87,6 +108,15 @@ class MVQueryBuilder(ESQueryBuilder):
         r['query'] = ' AND '.join(query)
         return r
 
+    def _genomic_key_field(self, assembly, options):
+        """
+        The genomic key field of `assembly` if the queried index has genomic keys (see utils.genomickey), else None.
+        """
+        if self.metadata is None:
+            return None
+        mappings = self.metadata.get_mappings('hg38' if assembly == 'hg38' else options.biothing_type)
+        return f"{GENOMIC_KEY_FIELD}.{assembly}" if GENOMIC_KEY_FIELD in (mappings or {}) else None
+
     def default_string_query(self, q, options):
 
         match = self._parse_interval_query(q)
@@ -94,23 +124,231 @@ class MVQueryBuilder(ESQueryBuilder):
             search = Search()
             if match['query'] != '':
                 search = search.query("query_string", query=match['query'])
-            search = search.filter('match', chrom=match['chr'])
             assembly = 'hg38' if options.assembly == 'hg38' else 'hg19'
-            search = search.filter('range', **{assembly + ".start": {"lte": match['gend']}})
+            key_field = self._genomic_key_field(assembly, options)
+            if key_field:
+                # one range on the index sort field, for the chromosome and the start,
+                # hits in position order unless sorted otherwise
+                gend = int(match['gend'].replace(',', ''))
+                search = search.filter('range', **{key_field: {"gte": genomic_key(match['chr'], 0),
+                                                               "lte": genomic_key(match['chr'], gend)}})
+                if match['query'] == '':
+                    # a position-ordered scan, paged with `search_after` (the sort values of the last hit),
+                    # without counting all the hits of the interval
+                    search = search.sort(key_field, self.SORT_TIEBREAKER).extra(track_total_hits=False)
+            else:
+                search = search.filter('match', chrom=match['chr'])
+                search = search.filter('range', **{assembly + ".start": {"lte": match['gend']}})
             search = search.filter('range', **{assembly + ".end": {"gte": match['gstart']}})
+            if self.CHROM_ROUTING:
+                search = search.params(routing=chrom_routing(match['chr']))
 
         else:  # default query
             search = super().default_string_query(q, options)
 
         return search
 
+    def _build_match_query(self, q, scopes, options):
+        search = super()._build_match_query(q, scopes, options)
+        if self.CHROM_ROUTING and isinstance(q, str):
+            # `_id` lookup of an HGVS id, e.g. from the annotation endpoint
+            scopes = {scopes} if isinstance(scopes, str) else set(scopes)
+            routing = id_routing(q)
+            if "_id" in scopes and scopes <= self.ID_SCOPES and routing != OTHER_PARTITION:
+                search = search.params(routing=routing)
+        return search
+
+
+    def apply_extras(self, search, options):
+        search = super().apply_extras(search, options)
+        if options.search_after:
+            search = search.extra(search_after=options.search_after)
+        if self.DOCVALUE_FIELDS and self.metadata is not None:
+            mappings = self.metadata.get_mappings('hg38' if options.assembly == 'hg38' else options.biothing_type)
+            fields = docvalue_fields(options._source, mappings)
+            if fields:
+                # hits rebuilt by MVQueryBackend
+                search = search.source(False).extra(docvalue_fields=fields)
+        return search
+
+
+class ChromRoutingQueryBuilder(MVQueryBuilder):
+    """
+    Query builder of indices routed by chromosome (with the "routing" option of the indexer, see config_hub).
+    """
+    CHROM_ROUTING = True
+
+
+class DocValueQueryBuilder(MVQueryBuilder):
+    """
+    Query builder returning narrow projections of scalar fields from doc values, see utils.docvalues.
+    """
+    DOCVALUE_FIELDS = True
+
+
+def iter_hits(response):
+    """
+    Hits of a search response, or of a list of search responses (multi-search).
+    """
+    for res in (response if isinstance(response, list) else [response]):
+        try:
+            yield from res["hits"]["hits"]
+        except (KeyError, TypeError):
+            # failed search of a multi-search
+            continue
+
 
 class MVQueryBackend(AsyncESQueryBackend):
+    # send the queries only needing SLIM_FIELDS to the slim indices, see utils.slim. The slim index of an alias is
+    # the one of the index it points to, checked every SLIM_INDEX_CHECK_INTERVAL seconds.
+    SLIM_INDEX = False
+    SLIM_FIELDS = DEFAULT_SLIM_FIELDS
+    SLIM_INDEX_CHECK_INTERVAL = 60
+    # folder of the id filters of the indices ("<index>.idfilter", exported by the hub), to answer the searches of
+    # missing ids without ES, see utils.idfilter. The filter of an alias is swapped when it points to another index or
+    # when its file changes (extended by a sync), checked every ID_FILTER_CHECK_INTERVAL seconds.
+    ID_FILTER_FOLDER = os.environ.get("ID_FILTER_FOLDER")
+    ID_FILTER_CHECK_INTERVAL = 60
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # {index or alias: (concrete index, its id filter or None, mtime of its file, checked at)}
+        self.id_filters = {}
+        # {index or alias: (its slim index or None, checked at)}
+        self.slim_indices = {}
+
+    async def slim_index(self, index):
+        """
+        The slim index of the index `index` is (or points to), or the slim indices of comma-separated indices, None if
+        one of them has none.
+        """
+        slim_index, checked_at = self.slim_indices.get(index, (None, 0))
+        if time.monotonic() - checked_at < self.SLIM_INDEX_CHECK_INTERVAL:
+            return slim_index
+        slim_indices = []
+        for name in index.split(","):
+            try:
+                concrete_indices = list(await self.client.indices.get_alias(index=name))
+            except NotFoundError:
+                concrete_indices = [name]
+            slim_indices.extend(concrete_index + SLIM_SUFFIX for concrete_index in concrete_indices)
+        slim_index = ",".join(slim_indices)
+        if not await self.client.indices.exists(index=slim_index):
+            slim_index = None
+        self.slim_indices[index] = (slim_index, time.monotonic())
+        return slim_index
+
+    async def id_filter(self, index):
+        """
+        The id filter of the index `index` is (or points to), None if there's none.
+        """
+        concrete_index, bloom, mtime, checked_at = self.id_filters.get(index, (None, None, None, 0))
+        if time.monotonic() - checked_at < self.ID_FILTER_CHECK_INTERVAL:
+            return bloom
+        try:
+            concrete_indices = list(await self.client.indices.get_alias(index=index))
+        except NotFoundError:
+            concrete_indices = []
+        path = os.path.join(self.ID_FILTER_FOLDER, concrete_indices[0] + ID_FILTER_SUFFIX) \
+            if len(concrete_indices) == 1 else None
+        try:
+            current_mtime = os.stat(path).st_mtime if path else None
+        except FileNotFoundError:
+            current_mtime = None
+        if current_mtime is None:
+            bloom = None
+        elif concrete_indices[0] != concrete_index or current_mtime != mtime:
+            # saved files are replaced, never rewritten, so the previous filter stays valid until then
+            bloom = BloomFilter.load(path)
+        # replaced at once, searches use either filter, never one of another index
+        self.id_filters[index] = (concrete_indices[0] if bloom else None, bloom, current_mtime, time.monotonic())
+        return bloom
 
-    def execute(self, query, **options):
+    def _no_hits(self):
+        total = 0 if self.total_hits_as_int else {"value": 0, "relation": "eq"}
+        return {"took": 0, "timed_out": False, "hits": {"total": total, "max_score": None, "hits": []}}
+
+    @staticmethod
+    def _missing_id(body, bloom):
+        # a match query of an id (e.g. from the annotation endpoint) no document has
+        match = body.get("query", {}).get("multi_match")
+        return bool(match) and not body.get("aggs") and definitely_absent(bloom, match["query"], match["fields"])
+
+    async def _execute_known_ids(self, query, bloom, **options):
+        """
+        Execute `query` without its searches of missing ids, answered with no hits.
+        """
+        if isinstance(query, Search):
+            if self._missing_id(query.to_dict(), bloom):
+                return self._no_hits()
+            return await super().execute(query, **options)
+        # the request alternates the header and the body of each search
+        request = query.to_dict()
+        searches = list(zip(request[0::2], request[1::2]))
+        missing = [self._missing_id(body, bloom) for _, body in searches]
+        if not any(missing):
+            return await super().execute(query, **options)
+        remaining = MultiSearch()
+        for (header, body), is_missing in zip(searches, missing):
+            if not is_missing:
+                params = {key: value for key, value in header.items() if key != "index"}
+                remaining = remaining.add(Search(index=header.get("index")).update_from_dict(body).params(**params))
+        responses = iter(await super().execute(remaining, **options) if not all(missing) else [])
+        return [self._no_hits() if is_missing else next(responses) for is_missing in missing]
+
+    def adjust_index(self, original_index, query, **options):
+        if not self.SLIM_INDEX:
+            return original_index
+        if isinstance(query, MultiSearch):
+            # the request alternates the header and the body of each search
+            bodies = query.to_dict()[1::2]
+        elif isinstance(query, Search):
+            bodies = [query.to_dict()]
+        else:
+            return original_index
+        # resolved by execute()
+        slim_index, _ = self.slim_indices.get(original_index, (None, 0))
+        if slim_index and bodies and all(slim_compatible(body, self.SLIM_FIELDS) for body in bodies):
+            return slim_index
+        return original_index
+
+    async def execute(self, query, **options):
 
         # override index to query
         if options.get('assembly') == 'hg38':
             options['biothing_type'] = 'hg38'
 
-        return super().execute(query, **options)
+        if self.SLIM_INDEX and isinstance(query, (Search, MultiSearch)):
+            await self.slim_index(self.indices[options.get("biothing_type")])
+
+        bloom = None
+        if self.ID_FILTER_FOLDER and isinstance(query, (Search, MultiSearch)) \
+                and not (options.get("raw") or options.get("fetch_all")):
+            bloom = await self.id_filter(self.indices[options.get("biothing_type")])
+        if bloom is None:
+            response = await super().execute(query, **options)
+        else:
+            response = await self._execute_known_ids(query, bloom, **options)
+
+        for res in (response if isinstance(response, list) else [response]):
+            try:
+                hits = res["hits"]
+            except (KeyError, TypeError):
+                continue
+            if "total" not in hits:
+                # not counted (track_total_hits=False), at least the returned hits
+                count = len(hits["hits"])
+                hits["total"] = count if self.total_hits_as_int else {"value": count, "relation": "gte"}
+
+        # hits of docvalue_fields queries, see MVQueryBuilder.DOCVALUE_FIELDS
+        for hit in iter_hits(response):
+            if "_source" not in hit:
+                hit["_source"] = docvalue_source(hit.pop("fields", {}))
+        return response
+
+
+class SlimIndexQueryBackend(MVQueryBackend):
+    """
+    Query backend of indices with slim indices (with the "slim" option of the indexer, see config_hub).
+    """
+    SLIM_INDEX = True